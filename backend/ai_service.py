@@ -1,116 +1,288 @@
-import ollama
 import json
+import logging
+import os
+import re
+import time
+from functools import lru_cache
+from typing import Callable, Optional, Tuple
+
+from database import engine
+from device_registry import ALIASES, ALL_WORDS, BY_NUMBER, canonical_name, spoken_vocabulary
+from intent_classifier import IntentClassifier, qualified
+from json_stream import JSONObjectExtractor
+from metrics import intent_seconds, intents_total
+from semantic_cache import SemanticCache
+from session_context import DEFAULT_SESSION, SessionContextStore
+
+# Distinct normalized utterances remembered by the fast path
+FAST_PATH_CACHE_SIZE = 1024
+# Startup warm-up (SMART_HOME_WARMUP): "off" (default); "fast" primes the fast
+# path; "llm" also has Ollama load the model, so the first slow-path command
+# after a restart doesn't wait for it
+WARMUP = os.getenv("SMART_HOME_WARMUP", "off")
+# Seconds the "llm" warm-up waits for Ollama: a cold model load from disk can take minutes
+WARMUP_TIMEOUT = float(os.getenv("SMART_HOME_WARMUP_TIMEOUT", "300"))
+
+# "turn (on|off) (the) (location) (light|fan...|all|everything|number X)"
+# Built once from the device registry instead of on every command
+_FAST_PATH_RE = re.compile(
+    r"(turn|switch)\s+(on|off)\s+(?:the\s+)?(?:(\w+)\s+)?("
+    + "|".join(re.escape(word) for word in spoken_vocabulary())
+    + r"|number \d+|\d+)"
+)
+_NUMBER_RE = re.compile(r"\d+")
+_ALL_WORDS = frozenset(ALL_WORDS)
+
+logger = logging.getLogger("smart_home.ai")
+
+
+def normalize_command(command_text: str) -> str:
+    """Lowercases and collapses whitespace so equivalent phrasings share a cache entry."""
+    return " ".join(command_text.lower().split())
+
+
+@lru_cache(maxsize=FAST_PATH_CACHE_SIZE)
+def match_intent(command_text: str) -> Optional[Tuple[str, str, str, str]]:
+    """
+    Fast-path intent match on a normalized utterance.
+    Returns (action, action_word, device_type, location) or None when the
+    command needs the LLM. Pure function, so results are safe to cache.
+    """
+    match = _FAST_PATH_RE.search(command_text)
+    if not match:
+        return None
+
+    action_word = match.group(2)  # on/off
+    location = match.group(3) or "unknown"
+    device_raw = match.group(4)  # light/fan
+
+    # --- HANDLE NUMBERS --- "number 1" or "1"
+    num_match = _NUMBER_RE.search(device_raw)
+    if num_match and num_match.group(0) in BY_NUMBER:
+        device_raw = BY_NUMBER[num_match.group(0)]
+
+    # "the kitchen light": the word read as a location is part of the device's name
+    if f"{location} {device_raw}" in ALIASES:
+        device_raw = f"{location} {device_raw}"
+
+    # Normalize device names (fridge -> refrigerator, all/everything -> all)
+    device_raw = "all" if device_raw in _ALL_WORDS else canonical_name(device_raw)
+
+    action = "turn_on" if action_word == "on" else "turn_off"
+    return action, action_word, device_raw, location
+
 
 class AIService:
-    def __init__(self, model: str = "mistral"):
+    def __init__(self, model: str = "mistral", client=None, cache: SemanticCache = None,
+                 classifier: IntentClassifier = None):
         self.model = model
-        self.context = {} # Store conversation state: {'pending_action': ...}
+        # Anything with an ollama-compatible chat() (swapped for a stub in benchmarks);
+        # None imports the ollama package on first slow-path use
+        self._client = client
+        # Remembers parsed slow-path results; None disables caching
+        self.cache = cache
+        # Local model for near-miss phrasings, tried before the LLM; None disables it
+        self.classifier = classifier
+        # Conversation state per session: {'pending_offer': ...}
+        self.sessions = SessionContextStore()
+
+    @property
+    def client(self):
+        if self._client is None:
+            # Deferred: ollama (and httpx under it) is about a fifth of the app's import time
+            import ollama
+            self._client = ollama
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def warm_up(self):
+        """Primes the fast path with every "turn on/off the <device>" phrasing and loads the classifier."""
+        for word in spoken_vocabulary():
+            for action_word in ("on", "off"):
+                match_intent(f"turn {action_word} the {word}")
+        if self.classifier is not None:
+            self.classifier.load()
+
+    def load_model(self):
+        """
+        Imports the Ollama client and asks Ollama to load the model (a chat
+        with no messages). Blocking: run it off the event loop.
+        """
+        started = time.perf_counter()
+        try:
+            self.client.chat(model=self.model, messages=[])
+            logger.info("LLM warm-up: %s loaded in %.1f s", self.model, time.perf_counter() - started)
+        except Exception as e:
+            logger.warning("LLM warm-up failed: %s", e)
 
-    def process_command(self, command_text: str):
+    def process_command(self, command_text: str, session_id: str = DEFAULT_SESSION):
         """
         FAST PATH: pattern matching for milliseconds response.
         SLOW PATH: Ollama for complex queries.
         """
-        command_text = command_text.lower().strip()
+        result = self.resolve_fast(command_text, session_id)
+        if result is None:
+            result = self.resolve_slow(command_text)
+        return result
+
+    def resolve_fast(self, command_text: str, session_id: str = DEFAULT_SESSION):
+        """
+        Everything that doesn't need the LLM: yes/no follow-ups, the regex
+        fast path, the semantic cache and the local classifier. Returns None
+        when the LLM is needed. Commands qualified by a negation, an exception
+        or a time ("don't turn on the fan", "fan off in 10 minutes") skip the
+        regex and the classifier. Cheap enough to run directly on the event
+        loop. Follow-ups only see offers made to the same session_id.
+        """
+        started = time.perf_counter()
+        result, path = self._resolve_fast(command_text, session_id)
+        intents_total.inc(path)
+        intent_seconds.observe(time.perf_counter() - started, path)
+        return result
+
+    def _resolve_fast(self, command_text: str, session_id: str):
+        """resolve_fast, plus which tier answered: "followup", "fast", "cache", "classifier" or "miss"."""
+        command_text = normalize_command(command_text)
         
         # --- CONTEXT CHECK (Handling "Yes" / "No") ---
-        if self.context.get('pending_offer'):
+        if self.sessions.get_offer(session_id):
             if command_text in ["yes", "yeah", "sure", "please", "confirm"]:
-                action_to_do = self.context.pop('pending_offer')
+                action_to_do = self.sessions.pop_offer(session_id)
                 # Recursively process the confirmed action
-                return self.process_command(action_to_do)
+                if action_to_do:
+                    result, path = self._resolve_fast(action_to_do, session_id)
+                    return result, "followup" if result is not None else path
             elif command_text in ["no", "nah", "cancel"]:
-                self.context.pop('pending_offer')
+                self.sessions.pop_offer(session_id)
                 return {
                     "action": "none",
                     "response_text": "Okay, leaving it off."
-                }
-        
-        # --- FAST PATH (Regex) ---
-        import re
+                }, "followup"
         
-        # Pattern: "turn (on|off) (the) (light|fan...|all|everything|number X)"
-        # Regex to capture action and device
-        match = re.search(r"(turn|switch)\s+(on|off)\s+(?:the\s+)?(?:(\w+)\s+)?(light|fan|relay|tv|fridge|refrigerator|home theater|hometheater|ac|heater|all|everything|number \d+|\d+)", command_text)
-        
-        if match:
-            action_word = match.group(2) # on/off
-            location = match.group(3) or "unknown"
-            device_raw = match.group(4) # light/fan
-            
-            # --- HANDLE NUMBERS ---
-            number_map = {
-                '1': 'light',
-                '2': 'fan',
-                '3': 'kitchen light',
-                '4': 'refrigerator',
-                '5': 'tv',
-                '6': 'hometheater'
-            }
-            # Extract number if present "number 1" or "1"
-            import re as regex_lib
-            num_match = regex_lib.search(r"\d+", device_raw)
-            if num_match:
-                num = num_match.group(0)
-                if num in number_map:
-                    device_raw = number_map[num]
-
-            # Normalize device names
-            if device_raw in ["fridge", "refrigerator"]: device_raw = "refrigerator"
-            if device_raw in ["home theater", "hometheater"]: device_raw = "hometheater"
-            
-            action = "turn_on" if action_word == "on" else "turn_off"
-            print(f"⚡ FAST PATH TRIGGERED: {action} {device_raw}")
-
-            # --- HANDLE ALL ---
-            if device_raw in ["all", "everything"]:
-                return {
-                    "action": action,
-                    "device_type": "all",
-                    "location": "all",
-                    "response_text": f"OK, turning {action_word} everything."
-                }
-            
-            # Special Rule: TV -> Offer Home Theater
-            response_text = f"OK, turning {action_word} the {device_raw}."
-            
-            if device_raw == "tv" and action == "turn_on":
-                self.context['pending_offer'] = "turn on hometheater"
-                response_text = "TV is ON. Shall I turn on the Home Theater as well?"
-            
+        # --- QUALIFIED COMMANDS: "turn on" in "don't turn on the fan" is not the intent ---
+        local = not qualified(command_text)
+
+        # --- FAST PATH (Precompiled intent table + LRU cache) ---
+        intent = match_intent(command_text) if local else None
+
+        if intent:
+            action, action_word, device_raw, location = intent
+            logger.debug("Fast path: %s %s", action, device_raw)
+            return self._device_intent(action, device_raw, location, session_id), "fast"
+
+        # --- SEMANTIC CACHE (phrasings the LLM already answered; qualified ones only verbatim) ---
+        if self.cache is not None:
+            cached = self.cache.get(command_text, fuzzy=local)
+            if cached is not None:
+                logger.debug("Semantic cache hit: %s", command_text)
+                return cached, "cache"
+
+        # --- LOCAL CLASSIFIER ("lights on please", "kill the fan"); unsure means LLM ---
+        if self.classifier is not None and local:
+            predicted = self.classifier.classify(command_text)
+            if predicted is not None:
+                action, device_raw, confidence = predicted
+                logger.debug("Classifier: %s %s (%.2f)", action, device_raw, confidence)
+                return self._device_intent(action, device_raw, "unknown", session_id), "classifier"
+
+        return None, "miss"
+
+    def _device_intent(self, action: str, device_raw: str, location: str, session_id: str) -> dict:
+        action_word = "on" if action == "turn_on" else "off"
+
+        # --- HANDLE ALL ---
+        if device_raw == "all":
             return {
                 "action": action,
-                "device_type": device_raw,
-                "location": location,
-                "response_text": response_text
+                "device_type": "all",
+                "location": "all",
+                "response_text": f"OK, turning {action_word} everything."
             }
 
+        # Special Rule: TV -> Offer Home Theater
+        response_text = f"OK, turning {action_word} the {device_raw}."
+
+        if device_raw == "tv" and action == "turn_on":
+            self.sessions.set_offer(session_id, "turn on hometheater")
+            response_text = "TV is ON. Shall I turn on the Home Theater as well?"
+
+        return {
+            "action": action,
+            "device_type": device_raw,
+            "location": location,
+            "response_text": response_text
+        }
+
+    def resolve_slow(self, command_text: str, on_token: Optional[Callable[[str], None]] = None):
+        """
+        SLOW PATH: blocking Ollama inference. Run it off the event loop.
+        With on_token, the completion is streamed: every chunk is passed to
+        on_token and generation stops as soon as the JSON intent is complete.
+        """
+        command_text = normalize_command(command_text)
+
         # --- SLOW PATH (LLM) ---
-        print(f"🐢 SLOW PATH (LLM) TRIGGERED: {command_text}")
+        logger.debug("Slow path (LLM): %s", command_text)
         prompt = f"""
         Extract intent from: "{command_text}".
         Return JSON with: action ("turn_on", "turn_off"), device_type, location, response_text.
         """
+        messages = [{'role': 'user', 'content': prompt}]
         
         try:
-            response = ollama.chat(model=self.model, messages=[
-                {'role': 'user', 'content': prompt},
-            ])
-            content = response['message']['content']
-            # Clean up potential markdown code blocks
-            content = content.replace("```json", "").replace("```", "").strip()
-            # Find the first { and last }
-            start = content.find('{')
-            end = content.rfind('}') + 1
-            if start != -1 and end != -1:
-                return json.loads(content[start:end])
+            started = time.perf_counter()
+            if on_token is None:
+                response = self.client.chat(model=self.model, messages=messages)
+                result = self._parse_intent(response['message']['content'])
             else:
-                 return {"action": "error", "response_text": "Could not parse AI response."}
+                result = self._stream_intent(messages, on_token)
+            latency = time.perf_counter() - started
+
+            if result is None:
+                intents_total.inc("error")
+                return {"action": "error", "response_text": "Could not parse AI response."}
+            intents_total.inc("slow")
+            intent_seconds.observe(latency, "slow")
+            if self.cache is not None:
+                # Only valid turn_on/turn_off intents are kept
+                self.cache.put(command_text, result, latency)
+            return result
         except Exception as e:
-            print(f"Error calling Ollama: {e}")
+            logger.error("Error calling Ollama: %s", e)
+            intents_total.inc("error")
             return {
                 "action": "error",
                 "response_text": "I'm sorry, I couldn't process that command."
             }
 
-ai_service = AIService()
+    @staticmethod
+    def _parse_intent(content: str):
+        # Clean up potential markdown code blocks
+        content = content.replace("```json", "").replace("```", "").strip()
+        # Find the first { and last }
+        start = content.find('{')
+        end = content.rfind('}') + 1
+        if start == -1 or end == 0:
+            return None
+        return json.loads(content[start:end])
+
+    def _stream_intent(self, messages, on_token: Callable[[str], None]):
+        extractor = JSONObjectExtractor()
+        stream = self.client.chat(model=self.model, messages=messages, stream=True)
+        try:
+            for chunk in stream:
+                piece = chunk['message']['content']
+                on_token(piece)
+                if extractor.feed(piece) is not None:
+                    # Intent is complete; don't wait for the rest of the generation
+                    break
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        return extractor.result
+
+ai_service = AIService(cache=SemanticCache(engine), classifier=IntentClassifier())
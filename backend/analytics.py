@@ -0,0 +1,357 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, OperationalError, SQLAlchemyError
+from sqlmodel import Session
+
+from device_registry import lookup
+from models import DeviceLog, DeviceUsage, UsageCursor
+
+PERIODS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+GRANULARITIES = ("total", "day", "hour")
+# Raw DeviceLog rows older than this are deleted once rolled up (0 keeps them forever)
+RAW_RETENTION_DAYS = int(os.getenv("SMART_HOME_LOG_RETENTION_DAYS", "30"))
+# Hourly buckets kept this long; daily buckets are kept forever
+HOURLY_RETENTION_DAYS = int(os.getenv("SMART_HOME_HOURLY_RETENTION_DAYS", "90"))
+# Seconds between retention passes
+MAINTENANCE_INTERVAL = 3600.0
+# Raw rows read per backfill step, and deleted per retention transaction (short write locks)
+CHUNK_SIZE = 50_000
+# UsageCursor row marking a database whose log has been rolled up (not a device name)
+ROLLED_UP = "*rolled-up*"
+
+logger = logging.getLogger("smart_home.analytics")
+
+# Bucket arithmetic runs on seconds since EPOCH (naive UTC), far cheaper than datetime.replace
+EPOCH = datetime(1970, 1, 1)
+PERIOD_SECONDS = {"hour": 3600, "day": 86400}
+
+# (device_type, period, bucket start in seconds since EPOCH) -> [on_seconds, switch_ons]
+Buckets = Dict[Tuple[str, str, float], List]
+
+
+def bucket_start(ts: datetime, period: str) -> datetime:
+    if period == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def bucket_end(ts: datetime, period: str) -> datetime:
+    """Smallest bucket boundary at or after ts."""
+    start = bucket_start(ts, period)
+    return start if start == ts else start + PERIODS[period]
+
+
+def split_interval(start: datetime, end: datetime, period: str) -> Iterator[Tuple[datetime, float]]:
+    """(bucket start, seconds of [start, end) inside it) for every bucket the interval touches."""
+    bucket = bucket_start(start, period)
+    while bucket < end:
+        following = bucket + PERIODS[period]
+        seconds = (min(end, following) - max(start, bucket)).total_seconds()
+        if seconds > 0:
+            yield bucket, seconds
+        bucket = following
+
+
+def _add_on_time(buckets: Buckets, device_type: str, start: float, end: float):
+    """Adds the on-interval [start, end) (seconds since EPOCH) to every bucket it overlaps."""
+    for period, size in PERIOD_SECONDS.items():
+        bucket = start - start % size
+        while bucket < end:
+            seconds = min(end, bucket + size) - max(start, bucket)
+            if seconds > 0:
+                buckets.setdefault((device_type, period, bucket), [0.0, 0])[0] += seconds
+            bucket += size
+
+
+def energy_kwh(device_type: str, on_seconds: float) -> Optional[float]:
+    spec = lookup(device_type)
+    return round(on_seconds * spec.watts / 3_600_000, 4) if spec and spec.watts else None
+
+
+class UsageAnalytics:
+    """
+    On-time per device, kept as hourly and daily rollups (DeviceUsage) that
+    grow with the number of devices and hours, not with the number of events.
+    - apply() runs inside the state writer's transaction, so each batch of
+      DeviceLog rows and its rollup increments commit together. A device's
+      current state and since when (UsageCursor) turns each off event into
+      an on-interval, split over the hours and days it spans.
+    - An interval that is still open (a device on right now) is added at
+      query time from the cursor, so reports are current to the second.
+    - Once rolled up, raw DeviceLog rows older than RAW_RETENTION_DAYS and
+      hourly buckets older than HOURLY_RETENTION_DAYS are deleted in chunks.
+      The latest row per device always stays, for restore_states.
+    Bucket times are UTC, like DeviceLog.timestamp.
+    """
+
+    def __init__(self, engine, raw_retention_days: int = RAW_RETENTION_DAYS,
+                 hourly_retention_days: int = HOURLY_RETENTION_DAYS,
+                 maintenance_interval: float = MAINTENANCE_INTERVAL, chunk_size: int = CHUNK_SIZE):
+        self.engine = engine
+        self.raw_retention_days = raw_retention_days
+        self.hourly_retention_days = hourly_retention_days
+        self.maintenance_interval = maintenance_interval
+        self.chunk_size = chunk_size
+        self._task: asyncio.Task = None
+
+        # Stats
+        self.events = 0
+        self.backfilled = 0
+        self.pruned_raw = 0
+        self.pruned_hourly = 0
+        self.queries = 0
+
+    async def start(self):
+        await run_in_threadpool(self.prepare)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def prepare(self):
+        """
+        Adds the DeviceLog index to databases created before it existed, and
+        rolls up the existing log the first time. Runs before the state writer
+        starts, so no event is applied twice. The whole backfill is one
+        transaction behind the ROLLED_UP marker: a crash leaves nothing half
+        done, and other workers starting alongside wait for it.
+        """
+        for index in DeviceLog.__table__.indexes:
+            index.create(self.engine, checkfirst=True)
+        with Session(self.engine) as session:
+            if session.get(UsageCursor, ROLLED_UP) is not None:
+                return
+        started = time.perf_counter()
+        try:
+            with Session(self.engine) as session:
+                session.add(UsageCursor(device_type=ROLLED_UP, state="off", since=datetime.utcnow()))
+                # Takes the write lock: a second worker blocks here, then fails
+                session.flush()
+                self.backfill(session)
+                session.commit()
+        except (IntegrityError, OperationalError):
+            self._wait_for_backfill()
+            return
+        if self.backfilled:
+            logger.info("Rolled up %d logged events in %.1f s", self.backfilled, time.perf_counter() - started)
+
+    def _wait_for_backfill(self):
+        logger.info("Another worker is rolling up the state log, waiting")
+        while True:
+            with Session(self.engine) as session:
+                if session.get(UsageCursor, ROLLED_UP) is not None:
+                    return
+            time.sleep(0.5)
+
+    def backfill(self, session, after_id: int = 0):
+        """Rolls up DeviceLog rows with id > after_id in the caller's transaction, a chunk at a time."""
+        while True:
+            log = DeviceLog.__table__.c
+            rows = session.execute(
+                select(log.id, log.device_type, log.action, log.timestamp)
+                .where(log.id > after_id).order_by(log.id).limit(self.chunk_size)).all()
+            if not rows:
+                return
+            self.apply(session, [(device_type, "on" if action == "turned_on" else "off", timestamp)
+                                 for _, device_type, action, timestamp in rows])
+            self.backfilled += len(rows)
+            after_id = rows[-1][0]
+
+    def apply(self, session, events):
+        """
+        Rolls up state events, (device_type, "on" | "off", timestamp) in time
+        order, in the caller's transaction. Events that repeat the current
+        state are ignored.
+        """
+        devices = {e[0] for e in events}
+        cursors = {c.device_type: (c.state, c.since) for c in session.execute(
+            select(UsageCursor).where(UsageCursor.device_type.in_(devices))).scalars()}
+        # device_type -> since, in seconds since EPOCH, for devices that are on
+        on_since = {d: (since - EPOCH).total_seconds() for d, (state, since) in cursors.items() if state == "on"}
+        buckets: Buckets = {}
+        for device_type, state, timestamp in events:
+            current, since = cursors.get(device_type, ("off", None))
+            if state == current and since is not None:
+                continue
+            at = (timestamp - EPOCH).total_seconds()
+            if current == "on" and since is not None:
+                _add_on_time(buckets, device_type, on_since.pop(device_type), at)
+            if state == "on":
+                on_since[device_type] = at
+                for period, size in PERIOD_SECONDS.items():
+                    buckets.setdefault((device_type, period, at - at % size), [0.0, 0])[1] += 1
+            cursors[device_type] = (state, timestamp)
+        self.events += len(events)
+
+        # Core statements: no ORM objects for thousands of rows
+        if buckets:
+            usage = DeviceUsage.__table__
+            statement = sqlite_insert(usage)
+            statement = statement.on_conflict_do_update(
+                index_elements=[usage.c.device_type, usage.c.period, usage.c.start],
+                set_={"on_seconds": usage.c.on_seconds + statement.excluded.on_seconds,
+                      "switch_ons": usage.c.switch_ons + statement.excluded.switch_ons})
+            session.execute(statement, [
+                {"device_type": d, "period": p, "start": EPOCH + timedelta(seconds=s), "on_seconds": v[0],
+                 "switch_ons": v[1]}
+                for (d, p, s), v in buckets.items()
+            ])
+        statement = sqlite_insert(UsageCursor.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=[UsageCursor.__table__.c.device_type],
+            set_={"state": statement.excluded.state, "since": statement.excluded.since})
+        session.execute(statement, [{"device_type": d, "state": s, "since": t}
+                                    for d, (s, t) in cursors.items() if d in devices])
+
+    def apply_batch(self, session, batch):
+        """StateWriter batch hook."""
+        self.apply(session, [(e.device_type, e.state, e.timestamp) for e in batch])
+
+    # --- Retention ---
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.maintenance_interval)
+            try:
+                await run_in_threadpool(self.prune)
+            except SQLAlchemyError as e:
+                logger.error("Usage retention pass failed: %s", e)
+
+    def prune(self, now: datetime = None) -> Dict[str, int]:
+        """Deletes raw rows and hourly buckets past their retention. Returns how many of each."""
+        now = now or datetime.utcnow()
+        raw = hourly = 0
+        if self.raw_retention_days:
+            cutoff = now - timedelta(days=self.raw_retention_days)
+            # restore_states reads the latest row of each device
+            latest = select(func.max(DeviceLog.id)).group_by(DeviceLog.device_type)
+            while True:
+                with Session(self.engine) as session:
+                    # Rows are appended in time order: only the oldest chunk needs looking at
+                    oldest = select(DeviceLog.id, DeviceLog.timestamp).where(
+                        DeviceLog.id.not_in(latest)).order_by(DeviceLog.id).limit(self.chunk_size).subquery()
+                    last, expired = session.execute(
+                        select(func.max(oldest.c.id), func.count()).where(oldest.c.timestamp < cutoff)).one()
+                    if not expired:
+                        break
+                    # Every logged row was rolled up in the transaction that wrote it
+                    result = session.execute(delete(DeviceLog.__table__).where(
+                        DeviceLog.id <= last, DeviceLog.id.not_in(latest)))
+                    session.commit()
+                    raw += result.rowcount
+                if expired < self.chunk_size:
+                    break
+        if self.hourly_retention_days:
+            cutoff = bucket_start(now - timedelta(days=self.hourly_retention_days), "day")
+            with Session(self.engine) as session:
+                result = session.execute(delete(DeviceUsage.__table__).where(DeviceUsage.period == "hour",
+                                                                   DeviceUsage.start < cutoff))
+                session.commit()
+                hourly = result.rowcount
+        self.pruned_raw += raw
+        self.pruned_hourly += hourly
+        if raw or hourly:
+            logger.info("Retention: deleted %d raw events and %d hourly buckets", raw, hourly)
+        return {"raw": raw, "hourly": hourly}
+
+    # --- Queries ---
+
+    def _pieces(self, start: datetime, end: datetime, granularity: str, now: datetime):
+        """(period, from, to) bucket ranges that together cover [start, end)."""
+        if granularity != "total":
+            return [(granularity, bucket_start(start, granularity), bucket_end(end, granularity))]
+        # Whole days from the daily buckets, the hours at either edge from the hourly ones
+        hourly_from = bucket_start(now - timedelta(days=self.hourly_retention_days), "day") \
+            if self.hourly_retention_days else datetime.min
+        start = bucket_start(start, "hour") if start >= hourly_from else bucket_start(start, "day")
+        end = bucket_end(end, "hour")
+        first_day, last_day = bucket_end(start, "day"), bucket_start(end, "day")
+        if first_day >= last_day:
+            return [("hour", start, end)]
+        return [("hour", start, first_day), ("day", first_day, last_day), ("hour", last_day, end)]
+
+    def usage(self, session, start: datetime, end: datetime, device_type: Optional[str] = None,
+              granularity: str = "total", now: datetime = None) -> Dict:
+        """
+        On-time per device over [start, end), from the rollups plus intervals
+        still open. granularity "total" gives one figure per device (the range
+        is widened to whole hours); "day" / "hour" give one entry per bucket.
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+        if end <= start:
+            raise ValueError("end must be after start")
+        now = now or datetime.utcnow()
+        self.queries += 1
+        pieces = self._pieces(start, end, granularity, now)
+        start, end = pieces[0][1], pieces[-1][2]
+
+        totals: Dict[str, Dict] = {}
+        series: Dict[str, Dict[datetime, List]] = {}
+        for period, low, high in pieces:
+            if low >= high:
+                continue
+            where = [DeviceUsage.period == period, DeviceUsage.start >= low, DeviceUsage.start < high]
+            if device_type is not None:
+                where.append(DeviceUsage.device_type == device_type)
+            if granularity == "total":
+                rows = session.execute(select(DeviceUsage.device_type, func.sum(DeviceUsage.on_seconds),
+                                              func.sum(DeviceUsage.switch_ons))
+                                       .where(*where).group_by(DeviceUsage.device_type)).all()
+                for device, on_seconds, switch_ons in rows:
+                    entry = totals.setdefault(device, {"on_seconds": 0.0, "switch_ons": 0})
+                    entry["on_seconds"] += on_seconds
+                    entry["switch_ons"] += switch_ons
+            else:
+                rows = session.execute(select(DeviceUsage.device_type, DeviceUsage.start, DeviceUsage.on_seconds,
+                                              DeviceUsage.switch_ons).where(*where)).all()
+                for device, bucket, on_seconds, switch_ons in rows:
+                    series.setdefault(device, {})[bucket] = [on_seconds, switch_ons]
+
+        # Devices on right now: their current interval isn't in the rollups yet
+        open_where = [UsageCursor.state == "on", UsageCursor.since < end]
+        if device_type is not None:
+            open_where.append(UsageCursor.device_type == device_type)
+        for cursor in session.execute(select(UsageCursor).where(*open_where)).scalars():
+            low, high = max(cursor.since, start), min(now, end)
+            if high <= low:
+                continue
+            if granularity == "total":
+                entry = totals.setdefault(cursor.device_type, {"on_seconds": 0.0, "switch_ons": 0})
+                entry["on_seconds"] += (high - low).total_seconds()
+            else:
+                buckets = series.setdefault(cursor.device_type, {})
+                for bucket, seconds in split_interval(low, high, granularity):
+                    buckets.setdefault(bucket, [0.0, 0])[0] += seconds
+
+        result = {"start": start.isoformat(), "end": end.isoformat(), "granularity": granularity}
+        if granularity == "total":
+            result["devices"] = {
+                device: {"on_seconds": round(e["on_seconds"], 1), "switch_ons": e["switch_ons"],
+                         "energy_kwh": energy_kwh(device, e["on_seconds"])}
+                for device, e in sorted(totals.items())}
+        else:
+            result["devices"] = {
+                device: [{"start": bucket.isoformat(), "on_seconds": round(v[0], 1), "switch_ons": v[1],
+                          "energy_kwh": energy_kwh(device, v[0])} for bucket, v in sorted(buckets.items())]
+                for device, buckets in sorted(series.items())}
+        return result
+
+    def stats(self) -> Dict:
+        return {"events": self.events, "backfilled": self.backfilled, "pruned_raw": self.pruned_raw,
+                "pruned_hourly": self.pruned_hourly, "queries": self.queries}
@@ -0,0 +1,368 @@
+import asyncio
+import heapq
+import json
+import logging
+import time
+from datetime import datetime, time as clock_time, timedelta
+from typing import Callable, Dict, FrozenSet, List, Tuple
+
+from sqlalchemy import bindparam, delete, or_, select, true, update
+
+from database import run_db
+from dispatcher import ACTIONS, CommandDispatcher, expand_states, normalize_states
+from models import Scene, Schedule
+
+DAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+DAY_SETS = {"daily": frozenset(range(7)), "weekdays": frozenset(range(5)), "weekends": frozenset((5, 6))}
+# Longest sleep of the timer loop, so a wall clock change (NTP, DST) is noticed within a minute
+MAX_SLEEP = 60.0
+# Occurrences noticed later than this (host suspended, loop stalled) are skipped, not run late
+MISFIRE_GRACE = 300.0
+
+logger = logging.getLogger("smart_home.automations")
+
+_schedules = Schedule.__table__
+# Takes one occurrence of a schedule; matches no row if another worker (or this one before a restart) did
+CLAIM = update(_schedules).where(
+    _schedules.c.id == bindparam("schedule_id"), _schedules.c.enabled == true(),
+    or_(_schedules.c.last_fired_at.is_(None), _schedules.c.last_fired_at < bindparam("fire_at")),
+).values(last_fired_at=bindparam("fire_at"))
+
+
+def scene_name(name: str) -> str:
+    """Scenes are stored and looked up by lowercased, stripped name ("Movie " is "movie")."""
+    if not isinstance(name, str):
+        raise ValueError(f"Invalid scene name {name!r}")
+    return name.strip().lower()
+
+
+def parse_days(days: str) -> FrozenSet[int]:
+    """"daily" | "weekdays" | "weekends" | "mon,wed,fri" -> weekday numbers (Monday = 0)."""
+    if not isinstance(days, str):
+        raise ValueError(f"Invalid days {days!r}: use daily, weekdays, weekends or e.g. mon,wed,fri")
+    days = days.strip().lower()
+    if days in DAY_SETS:
+        return DAY_SETS[days]
+    try:
+        parsed = frozenset(DAY_NAMES.index(d.strip()[:3]) for d in days.split(",") if d.strip())
+    except ValueError:
+        raise ValueError(f"Unknown days {days!r}: use daily, weekdays, weekends or e.g. mon,wed,fri")
+    if not parsed:
+        raise ValueError("days is empty")
+    return parsed
+
+
+def parse_time(at: str) -> Tuple[int, int]:
+    """"HH:MM" -> (hour, minute)."""
+    try:
+        hour, minute = (int(part) for part in at.split(":"))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid time {at!r}: use HH:MM")
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Invalid time {at!r}: use HH:MM")
+    return hour, minute
+
+
+def next_fire(at: str, days: str, after: datetime) -> datetime:
+    """First occurrence of at (local time) on one of days strictly after `after`."""
+    hour, minute = parse_time(at)
+    weekdays = parse_days(days)
+    for offset in range(8):
+        day = after.date() + timedelta(days=offset)
+        candidate = datetime.combine(day, clock_time(hour, minute))
+        if candidate > after and day.weekday() in weekdays:
+            return candidate
+    raise ValueError("days is empty")
+
+
+def schedule_dict(schedule: Schedule) -> Dict:
+    return schedule.model_dump(mode="json")
+
+
+class AutomationEngine:
+    """
+    Scenes (named sets of device states) and schedules that apply a scene or
+    a single command at a time of day.
+    - Every rule lives in SQLite (Scene / Schedule) and in memory; the API
+      writes both, so the timer never reads the DB to find what is due.
+    - One task sleeps until the earliest occurrence in a heap of
+      (fire time, schedule id, generation); however many rules there are,
+      nothing polls them. Editing a rule bumps its generation, and heap
+      entries of older generations are skipped when they come up.
+    - Rules due at the same moment, and every device of a scene, go out as one
+      dispatch_states call: one state change batch, one dashboard broadcast.
+    - Before firing, a worker claims the occurrence by writing last_fired_at,
+      so with several workers (or a restart in the same minute) it runs once.
+    """
+
+    def __init__(self, dispatcher: CommandDispatcher, max_sleep: float = MAX_SLEEP,
+                 misfire_grace: float = MISFIRE_GRACE):
+        self.dispatcher = dispatcher
+        self.max_sleep = max_sleep
+        self.misfire_grace = misfire_grace
+        # name -> normalized states
+        self.scenes: Dict[str, Dict[str, str]] = {}
+        self.schedules: Dict[int, Schedule] = {}
+        # (time.time() of the occurrence, schedule id, generation, local datetime) min-heap
+        self._timers: List[Tuple[float, int, int, datetime]] = []
+        self._generations: Dict[int, int] = {}
+        self._wakeup: asyncio.Event = None
+        self._task: asyncio.Task = None
+        # Called with no arguments after this process changed a scene or schedule
+        self.listeners: List[Callable[[], None]] = []
+
+        # Stats
+        self.fired = 0
+        self.skipped = 0
+        self.scenes_applied = 0
+
+    async def start(self):
+        await self.reload()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def reload(self):
+        """Reads every scene and schedule from the DB and rebuilds the timer heap."""
+        def load(session):
+            return (session.execute(select(Scene)).scalars().all(),
+                    session.execute(select(Schedule)).scalars().all())
+
+        scenes, schedules = await run_db(load)
+        self.scenes = {scene.name: json.loads(scene.states) for scene in scenes}
+        self.schedules = {schedule.id: schedule for schedule in schedules}
+        self._timers = []
+        now = datetime.now()
+        for schedule_id in self.schedules:
+            self._arm(schedule_id, now)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        logger.info("Loaded %d scenes and %d schedules", len(self.scenes), len(self.schedules))
+
+    def _arm(self, schedule_id: int, after: datetime):
+        """(Re)schedules one rule's next occurrence; older heap entries for it become stale."""
+        generation = self._generations.get(schedule_id, 0) + 1
+        self._generations[schedule_id] = generation
+        schedule = self.schedules.get(schedule_id)
+        if schedule is None or not schedule.enabled:
+            return
+        fire_at = next_fire(schedule.at, schedule.days, after)
+        heapq.heappush(self._timers, (fire_at.timestamp(), schedule_id, generation, fire_at))
+        # Stale entries stay until they come up; rebuild once they outnumber live ones
+        if len(self._timers) > 2 * len(self.schedules) + 64:
+            self._timers = [t for t in self._timers if self._generations.get(t[1]) == t[2]]
+            heapq.heapify(self._timers)
+
+    def _rearm(self, schedule_id: int):
+        self._arm(schedule_id, datetime.now())
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            timeout = self.max_sleep
+            if self._timers:
+                timeout = min(timeout, max(0.0, self._timers[0][0] - time.time()))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+            now = time.time()
+            due = []
+            while self._timers and self._timers[0][0] <= now:
+                at, schedule_id, generation, fire_at = heapq.heappop(self._timers)
+                if self._generations.get(schedule_id) != generation:
+                    continue  # Edited or deleted since
+                self._arm(schedule_id, fire_at)
+                if now - at > self.misfire_grace:
+                    self.skipped += 1
+                    logger.warning("Schedule %d skipped: %s was %.0f s ago", schedule_id, fire_at, now - at)
+                    continue
+                due.append((schedule_id, fire_at))
+            if due:
+                try:
+                    await self._fire(due)
+                except Exception:
+                    logger.exception("Firing %d schedules failed", len(due))
+
+    async def _fire(self, due: List[Tuple[int, datetime]]):
+        def claim(session):
+            claimed = []
+            for schedule_id, fire_at in due:
+                result = session.execute(CLAIM, {"schedule_id": schedule_id, "fire_at": fire_at})
+                if result.rowcount:
+                    claimed.append((schedule_id, fire_at))
+            session.commit()
+            return claimed
+
+        claimed = await run_db(claim)
+        states: Dict[str, str] = {}
+        for schedule_id, fire_at in claimed:
+            schedule = self.schedules.get(schedule_id)
+            if schedule is None:
+                continue
+            schedule.last_fired_at = fire_at
+            states.update(self.schedule_states(schedule))
+            logger.info("Schedule %d (%s) fired", schedule_id, schedule.name)
+        self.fired += len(claimed)
+        if states:
+            await self.dispatcher.dispatch_states(states)
+
+    def schedule_states(self, schedule: Schedule) -> Dict[str, str]:
+        if schedule.scene is not None:
+            return expand_states(self.scenes.get(schedule.scene, {}))
+        return expand_states({schedule.device_type: "on" if schedule.action == "turn_on" else "off"})
+
+    def _notify(self):
+        for listener in self.listeners:
+            listener()
+
+    # --- Scenes ---
+
+    def list_scenes(self) -> Dict[str, Dict[str, str]]:
+        return self.scenes
+
+    async def save_scene(self, name: str, states: Dict[str, str]) -> Dict[str, str]:
+        """Creates or replaces a scene."""
+        name = scene_name(name)
+        if not name:
+            raise ValueError("A scene needs a name")
+        states = normalize_states(states)
+
+        def save(session):
+            session.merge(Scene(name=name, states=json.dumps(states)))
+            session.commit()
+
+        await run_db(save)
+        self.scenes[name] = states
+        self._notify()
+        return states
+
+    async def delete_scene(self, name: str):
+        name = scene_name(name)
+        if name not in self.scenes:
+            raise KeyError(name)
+        users = [s.id for s in self.schedules.values() if s.scene == name]
+        if users:
+            raise ValueError(f"Scene {name!r} is used by schedules {users}")
+
+        def remove(session):
+            session.execute(delete(Scene).where(Scene.name == name))
+            session.commit()
+
+        await run_db(remove)
+        del self.scenes[name]
+        self._notify()
+
+    async def activate_scene(self, name: str, started: float = None) -> List[str]:
+        """Applies a scene now. Returns the device types that changed."""
+        name = scene_name(name)
+        if name not in self.scenes:
+            raise KeyError(name)
+        self.scenes_applied += 1
+        return await self.dispatcher.dispatch_states(expand_states(self.scenes[name]), started)
+
+    # --- Schedules ---
+
+    def list_schedules(self) -> List[Dict]:
+        entries = {t[1]: t[3] for t in self._timers if self._generations.get(t[1]) == t[2]}
+        return [{**schedule_dict(s), "next_fire_at": entries[s.id].isoformat() if s.id in entries else None}
+                for s in self.schedules.values()]
+
+    def _validate(self, fields: Dict) -> Dict:
+        unknown = set(fields) - {"name", "at", "days", "scene", "action", "device_type", "enabled"}
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        fields = dict(fields)
+        fields.setdefault("days", "daily")
+        fields.setdefault("enabled", True)
+        parse_time(fields.get("at"))
+        parse_days(fields["days"])
+        if not isinstance(fields["enabled"], bool):
+            raise ValueError("enabled must be true or false")
+        if not isinstance(fields.get("name"), str) or not fields["name"].strip():
+            raise ValueError("A schedule needs a name")
+        if fields.get("scene") is not None:
+            fields["scene"] = scene_name(fields["scene"])
+            if fields["scene"] not in self.scenes:
+                raise ValueError(f"Unknown scene {fields['scene']!r}")
+            fields["action"] = fields["device_type"] = None
+        else:
+            if fields.get("action") not in ACTIONS or not fields.get("device_type"):
+                raise ValueError("A schedule needs a scene, or an action (turn_on/turn_off) and a device_type")
+            fields["device_type"] = next(iter(normalize_states({fields["device_type"]: "on"})))
+        return fields
+
+    async def create_schedule(self, fields: Dict) -> Dict:
+        schedule = Schedule(**self._validate(fields))
+
+        def add(session):
+            session.add(schedule)
+            session.commit()
+            session.refresh(schedule)
+            return schedule
+
+        schedule = await run_db(add)
+        self.schedules[schedule.id] = schedule
+        self._rearm(schedule.id)
+        self._notify()
+        return schedule_dict(schedule)
+
+    async def update_schedule(self, schedule_id: int, fields: Dict) -> Dict:
+        """Changes some fields of a schedule; the others keep their value."""
+        current = self.schedules.get(schedule_id)
+        if current is None:
+            raise KeyError(schedule_id)
+        editable = schedule_dict(current)
+        for key in ("id", "last_fired_at"):
+            editable.pop(key)
+        if fields.get("scene") is None and "action" in fields:
+            editable["scene"] = None
+        values = self._validate({**editable, **fields})
+
+        def edit(session):
+            schedule = session.get(Schedule, schedule_id)
+            if schedule is None:
+                return None
+            for key, value in values.items():
+                setattr(schedule, key, value)
+            session.commit()
+            session.refresh(schedule)
+            return schedule
+
+        schedule = await run_db(edit)
+        if schedule is None:
+            raise KeyError(schedule_id)
+        self.schedules[schedule_id] = schedule
+        self._rearm(schedule_id)
+        self._notify()
+        return schedule_dict(schedule)
+
+    async def delete_schedule(self, schedule_id: int):
+        if schedule_id not in self.schedules:
+            raise KeyError(schedule_id)
+
+        def remove(session):
+            session.execute(delete(Schedule).where(Schedule.id == schedule_id))
+            session.commit()
+
+        await run_db(remove)
+        del self.schedules[schedule_id]
+        self._rearm(schedule_id)
+        self._notify()
+
+    def stats(self) -> Dict:
+        return {"scenes": len(self.scenes), "schedules": len(self.schedules),
+                "timers": len(self._timers), "fired": self.fired, "skipped": self.skipped,
+                "scenes_applied": self.scenes_applied}
@@ -0,0 +1,127 @@
+"""
+Usage reports from DeviceLog: scanning the raw log vs. the hourly/daily rollups.
+
+Fills a scratch database with --events synthetic events (generate_device_logs)
+for 6 devices over a year, then:
+  1. builds the rollups from the raw log (the one-time backfill on first start)
+  2. answers "on-time per device" for the last day / 30 days / year:
+       - raw, no index:   LEAD() over DeviceLog as it was (no index at all)
+       - raw, indexed:    the same query with the (device_type, timestamp) index
+       - rollups:         UsageAnalytics.usage, the /analytics/usage endpoint
+  3. times one incremental state-writer batch (500 events) and a retention
+     pass that deletes everything older than 30 days.
+
+Use --events 20000000 for the tens-of-millions case (generation takes a while).
+
+Run from the backend directory:
+    python benchmarks/bench_analytics.py [--events 2000000]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import text  # noqa: E402
+from sqlmodel import Session, create_engine  # noqa: E402
+
+from analytics import UsageAnalytics  # noqa: E402
+from generate_device_logs import generate  # noqa: E402
+from state_store import StateEvent  # noqa: E402
+
+RANGES = (("1 day", timedelta(days=1)), ("30 days", timedelta(days=30)), ("365 days", timedelta(days=365)))
+REPEAT = 5
+
+RAW_QUERY = text("""
+SELECT device_type, SUM((julianday(next_ts) - julianday(timestamp)) * 86400)
+FROM (SELECT device_type, action, timestamp,
+             LEAD(timestamp) OVER (PARTITION BY device_type ORDER BY timestamp) AS next_ts
+      FROM devicelog WHERE timestamp >= :start AND timestamp < :end)
+WHERE action = 'turned_on' AND next_ts IS NOT NULL
+GROUP BY device_type
+""")
+
+
+def timed(fn, repeat: int = REPEAT) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="smart-home-bench-")
+    path = os.path.join(scratch, "usage.db")
+    engine = create_engine(f"sqlite:///{path}")
+    now = datetime.utcnow()
+    try:
+        started = time.perf_counter()
+        written = generate(path, args.events, end=now)
+        print(f"Generated {written:,} events in {time.perf_counter() - started:.1f} s "
+              f"({os.path.getsize(path) / 1e6:.0f} MB)")
+
+        with Session(engine) as session:
+            session.execute(text("DROP INDEX ix_devicelog_device_type_timestamp"))
+            session.commit()
+
+        def raw(start, end):
+            with Session(engine) as session:
+                return session.execute(RAW_QUERY, {"start": start, "end": end}).all()
+
+        raw_no_index = {label: timed(lambda: raw(now - span, now), 1) for label, span in RANGES}
+
+        analytics = UsageAnalytics(engine, raw_retention_days=30)
+        started = time.perf_counter()
+        analytics.prepare()  # Creates the index, then rolls up the whole log
+        print(f"Index + rollups built in {time.perf_counter() - started:.1f} s")
+        raw_indexed = {label: timed(lambda: raw(now - span, now), 1) for label, span in RANGES}
+
+        print(f"\n{'range':10} {'raw, no index':>15} {'raw, indexed':>15} {'rollups':>12}")
+        for label, span in RANGES:
+            def rollups():
+                with Session(engine) as session:
+                    return analytics.usage(session, now - span, now, now=now)
+            print(f"{label:10} {raw_no_index[label] * 1000:12.0f} ms {raw_indexed[label] * 1000:12.0f} ms "
+                  f"{timed(rollups) * 1000:9.1f} ms")
+
+        with Session(engine) as session:
+            year = analytics.usage(session, now - timedelta(days=365), now, now=now)["devices"]
+            raw_year = dict(raw(now - timedelta(days=365), now))
+        light = year.get("light", {}).get("on_seconds", 0)
+        # The raw query drops the intervals cut by the range edges, so the two differ by at most one each
+        print(f"\nlight, last year: rollups {light / 3600:,.1f} h, raw {raw_year.get('light', 0) / 3600:,.1f} h")
+
+        def daily_series():
+            with Session(engine) as session:
+                return analytics.usage(session, now - timedelta(days=30), now, granularity="day", now=now)
+        print(f"30 daily buckets per device: {timed(daily_series) * 1000:.1f} ms")
+
+        batch = [StateEvent(f"relay-{i % 50}", "on" if (i // 50) % 2 else "off", now + timedelta(seconds=i))
+                 for i in range(500)]
+
+        def write_batch():
+            with Session(engine) as session:
+                analytics.apply_batch(session, batch)
+                session.commit()
+        print(f"Rollup update per state-writer batch of 500: {timed(write_batch, 1) * 1000:.1f} ms")
+
+        started = time.perf_counter()
+        pruned = analytics.prune(now)
+        print(f"Retention (raw > 30 days): deleted {pruned['raw']:,} rows in {time.perf_counter() - started:.1f} s")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
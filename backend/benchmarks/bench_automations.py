@@ -0,0 +1,181 @@
+"""
+Scenes and schedules at scale.
+
+  1. Scheduler cost for 1,000 / 10,000 daily rules over one simulated day:
+       - polling: every rule checked once a second (what one task per rule,
+         or the old cron scripts hammering the API, amount to)
+       - heap:    AutomationEngine's timer heap, one pop + re-arm per occurrence
+  2. Firing latency: 10,000 schedules loaded from a scratch database, 200 of
+     them due at the same moment; time from the due instant to the single
+     dispatch_states call (includes the claim transaction).
+  3. Scene activation with 100 dashboards (half text, half compact):
+     the 6 devices as 6 dispatches vs. one dispatch_states.
+
+Run from the backend directory:
+    python benchmarks/bench_automations.py
+"""
+import asyncio
+import heapq
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+SCRATCH = tempfile.mkdtemp(prefix="smart-home-bench-")
+os.environ["SMART_HOME_DB_PATH"] = os.path.join(SCRATCH, "database.db")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from automations import AutomationEngine, expand_states, next_fire  # noqa: E402
+from command_queue import CommandQueue  # noqa: E402
+from connection_manager import ConnectionManager  # noqa: E402
+from database import create_db_and_tables, engine  # noqa: E402
+from dispatcher import CommandDispatcher  # noqa: E402
+from models import Schedule  # noqa: E402
+from sqlmodel import Session  # noqa: E402
+from ws_protocol import PROTO_COMPACT, PROTO_TEXT  # noqa: E402
+
+RULE_COUNTS = (1_000, 10_000)
+DUE_TOGETHER = 200
+DASHBOARDS = 100
+ACTIVATIONS = 2_000
+SCENE = {"tv": "on", "hometheater": "on", "light": "off", "kitchen light": "off", "fan": "off",
+         "refrigerator": "on"}
+
+
+class FakeSocket:
+    def __init__(self):
+        self.frames = 0
+
+    async def send_text(self, message: str):
+        self.frames += 1
+
+    async def send_bytes(self, message: bytes):
+        self.frames += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def rule_times(n: int):
+    return [f"{i * 1440 // n // 60:02d}:{i * 1440 // n % 60:02d}" for i in range(n)]
+
+
+def scheduler_cost(n: int):
+    times = rule_times(n)
+    midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    # Polling: every second, compare each rule's next occurrence with the clock
+    upcoming = [next_fire(at, "daily", midnight).timestamp() for at in times]
+    now = midnight.timestamp()
+    ticks = 200
+    started = time.perf_counter()
+    for tick in range(ticks):
+        clock = now + tick
+        for i, at in enumerate(upcoming):
+            if at <= clock:
+                upcoming[i] = at + 86400
+    polling = (time.perf_counter() - started) / ticks * 86400
+
+    # Heap: the engine's own _arm, then every occurrence of the day popped and re-armed
+    automations = AutomationEngine(None)
+    automations.schedules = {i: Schedule(id=i, name=f"r{i}", at=at, action="turn_off", device_type="light")
+                             for i, at in enumerate(times)}
+    started = time.perf_counter()
+    for i in automations.schedules:
+        automations._arm(i, midnight)
+    armed = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(n):
+        _, schedule_id, _, fire_at = heapq.heappop(automations._timers)
+        automations._arm(schedule_id, fire_at)
+    heap = time.perf_counter() - started
+    print(f"  {n:>6,} rules   polling {polling:8.2f} CPU s/day   heap {heap * 1000:8.1f} CPU ms/day"
+          f"   (arming all: {armed * 1000:.1f} ms)")
+
+
+class RecordingDispatcher:
+    def __init__(self):
+        self.calls = []
+
+    async def dispatch_states(self, states, started=None):
+        self.calls.append((time.time(), len(states)))
+        return []
+
+
+async def firing_latency(n: int):
+    create_db_and_tables()
+    with Session(engine) as session:
+        for i, at in enumerate(rule_times(n)):
+            session.add(Schedule(name=f"r{i}", at=at, action="turn_on" if i % 2 else "turn_off",
+                                 device_type=("light", "fan", "tv")[i % 3]))
+        session.commit()
+
+    dispatcher = RecordingDispatcher()
+    automations = AutomationEngine(dispatcher)
+    started = time.perf_counter()
+    await automations.start()
+    loaded = time.perf_counter() - started
+
+    # Make DUE_TOGETHER rules come up 50 ms from now
+    due_at = time.time() + 0.05
+    fire_at = datetime.fromtimestamp(due_at)
+    for schedule_id in list(automations.schedules)[:DUE_TOGETHER]:
+        generation = automations._generations[schedule_id] = automations._generations[schedule_id] + 1
+        heapq.heappush(automations._timers, (due_at, schedule_id, generation, fire_at))
+    automations._wakeup.set()
+    while not dispatcher.calls:
+        await asyncio.sleep(0.01)
+    fired_at, devices = dispatcher.calls[0]
+    await automations.stop()
+    print(f"  {n:,} schedules loaded in {loaded * 1000:.0f} ms; {DUE_TOGETHER} due together -> "
+          f"{len(dispatcher.calls)} dispatch ({devices} devices) {(fired_at - due_at) * 1000:.1f} ms after due, "
+          f"{automations.fired} claimed")
+
+
+async def scene_activation():
+    for label, batched in (("per device", False), ("one batch", True)):
+        manager = ConnectionManager()
+        sockets = [FakeSocket() for _ in range(DASHBOARDS)]
+        for i, socket in enumerate(sockets):
+            manager.register_client(socket, PROTO_TEXT if i % 2 else PROTO_COMPACT)
+        dispatcher = CommandDispatcher(manager, CommandQueue())
+        states = expand_states(SCENE)
+        plans = [dispatcher.plan("turn_on" if s == "on" else "turn_off", d) for d, s in states.items()]
+
+        started = time.perf_counter()
+        for i in range(ACTIVATIONS):
+            # Alternate with the opposite scene so every activation changes every device
+            flip = i % 2
+            if batched:
+                await dispatcher.dispatch_states(
+                    {d: ("off" if s == "on" else "on") if flip else s for d, s in states.items()})
+            else:
+                for plan in plans:
+                    opposite = dispatcher.plan("turn_off" if plan.action == "turn_on" else "turn_on",
+                                               plan.device_type)
+                    await dispatcher.dispatch(opposite if flip else plan)
+            for channel in manager.client_channels.values():
+                await channel.flush()
+            dispatcher.queue.poll(batch=True)
+        elapsed = time.perf_counter() - started
+        text = sum(s.frames for i, s in enumerate(sockets) if i % 2) / (DASHBOARDS // 2) / ACTIVATIONS
+        compact = sum(s.frames for i, s in enumerate(sockets) if not i % 2) / (DASHBOARDS // 2) / ACTIVATIONS
+        print(f"  {label:10} {elapsed / ACTIVATIONS * 1e6:8.0f} us/activation   frames per dashboard: "
+              f"text {text:.0f}, compact {compact:.0f}")
+        for channel in list(manager.client_channels.values()):
+            channel.close()
+
+
+def main():
+    print("Scheduler cost over one day")
+    for n in RULE_COUNTS:
+        scheduler_cost(n)
+    print("\nFiring latency")
+    asyncio.run(firing_latency(RULE_COUNTS[-1]))
+    print(f"\nScene activation ({len(SCENE)} devices, {DASHBOARDS} dashboards)")
+    asyncio.run(scene_activation())
+
+
+if __name__ == "__main__":
+    main()
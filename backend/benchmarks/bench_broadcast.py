@@ -0,0 +1,110 @@
+"""
+Broadcast latency benchmark for ConnectionManager.
+
+Simulates N dashboard sockets (a few of them slow, e.g. a tablet on weak Wi-Fi)
+and measures how long it takes until every *healthy* client has received a
+broadcast frame, comparing the old serial loop with the queued fan-out.
+
+Run from the backend directory:
+    python benchmarks/bench_broadcast.py
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from connection_manager import ConnectionManager  # noqa: E402
+
+CLIENT_COUNTS = [10, 100, 1000]
+SLOW_CLIENTS = 2          # Number of clients that take SLOW_DELAY per frame
+SLOW_DELAY = 0.05         # 50 ms per frame, roughly a congested phone
+ROUNDS = 20
+
+
+class FakeClient:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.received = 0
+        self.done = None
+
+    async def send_text(self, message: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            # Yield like a real socket write would
+            await asyncio.sleep(0)
+        self.received += 1
+        if self.done is not None and not self.delay:
+            self.done()
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def serial_broadcast(clients, message):
+    # The pre-queue implementation: await every socket one after another
+    for c in clients:
+        await c.send_text(message)
+
+
+def make_clients(n):
+    return [FakeClient(SLOW_DELAY if i < SLOW_CLIENTS else 0.0) for i in range(n)]
+
+
+async def measure_serial(n):
+    clients = make_clients(n)
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        await serial_broadcast(clients, "ACTION:turn_on:light")
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def measure_queued(n):
+    manager = ConnectionManager()
+    clients = make_clients(n)
+    for c in clients:
+        manager.register_client(c)
+
+    healthy = n - SLOW_CLIENTS
+    samples = []
+    for _ in range(ROUNDS):
+        remaining = [healthy]
+        finished = asyncio.get_running_loop().create_future()
+
+        def on_delivered():
+            remaining[0] -= 1
+            if remaining[0] == 0 and not finished.done():
+                finished.set_result(None)
+
+        for c in clients:
+            c.done = on_delivered
+        start = time.perf_counter()
+        await manager.broadcast_status("ACTION:turn_on:light")
+        await finished
+        samples.append(time.perf_counter() - start)
+
+    for channel in list(manager.client_channels.values()):
+        channel.close()
+    return samples
+
+
+def fmt(samples):
+    ms = sorted(s * 1000 for s in samples)
+    return f"p50={statistics.median(ms):8.2f} ms  max={ms[-1]:8.2f} ms"
+
+
+async def main():
+    print(f"{SLOW_CLIENTS} slow clients at {SLOW_DELAY * 1000:.0f} ms/frame, {ROUNDS} rounds\n")
+    for n in CLIENT_COUNTS:
+        serial = await measure_serial(n)
+        queued = await measure_queued(n)
+        print(f"{n:5d} clients  serial: {fmt(serial)}   queued: {fmt(queued)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
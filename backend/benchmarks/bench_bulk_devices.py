@@ -0,0 +1,81 @@
+"""
+Provisioning 5,000 devices: one POST /devices/ per device vs. POST /devices/bulk.
+
+Runs the app in-process (TestClient) on a fresh scratch database per case:
+  - per item:  5,000 requests, each a lookup and a commit
+  - bulk:      one request with every device, one transaction
+  - bulk x10:  ten requests of 500
+  - re-run:    the same bulk request again (every row updated, none inserted)
+
+Run from the backend directory:
+    python benchmarks/bench_bulk_devices.py [--devices 5000]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Runs in a child process so every case starts with its own empty database and engine
+CASE = """
+import json, sys, time
+from fastapi.testclient import TestClient
+import main
+
+mode, n = sys.argv[1], int(sys.argv[2])
+devices = [{"id": f"esp32-{i:05d}", "name": f"Room {i // 6} relay {i % 6 + 1}", "type": "light",
+            "pin": i % 6 + 1, "ip_address": f"10.0.{i // 250}.{i % 250 + 1}"} for i in range(n)]
+with TestClient(main.app) as client:
+    started = time.perf_counter()
+    if mode == "per_item":
+        for device in devices:
+            client.post("/devices/", json=device).raise_for_status()
+    elif mode == "bulk":
+        client.post("/devices/bulk", json=devices).raise_for_status()
+    elif mode == "bulk_chunks":
+        for i in range(0, n, 500):
+            client.post("/devices/bulk", json=devices[i:i + 500]).raise_for_status()
+    else:
+        client.post("/devices/bulk", json=devices).raise_for_status()
+        started = time.perf_counter()
+        result = client.post("/devices/bulk", json=devices).json()
+        assert result["updated"] == n, result
+    elapsed = time.perf_counter() - started
+    assert len(client.get("/devices/").json()) == n
+print(json.dumps({"elapsed": elapsed}))
+"""
+
+
+def run_case(mode: str, n: int) -> float:
+    scratch = tempfile.mkdtemp(prefix="smart-home-bench-")
+    env = {**os.environ, "SMART_HOME_DB_PATH": os.path.join(scratch, "database.db"),
+           "SMART_HOME_LOG_LEVEL": "WARNING"}
+    try:
+        out = subprocess.run([sys.executable, "-c", CASE, mode, str(n)], cwd=BACKEND_DIR, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        return json.loads(out.strip().splitlines()[-1])["elapsed"]
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=5_000)
+    args = parser.parse_args()
+
+    print(f"Provisioning {args.devices:,} devices")
+    baseline = None
+    for label, mode in (("per item", "per_item"), ("bulk", "bulk"), ("bulk x500", "bulk_chunks"),
+                        ("bulk re-run", "bulk_update")):
+        elapsed = run_case(mode, args.devices)
+        baseline = baseline or elapsed
+        print(f"  {label:12} {elapsed:8.2f} s   {args.devices / elapsed:10,.0f} devices/s   "
+              f"{baseline / elapsed:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
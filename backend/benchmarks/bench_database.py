@@ -0,0 +1,142 @@
+"""
+Concurrent GET /devices/ throughput under the old and new SQLite settings.
+
+Each configuration gets its own temporary database with DEVICES rows. READERS
+concurrent callers run the get_devices query (select all Device rows) while
+one writer keeps committing DeviceLog rows, as the state writer does under load.
+  - old:        create_engine(url, echo=True), SQLite defaults (rollback journal)
+  - production: database.py production profile (WAL, synchronous=NORMAL, pool, no echo)
+  - async:      production pragmas through the aiosqlite engine (if installed)
+
+Run from the backend directory:
+    python benchmarks/bench_database.py
+"""
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import event  # noqa: E402
+from sqlmodel import Session, SQLModel, create_engine, select  # noqa: E402
+
+import database  # noqa: E402
+from models import Device, DeviceLog  # noqa: E402
+
+DEVICES = 50
+READERS = 40      # Same as FastAPI's default threadpool size
+DURATION = 3.0    # Seconds per configuration
+
+
+def temp_url(driver="sqlite"):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    return path, f"{driver}:///{path}"
+
+
+def seed(engine):
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        for i in range(DEVICES):
+            session.add(Device(id=f"esp32-{i}", name=f"Device {i}", type="light", pin=i))
+        session.commit()
+
+
+def get_devices(session):
+    return session.execute(select(Device)).scalars().all()
+
+
+def writer(engine, stop):
+    while not stop.is_set():
+        with Session(engine) as session:
+            session.add(DeviceLog(device_type="light", action="turned_on"))
+            session.commit()
+
+
+def run_threaded(label, engine):
+    stop = threading.Event()
+    reads = [0] * READERS
+    errors = [0]
+
+    def reader(i):
+        while not stop.is_set():
+            try:
+                with Session(engine) as session:
+                    get_devices(session)
+                reads[i] += 1
+            except Exception:
+                errors[0] += 1
+
+    w = threading.Thread(target=writer, args=(engine, stop))
+    w.start()
+    with ThreadPoolExecutor(READERS) as pool:
+        for i in range(READERS):
+            pool.submit(reader, i)
+        time.sleep(DURATION)
+        stop.set()
+    w.join()
+    return f"{label:12} {sum(reads) / DURATION:10,.0f} reads/s   errors={errors[0]}"
+
+
+async def run_async(label, async_engine, sync_engine):
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    stop = threading.Event()
+    reads = [0]
+
+    async def reader():
+        while not stop.is_set():
+            async with AsyncSession(async_engine) as session:
+                await session.run_sync(get_devices)
+            reads[0] += 1
+
+    w = threading.Thread(target=writer, args=(sync_engine, stop))
+    w.start()
+    tasks = [asyncio.create_task(reader()) for _ in range(READERS)]
+    await asyncio.sleep(DURATION)
+    stop.set()
+    await asyncio.gather(*tasks)
+    w.join()
+    print(f"{label:12} {reads[0] / DURATION:10,.0f} reads/s   (no threadpool slots used)")
+
+
+def main():
+    print(f"{READERS} concurrent readers + 1 writer, {DEVICES} devices, {DURATION:.0f} s each\n")
+
+    # Old settings; echo goes to stdout like in production, silenced here
+    _, url = temp_url()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        old = create_engine(url, echo=True)
+        seed(old)
+        result = run_threaded("old", old)
+    print(result)
+
+    _, url = temp_url()
+    new = create_engine(url, connect_args={"check_same_thread": False},
+                        pool_size=database.DB_POOL_SIZE, max_overflow=database.DB_MAX_OVERFLOW)
+    event.listen(new, "connect", database._apply_pragmas)
+    seed(new)
+    print(run_threaded("production", new))
+
+    try:
+        import aiosqlite  # noqa: F401
+        from sqlalchemy.ext.asyncio import create_async_engine
+    except ImportError:
+        print(f"{'async':12} skipped (pip install aiosqlite)")
+        return
+    path, url = temp_url()
+    sync_engine = create_engine(url, connect_args={"check_same_thread": False})
+    event.listen(sync_engine, "connect", database._apply_pragmas)
+    seed(sync_engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}",
+                                       pool_size=database.DB_POOL_SIZE, max_overflow=database.DB_MAX_OVERFLOW)
+    event.listen(async_engine.sync_engine, "connect", database._apply_pragmas)
+    asyncio.run(run_async("async", async_engine, sync_engine))
+
+
+if __name__ == "__main__":
+    main()
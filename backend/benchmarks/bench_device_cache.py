@@ -0,0 +1,86 @@
+"""
+GET /devices/ requests per second with and without the device list cache.
+
+Runs the real app in-process (httpx ASGI transport, no network) against a
+temporary database seeded with DEVICES rows, and compares:
+  - uncached:     the original endpoint (select(Device) + serialize every call)
+  - cached:       the cached endpoint, full body each time
+  - conditional:  the cached endpoint with If-None-Match (304, no DB hit)
+
+Run from the backend directory:
+    python benchmarks/bench_device_cache.py
+"""
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+os.environ.setdefault("SMART_HOME_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import httpx  # noqa: E402
+from fastapi import Depends  # noqa: E402
+from sqlmodel import Session, select  # noqa: E402
+
+import main  # noqa: E402
+from database import engine, get_session  # noqa: E402
+from models import Device  # noqa: E402
+
+DEVICES = 100
+REQUESTS = 3000
+CONCURRENCY = 20
+
+
+@main.app.get("/bench/devices-uncached", response_model=List[Device])
+def get_devices_uncached(session: Session = Depends(get_session)):
+    # The endpoint as it was before the cache
+    devices = session.exec(select(Device)).all()
+    return devices
+
+
+async def hammer(client, path, headers=None):
+    per_worker = REQUESTS // CONCURRENCY
+    statuses = {}
+
+    async def worker():
+        for _ in range(per_worker):
+            r = await client.get(path, headers=headers)
+            statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - start
+    return per_worker * CONCURRENCY / elapsed, statuses
+
+
+async def main_async():
+    with contextlib.redirect_stdout(io.StringIO()):
+        await main.on_startup()
+    with Session(engine) as session:
+        for i in range(DEVICES):
+            session.add(Device(id=f"esp32-{i}", name=f"Device {i}", type="light", pin=i))
+        session.commit()
+    main.device_cache.invalidate()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://hub") as client:
+        etag = (await client.get("/devices/")).headers["etag"]
+        print(f"{REQUESTS} requests, {CONCURRENCY} concurrent, {DEVICES} devices\n")
+        for label, path, headers in (
+            ("uncached", "/bench/devices-uncached", None),
+            ("cached", "/devices/", None),
+            ("conditional (304)", "/devices/", {"If-None-Match": etag}),
+        ):
+            rate, statuses = await hammer(client, path, headers)
+            print(f"{label:18} {rate:10,.0f} req/s   {statuses}")
+
+    print(f"\ncache: {main.device_cache.stats()}")
+    await main.on_shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main_async())
@@ -0,0 +1,80 @@
+"""
+Frames received per ESP32 board, broadcast to every board vs. device-topic routing.
+
+A house with one board per room (each driving one or two relays) plus one
+old board that never declares its devices. The same command mix runs twice
+through the dispatcher:
+  - broadcast: no board declares devices, so every board gets every command (the old behaviour)
+  - routed:    boards declare their devices and only get commands for them
+The undeclared board receives everything in both runs.
+
+Run from the backend directory:
+    python benchmarks/bench_device_routing.py
+"""
+import asyncio
+import contextlib
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from command_queue import CommandQueue  # noqa: E402
+from connection_manager import ConnectionManager  # noqa: E402
+from dispatcher import CommandDispatcher  # noqa: E402
+
+# board id -> devices it drives (None: never declares, gets everything)
+BOARDS = {
+    "bedroom": ["light"],
+    "living-room": ["fan", "tv", "hometheater"],
+    "kitchen": ["kitchen", "fridge"],
+    "legacy": None,
+}
+COMMANDS = 1000
+
+INTENTS = [
+    ("turn_on", "light"), ("turn_off", "light"), ("turn_on", "fan"), ("turn_on", "kitchen light"),
+    ("turn_off", "tv"), ("turn_on", "hometheater"), ("turn_off", "fan"), ("turn_on", "all"),
+    ("turn_off", "kitchen light"), ("turn_off", "all"),
+]
+
+
+class FakeBoard:
+    def __init__(self):
+        self.query_params = {}
+        self.headers = {}
+        self.frames = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message: str):
+        self.frames += 1
+
+
+async def run(routed: bool):
+    manager = ConnectionManager()
+    dispatcher = CommandDispatcher(manager, CommandQueue())
+    boards = {board_id: FakeBoard() for board_id in BOARDS}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for board_id, ws in boards.items():
+            await manager.connect_device(board_id, ws, BOARDS[board_id] if routed else None)
+    for i in range(COMMANDS):
+        action, device_type = INTENTS[i % len(INTENTS)]
+        await dispatcher.dispatch(dispatcher.plan(action, device_type))
+    return {board_id: ws.frames for board_id, ws in boards.items()}
+
+
+async def main():
+    broadcast = await run(routed=False)
+    routed = await run(routed=True)
+    print(f"{COMMANDS} commands, frames received per board\n")
+    print(f"{'board':12} {'drives':32} {'broadcast':>10} {'routed':>8}")
+    for board_id, devices in BOARDS.items():
+        drives = ", ".join(devices) if devices else "(undeclared)"
+        print(f"{board_id:12} {drives:32} {broadcast[board_id]:10,} {routed[board_id]:8,}")
+    print(f"{'total':45} {sum(broadcast.values()):10,} {sum(routed.values()):8,}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
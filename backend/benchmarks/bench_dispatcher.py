@@ -0,0 +1,148 @@
+"""
+Dispatches per second: the old inline WebSocket command handling vs. the
+pre-planned CommandDispatcher.
+
+Both run the same mix of dashboard frames ("ACTION:turn_on:light",
+"toggle:fan", "ACTION:turn_off:all", ...) against a ConnectionManager:
+  - no sockets:  parsing, planning, state update and poll-queue publish only
+  - with sockets: plus fan-out to fake dashboards and ESP32s. Note the
+    dispatcher sends text dashboards the per-device frames for "all" that the
+    HTTP path always sent, which the old WebSocket path skipped.
+
+The dispatcher also does work the inline handler never did (dispatch latency
+histogram, ack routing, per-board device routing), so expect it to be about
+on par: its point is one pipeline for every entry point, not raw speed.
+Rounds alternate between the two and the best of each is reported, since a
+single run on a busy machine varies by 20% or more.
+
+Run from the backend directory:
+    python benchmarks/bench_dispatcher.py
+"""
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from command_queue import CommandQueue  # noqa: E402
+from connection_manager import ConnectionManager  # noqa: E402
+from dispatcher import CommandDispatcher  # noqa: E402
+
+# (dashboards, boards)
+SETUPS = [(0, 0), (10, 2)]
+DISPATCHES = 20_000
+# Alternating runs per variant; the fastest is reported
+ROUNDS = 5
+
+MESSAGES = [
+    "ACTION:turn_on:light", "ACTION:turn_off:light", "toggle:fan", "ACTION:turn_on:kitchen light",
+    "ACTION:turn_off:kitchen light", "toggle:tv", "ACTION:turn_on:all", "ACTION:turn_off:all",
+]
+
+
+class FakeSocket:
+    def __init__(self):
+        self.query_params = {}
+        self.headers = {}
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def legacy_dispatch(manager, queue, data):
+    # The WebSocket handler body as it was before the dispatcher
+    if data.startswith("toggle:"):
+        _, device_type = data.split(":")
+        current_state = manager.device_states.get(device_type, "off")
+        new_action = "turn_off" if current_state == "on" else "turn_on"
+        data = f"ACTION:{new_action}:{device_type}"
+
+    parts = data.split(":")
+    if len(parts) >= 3 and parts[0] == "ACTION":
+        action = parts[1]
+        device_type = parts[2]
+        manager.update_state(device_type, action)
+        await manager.broadcast_status(data)
+        if device_type == "all":
+            queue.publish(f"{action}:all")
+            all_targets = ["light", "fan", "kitchen light", "refrigerator", "tv", "hometheater"]
+            for target in all_targets:
+                if target == "refrigerator" and action == "turn_off":
+                    continue
+                await manager.broadcast_to_devices(f"{action}:{target}")
+        else:
+            esp32_device = "kitchen" if device_type == "kitchen light" else device_type
+            device_command = f"{action}:{esp32_device}"
+            queue.publish(device_command)
+            await manager.broadcast_to_devices(device_command)
+
+
+def planned_dispatcher(dispatcher):
+    async def dispatch(data):
+        plan = dispatcher.parse_client_message(data)
+        if plan is not None:
+            await dispatcher.dispatch(plan)
+    return dispatch
+
+
+async def setup(clients, boards):
+    manager = ConnectionManager()
+    for _ in range(clients):
+        await manager.connect_client(FakeSocket())
+    for i in range(boards):
+        await manager.connect_device(f"esp32-{i}", FakeSocket())
+    return manager
+
+
+async def drain(manager, queue):
+    for channel in list(manager.client_channels.values()):
+        await channel.flush()
+    queue.poll(batch=True)
+
+
+async def run(dispatch_one, clients, boards) -> float:
+    with contextlib.redirect_stdout(io.StringIO()):
+        manager = await setup(clients, boards)
+    queue = CommandQueue()
+    dispatch = dispatch_one(manager, queue)
+
+    start = time.perf_counter()
+    for i in range(DISPATCHES):
+        await dispatch(MESSAGES[i % len(MESSAGES)])
+        if i % 32 == 31:
+            # Let the writer tasks empty the client queues, as the event loop would
+            await drain(manager, queue)
+    await drain(manager, queue)
+    elapsed = time.perf_counter() - start
+
+    for channel in list(manager.client_channels.values()):
+        channel.close()
+    return DISPATCHES / elapsed
+
+
+async def main():
+    for clients, boards in SETUPS:
+        print(f"{DISPATCHES:,} dashboard commands, {clients} dashboards, {boards} boards (best of {ROUNDS})")
+        variants = {
+            "inline": lambda manager, queue: lambda data: legacy_dispatch(manager, queue, data),
+            "planned": lambda manager, queue: planned_dispatcher(CommandDispatcher(manager, queue)),
+        }
+        best = dict.fromkeys(variants, 0.0)
+        for _ in range(ROUNDS):
+            for label, dispatch_one in variants.items():
+                best[label] = max(best[label], await run(dispatch_one, clients, boards))
+        for label, rate in best.items():
+            print(f"  {label:10} {rate:10,.0f} dispatches/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,458 @@
+"""
+End-to-end load test: the real app (`uvicorn main:app`) on a scratch
+database, with a stub `ollama` module in front of the installed one.
+
+Simulated load:
+  - --dashboards browsers on /ws/client (text protocol, permessage-deflate like browsers)
+  - --ws-boards ESP32s on /ws/device/{id}, like the firmware: compact frames,
+    ?ack=1, answering pings and acknowledging every command
+  - --poll-boards ESP32s long-polling /device?wait=
+  - voice commands over POST /command/: one lane per device toggles it on and
+    off, a --slow-share of them phrased so they miss the fast path and go to
+    the (stub) LLM, each with a unique tag so the semantic cache can't answer.
+
+Reports commands/s, p50/p95/p99 from sending the command to each board and
+dashboard seeing it (and to the last of them), server RSS per connection and
+server CPU per command (with --profile, the server's hottest functions
+from the built-in sampling profiler). Results are written as JSON (default
+benchmarks/results/end_to_end-<commit>.json); --compare OLD.json prints the
+change against an earlier run, e.g. the parent commit's.
+
+Every lane waits for its own command, so up to one LLM request per lane is in
+flight against the inference scheduler's slots: slow-path latency includes
+that queueing, as it would with several people talking to the assistant.
+
+The harness runs in one process next to the server, so on a small machine it
+competes with the server for CPU; compare runs from the same machine.
+
+Run from the backend directory:
+    python benchmarks/bench_end_to_end.py [--dashboards 100] [--ws-boards 20] [--poll-boards 20]
+        [--duration 20] [--slow-share 0.1] [--llm-latency 0.2] [--profile] [--compare results/old.json]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_multi_worker import BACKEND_DIR, HTTPConnection, free_port, wait_until_up  # noqa: E402
+from device_registry import BOARD_NAMES, DEVICE_TYPES  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# A delivery not seen within this many seconds counts the command as timed out
+DELIVERY_TIMEOUT = 10.0
+# Long-poll hold of the simulated polling boards
+POLL_WAIT = 20
+
+# Phrasings the fast path understands
+FAST_PHRASES = {
+    "light": "turn {} the light",
+    "fan": "turn {} the fan",
+    "kitchen light": "turn {} the kitchen light",
+    "refrigerator": "turn {} the fridge",
+    "tv": "turn {} the tv",
+    "hometheater": "turn {} the home theater",
+}
+# Neither the regex nor the local classifier answers these, so they go to the LLM
+SLOW_PHRASES = {"turn_on": "i could really use the {} right now request {}",
+                "turn_off": "i could really do without the {} right now request {}"}
+SPOKEN = {"light": "light", "fan": "fan", "kitchen light": "kitchen light", "refrigerator": "fridge", "tv": "tv",
+          "hometheater": "home theater"}
+
+# Installed as `ollama` for the server process only
+STUB_OLLAMA = '''
+"""Stub ollama for bench_end_to_end.py: answers like mistral would, after a fixed delay."""
+import json
+import os
+import re
+import time
+
+LATENCY = float(os.environ.get("SMART_HOME_STUB_LLM_LATENCY", "0.2"))
+# Longest names first, so "kitchen light" is not read as "light"
+DEVICES = (("kitchen light", "kitchen light"), ("home theater", "hometheater"), ("hometheater", "hometheater"),
+           ("refrigerator", "refrigerator"), ("fridge", "refrigerator"), ("light", "light"), ("fan", "fan"),
+           ("tv", "tv"))
+
+
+def _intent(messages):
+    # No messages: a model load (SMART_HOME_WARMUP=llm)
+    match = re.search(r'from: "([^"]*)"', messages[-1]["content"]) if messages else None
+    text = match.group(1) if match else ""
+    action = "turn_off" if re.search(r"\\b(off|down|without)\\b", text) else "turn_on"
+    device = next((name for word, name in DEVICES if word in text), "light")
+    return json.dumps({"action": action, "device_type": device, "location": "unknown",
+                       "response_text": "OK."})
+
+
+def _stream(body):
+    pieces = [body[i:i + 8] for i in range(0, len(body), 8)]
+    for piece in pieces:
+        time.sleep(LATENCY / len(pieces))
+        yield {"message": {"content": piece}}
+
+
+def chat(model, messages, stream=False, **kwargs):
+    body = _intent(messages)
+    if stream:
+        return _stream(body)
+    time.sleep(LATENCY)
+    return {"message": {"content": body}}
+'''
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 2)  # noqa: E731
+    return {"count": len(values), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+def process_rss_kb(pid: int, field: str = "VmRSS") -> int:
+    """Resident memory of a process from /proc (Linux); 0 where unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def process_cpu_seconds(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except OSError:
+        return 0.0
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD", "--", "."], cwd=BACKEND_DIR).returncode
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Round:
+    """One command in flight: which receivers have seen it, and when."""
+
+    def __init__(self, action: str, path: str, expected: int):
+        self.action = action
+        self.path = path
+        self.expected = expected
+        self.started = time.perf_counter()
+        self.seen = set()
+        self.done = asyncio.Event()
+
+
+class DeliveryTracker:
+    """Matches frames seen by the simulated clients to the command each device lane has in flight."""
+
+    def __init__(self):
+        self.rounds = {}  # device -> Round
+        self.latencies = {}  # (path, receiver kind) -> [seconds]
+
+    def delivered(self, kind: str, receiver: str, device: str, action: str):
+        current = self.rounds.get(device)
+        if current is None or current.action != action or receiver in current.seen:
+            return  # Initial state, a resend, or a late frame of an earlier command
+        current.seen.add(receiver)
+        elapsed = time.perf_counter() - current.started
+        self.latencies.setdefault((current.path, kind), []).append(elapsed)
+        if len(current.seen) == current.expected:
+            self.latencies.setdefault((current.path, "all"), []).append(elapsed)
+            current.done.set()
+
+
+class LoadTest:
+    def __init__(self, args, port: int):
+        self.args = args
+        self.port = port
+        self.tracker = DeliveryTracker()
+        self.initial_states = {}
+        self.tasks = []
+        self.sockets = []
+        self.completed = {"fast": 0, "slow": 0}
+        self.errors = 0
+        self.timeouts = 0
+        self.request_latencies = {"fast": [], "slow": []}
+        self.running = True
+
+    # --- Simulated clients ---
+
+    async def dashboard(self, i: int, connected: asyncio.Event):
+        ws = await websockets.connect(f"ws://127.0.0.1:{self.port}/ws/client", max_queue=None)
+        self.sockets.append(ws)
+        name = f"dashboard-{i}"
+        for _ in DEVICE_TYPES:  # Initial state, one frame per device
+            _, action, device = (await ws.recv()).split(":", 2)
+            self.initial_states.setdefault(device, "on" if action == "turn_on" else "off")
+        connected.set()
+        async for message in ws:
+            if message.startswith("ACTION:"):
+                _, action, device = message.split(":", 2)
+                self.tracker.delivered("dashboard", name, device, action)
+
+    async def ws_board(self, i: int, connected: asyncio.Event):
+        devices = quote(",".join(DEVICE_TYPES))
+        ws = await websockets.connect(
+            f"ws://127.0.0.1:{self.port}/ws/device/ws-board-{i}?proto=compact&ack=1&devices={devices}",
+            max_queue=None, compression=None)  # The firmware's client doesn't negotiate permessage-deflate
+        self.sockets.append(ws)
+        name = f"ws-board-{i}"
+        connected.set()
+        async for message in ws:
+            if message == "ping":
+                await ws.send("pong")
+                continue
+            command = json.loads(message)
+            for device, value in command.get("c", {}).items():
+                self.tracker.delivered("board_ws", name, device, "turn_on" if value else "turn_off")
+            if "q" in command:
+                await ws.send(f"ack:{command['q']}")
+
+    async def poll_board(self, i: int, connected: asyncio.Event):
+        conn = HTTPConnection(self.port)
+        name = f"poll-board-{i}"
+        await conn.request("GET", f"/device?device_id={name}")  # Registers the board
+        connected.set()
+        try:
+            while self.running:
+                body = (await conn.request("GET", f"/device?device_id={name}&batch=true&wait={POLL_WAIT}")).decode()
+                if body == "idle":
+                    continue
+                for line in body.split("\n"):
+                    action, _, device = line.partition(":")
+                    self.tracker.delivered("board_poll", name, BOARD_NAMES.get(device, device), action)
+        finally:
+            conn.close()
+
+    async def connect(self, client, count: int):
+        for i in range(count):
+            connected = asyncio.Event()
+            self.tasks.append(asyncio.create_task(client(i, connected)))
+            await connected.wait()
+
+    # --- Commands ---
+
+    async def lane(self, index: int, device: str, stop_at: float, tags):
+        """Toggles one device until stop_at, one command in flight at a time."""
+        conn = HTTPConnection(self.port)
+        expected = self.args.dashboards + self.args.ws_boards + self.args.poll_boards
+        state = self.initial_states.get(device, "off")
+        # Lanes take their slow turns at different rounds, not all at once
+        n = index * 7
+        while time.monotonic() < stop_at:
+            action = "turn_off" if state == "on" else "turn_on"
+            # Every 1/slow_share-th command goes to the LLM
+            slow = int((n + 1) * self.args.slow_share) > int(n * self.args.slow_share)
+            path = "slow" if slow else "fast"
+            text = (SLOW_PHRASES[action].format(SPOKEN[device], next(tags)) if slow
+                    else FAST_PHRASES[device].format("on" if action == "turn_on" else "off"))
+            current = self.tracker.rounds[device] = Round(action, path, expected)
+            body = json.dumps({"text": text, "session_id": f"lane-{device}"}).encode()
+            try:
+                response = await conn.request("POST", "/command/", body)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                # Idle past uvicorn's keep-alive timeout while waiting on a slow delivery
+                conn.close()
+                conn = HTTPConnection(self.port)
+                response = await conn.request("POST", "/command/", body)
+            result = json.loads(response)
+            self.request_latencies[path].append(time.perf_counter() - current.started)
+            n += 1
+            if result.get("action") != action:
+                self.errors += 1  # 503 busy / 504 timeout / misparsed
+                continue
+            state = "on" if action == "turn_on" else "off"
+            if not expected:
+                self.completed[path] += 1  # Nobody connected: the response is the whole trip
+                continue
+            try:
+                await asyncio.wait_for(current.done.wait(), DELIVERY_TIMEOUT)
+                self.completed[path] += 1
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+        conn.close()
+
+    async def run(self, server_pid: int) -> dict:
+        args = self.args
+        memory = {"idle_kb": process_rss_kb(server_pid)}
+        await self.connect(self.dashboard, args.dashboards)
+        memory["dashboards_kb"] = process_rss_kb(server_pid)
+        await self.connect(self.ws_board, args.ws_boards)
+        memory["ws_boards_kb"] = process_rss_kb(server_pid)
+        await self.connect(self.poll_board, args.poll_boards)
+        await asyncio.sleep(0.5)
+        memory["poll_boards_kb"] = process_rss_kb(server_pid)
+
+        conn = HTTPConnection(self.port)
+        if args.profile:
+            await conn.request("POST", f"/debug/profiler/start?duration={args.duration + 10}")
+        conn.close()
+        cpu_before, started = process_cpu_seconds(server_pid), time.perf_counter()
+        stop_at = time.monotonic() + args.duration
+        tags = itertools.count(int(time.time()))
+        await asyncio.gather(*(self.lane(i, device, stop_at, tags) for i, device in enumerate(DEVICE_TYPES)))
+        elapsed = time.perf_counter() - started
+        server_cpu = process_cpu_seconds(server_pid) - cpu_before
+        memory["loaded_kb"] = process_rss_kb(server_pid)
+        memory["peak_kb"] = process_rss_kb(server_pid, "VmHWM")
+
+        conn = HTTPConnection(self.port)  # uvicorn drops idle keep-alive connections after 5 s
+        if args.profile:
+            await conn.request("POST", "/debug/profiler/stop")
+        server = {"latency": json.loads(await conn.request("GET", "/commands/latency")),
+                  "ai_cache": json.loads(await conn.request("GET", "/ai/cache")),
+                  "ai_scheduler": json.loads(await conn.request("GET", "/ai/scheduler"))}
+        if args.profile:
+            server["profile"] = json.loads(await conn.request("GET", "/debug/profiler?limit=15"))["top"]
+        conn.close()
+
+        self.running = False
+        for ws in self.sockets:
+            await ws.close()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        commands = sum(self.completed.values())
+        latency = {path: {kind: percentiles(values) for (p, kind), values in self.tracker.latencies.items()
+                          if p == path} for path in ("fast", "slow")}
+        for path, values in self.request_latencies.items():
+            latency[path]["http_response"] = percentiles(values)
+        return {
+            "throughput": {"commands_per_s": round(commands / elapsed, 1), "commands": commands,
+                           "fast": self.completed["fast"], "slow": self.completed["slow"],
+                           "errors": self.errors, "timeouts": self.timeouts,
+                           "server_cpu_ms_per_command": round(server_cpu / commands * 1000, 3) if commands else None},
+            "latency_ms": latency,
+            "memory": {
+                **memory,
+                "per_dashboard_kb": round((memory["dashboards_kb"] - memory["idle_kb"]) / max(1, args.dashboards), 1),
+                "per_ws_board_kb": round((memory["ws_boards_kb"] - memory["dashboards_kb"]) / max(1, args.ws_boards), 1),
+                "per_poll_board_kb": round((memory["poll_boards_kb"] - memory["ws_boards_kb"])
+                                           / max(1, args.poll_boards), 1),
+            },
+            "server": server,
+        }
+
+
+def start_server(scratch: str, port: int, llm_latency: float) -> subprocess.Popen:
+    stub_dir = os.path.join(scratch, "stub")
+    os.makedirs(stub_dir)
+    with open(os.path.join(stub_dir, "ollama.py"), "w") as f:
+        f.write(STUB_OLLAMA)
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [stub_dir, os.environ.get("PYTHONPATH")])),
+           "SMART_HOME_DB_PATH": os.path.join(scratch, "database.db"),
+           "SMART_HOME_BROKER_PATH": os.path.join(scratch, "broker.db"),
+           "SMART_HOME_LOG_LEVEL": "WARNING", "SMART_HOME_STUB_LLM_LATENCY": str(llm_latency)}
+    log = open(os.path.join(scratch, "server.log"), "w")
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def flatten(data: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(baseline: dict, results: dict):
+    print(f"\nvs. {baseline['commit']} ({baseline['timestamp']}):")
+    old = flatten({k: baseline.get(k, {}) for k in ("throughput", "latency_ms", "memory")})
+    new = flatten({k: results[k] for k in ("throughput", "latency_ms", "memory")})
+    for key in sorted(old.keys() & new.keys()):
+        if key.endswith(".count") or not old[key]:
+            continue
+        change = (new[key] - old[key]) / old[key] * 100
+        print(f"  {key:42} {old[key]:>12,.2f} -> {new[key]:>12,.2f}  {change:+7.1f}%")
+
+
+def report(results: dict):
+    t = results["throughput"]
+    print(f"{t['commands_per_s']:,.1f} commands/s ({t['fast']} fast, {t['slow']} slow, {t['errors']} errors, "
+          f"{t['timeouts']} timeouts), server CPU {t['server_cpu_ms_per_command']} ms/command")
+    print(f"\n{'latency ms':24} {'p50':>9} {'p95':>9} {'p99':>9} {'count':>8}")
+    for path, kinds in results["latency_ms"].items():
+        for kind, p in sorted(kinds.items()):
+            if p["count"]:
+                print(f"  {path + ' ' + kind:22} {p['p50']:9.2f} {p['p95']:9.2f} {p['p99']:9.2f} {p['count']:8}")
+    m = results["memory"]
+    print(f"\nserver RSS: idle {m['idle_kb'] / 1024:.1f} MB, loaded {m['loaded_kb'] / 1024:.1f} MB, "
+          f"peak {m['peak_kb'] / 1024:.1f} MB; per dashboard {m['per_dashboard_kb']} kB, "
+          f"per WebSocket board {m['per_ws_board_kb']} kB, per polling board {m['per_poll_board_kb']} kB")
+    if "profile" in results["server"]:
+        print("\nserver event loop, by self time:")
+        for row in results["server"]["profile"][:10]:
+            print(f"  {row['self_pct']:5.1f}%  {row['function']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dashboards", type=int, default=100)
+    parser.add_argument("--ws-boards", type=int, default=20)
+    parser.add_argument("--poll-boards", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--slow-share", type=float, default=0.1, help="Share of commands for the LLM")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Stub inference time in seconds")
+    parser.add_argument("--profile", action="store_true", help="Sample the server's event loop during the run")
+    parser.add_argument("--output", default=None, help="Results file (default: results/end_to_end-<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    scratch = tempfile.mkdtemp(prefix="smart-home-bench-")
+    port = free_port()
+    server = start_server(scratch, port, args.llm_latency)
+    try:
+        try:
+            asyncio.run(wait_until_up(port, 1))
+        except RuntimeError:
+            with open(os.path.join(scratch, "server.log")) as f:
+                sys.exit("server did not start:\n" + f.read()[-2000:])
+        print(f"commit {commit}: {args.dashboards} dashboards, {args.ws_boards} WebSocket boards, "
+              f"{args.poll_boards} polling boards, {len(DEVICE_TYPES)} device lanes for {args.duration:.0f} s, "
+              f"{args.slow_share:.0%} slow path ({args.llm_latency * 1000:.0f} ms stub LLM)\n")
+        results = asyncio.run(LoadTest(args, port).run(server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    results = {"commit": commit, "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+               "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")}, **results}
+    report(results)
+    output = args.output or os.path.join(RESULTS_DIR, f"end_to_end-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Fast-path intent matching microbenchmark (commands per second).
+
+Compares the original per-call implementation (pattern string + number_map
+rebuilt inside process_command) with the precompiled, registry-driven
+match_intent, both cold (every utterance unique) and warm (repeated phrases
+served from the LRU cache).
+
+Run from the backend directory:
+    python benchmarks/bench_intents.py
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ai_service import match_intent, normalize_command  # noqa: E402
+
+ITERATIONS = 200_000
+
+PHRASES = [
+    "turn on the light",
+    "turn off the fan",
+    "switch on the kitchen light",
+    "turn off number 4",
+    "switch off everything",
+    "turn on the home theater",
+    "turn on 5",
+    "what's the weather like",  # falls through to the slow path
+]
+
+
+def legacy_fast_path(command_text):
+    """The fast path as it was before the intent table, minus prints and context."""
+    command_text = command_text.lower().strip()
+    match = re.search(r"(turn|switch)\s+(on|off)\s+(?:the\s+)?(?:(\w+)\s+)?(light|fan|relay|tv|fridge|refrigerator|home theater|hometheater|ac|heater|all|everything|number \d+|\d+)", command_text)
+    if not match:
+        return None
+    action_word = match.group(2)
+    location = match.group(3) or "unknown"
+    device_raw = match.group(4)
+    number_map = {
+        '1': 'light',
+        '2': 'fan',
+        '3': 'kitchen light',
+        '4': 'refrigerator',
+        '5': 'tv',
+        '6': 'hometheater'
+    }
+    num_match = re.search(r"\d+", device_raw)
+    if num_match:
+        num = num_match.group(0)
+        if num in number_map:
+            device_raw = number_map[num]
+    if device_raw in ["fridge", "refrigerator"]: device_raw = "refrigerator"
+    if device_raw in ["home theater", "hometheater"]: device_raw = "hometheater"
+    action = "turn_on" if action_word == "on" else "turn_off"
+    return action, action_word, device_raw, location
+
+
+def new_fast_path(command_text):
+    return match_intent(normalize_command(command_text))
+
+
+def run(label, fn, inputs):
+    start = time.perf_counter()
+    for text in inputs:
+        fn(text)
+    elapsed = time.perf_counter() - start
+    rate = len(inputs) / elapsed
+    print(f"{label:32} {rate:12,.0f} cmd/s   {1e6 / rate:7.2f} us/cmd")
+
+
+def main():
+    repeated = [PHRASES[i % len(PHRASES)] for i in range(ITERATIONS)]
+    # Unique utterances defeat the cache and measure the compiled matcher itself
+    unique = [f"{PHRASES[i % len(PHRASES)]} {i}x" for i in range(ITERATIONS)]
+
+    print(f"{ITERATIONS:,} commands per run\n")
+    run("legacy (repeated phrases)", legacy_fast_path, repeated)
+    match_intent.cache_clear()
+    run("compiled, cold cache (unique)", new_fast_path, unique)
+    match_intent.cache_clear()
+    run("compiled + LRU (repeated)", new_fast_path, repeated)
+    print(f"\ncache: {match_intent.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Slow-path load test: unbounded threadpool vs. the InferenceScheduler.
+
+A fake Ollama models CPU contention: each inference takes BASE_LATENCY times
+the number of inferences running when it starts, like a small box sharing
+its cores. A burst of slow-path commands (Zipf-distributed utterances, so
+some repeat while in flight) is fired either straight into run_in_threadpool
+(the old behaviour) or through the scheduler. Reports p50/p99 latency of
+answered requests, fast "busy" rejections and how many inferences ran.
+
+Run from the backend directory:
+    python benchmarks/bench_llm_scheduler.py
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi.concurrency import run_in_threadpool  # noqa: E402
+
+from ai_service import AIService  # noqa: E402
+from llm_scheduler import InferenceScheduler, SchedulerBusy  # noqa: E402
+from semantic_cache import normalize_key  # noqa: E402
+
+BASE_LATENCY = 0.1   # Seconds for one inference with the CPU to itself
+REQUESTS = 200
+ARRIVAL_RATE = 40    # Requests per second during the burst
+DISTINCT = 80        # Distinct utterances in the burst
+
+
+class ContendedOllama:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.calls = 0
+
+    def chat(self, model, messages):
+        with self.lock:
+            self.active += 1
+            self.calls += 1
+            load = self.active
+        try:
+            time.sleep(BASE_LATENCY * load)
+        finally:
+            with self.lock:
+                self.active -= 1
+        body = json.dumps({"action": "turn_on", "device_type": "light",
+                           "location": "unknown", "response_text": "OK."})
+        return {"message": {"content": body}}
+
+
+def burst():
+    rng = random.Random(7)
+    weights = [1 / (i + 1) for i in range(DISTINCT)]
+    t = 0.0
+    for _ in range(REQUESTS):
+        t += rng.expovariate(ARRIVAL_RATE)
+        n = rng.choices(range(DISTINCT), weights)[0]
+        yield t, f"set the mood for evening number {n}"
+
+
+async def run(label, call):
+    latencies, busy, failed = [], 0, 0
+    start = time.perf_counter()
+
+    async def one(at, text):
+        nonlocal busy, failed
+        await asyncio.sleep(at)
+        t0 = time.perf_counter()
+        try:
+            await call(text)
+            latencies.append(time.perf_counter() - t0)
+        except SchedulerBusy:
+            busy += 1
+        except asyncio.TimeoutError:
+            failed += 1
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(one(at, text) for at, text in burst()))
+    total = time.perf_counter() - start
+
+    ms = sorted(x * 1000 for x in latencies)
+    p99 = ms[min(len(ms) - 1, int(len(ms) * 0.99))] if ms else 0.0
+    p50 = statistics.median(ms) if ms else 0.0
+    print(f"{label:28} answered={len(ms):4d} busy={busy:4d} timeout={failed:3d} "
+          f"p50={p50:8.0f} ms  p99={p99:8.0f} ms  wall={total:5.1f} s", end="")
+
+
+async def main():
+    print(f"{REQUESTS} slow-path requests at {ARRIVAL_RATE}/s, {DISTINCT} distinct utterances, "
+          f"{BASE_LATENCY * 1000:.0f} ms base inference\n")
+
+    llm = ContendedOllama()
+    service = AIService(client=llm)
+    await run("unbounded threadpool", lambda text: run_in_threadpool(service.resolve_slow, text))
+    print(f"  inferences={llm.calls}")
+
+    for concurrency, max_queue in ((2, 16), (4, 32)):
+        llm = ContendedOllama()
+        service = AIService(client=llm)
+        scheduler = InferenceScheduler(concurrency=concurrency, max_queue=max_queue, timeout=10)
+        await run(f"scheduler c={concurrency} q={max_queue}",
+                  lambda text: scheduler.submit(normalize_key(text), service.resolve_slow, text))
+        print(f"  inferences={llm.calls} coalesced={scheduler.coalesced}")
+        await scheduler.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+"""
+Idle-device load test for GET /device: short polling vs long polling.
+
+Starts one uvicorn worker running main:app in a subprocess, then simulates N
+idle ESP32 boards (no commands are ever issued):
+  - short: each board polls every SHORT_INTERVAL seconds (today's firmware loop)
+  - long:  each board holds GET /device?wait=LONG_WAIT open and re-polls on timeout
+
+For every N it reports the request rate the server handled, the rate the boards
+asked for, and the worker's CPU usage. When short polling falls behind its target
+rate or pins the CPU, the worker can't sustain that many boards.
+
+Run from the backend directory:
+    python benchmarks/bench_long_poll.py [--devices 100,500,1000] [--duration 10]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SHORT_INTERVAL = 0.5  # seconds between polls for a short-polling board
+LONG_WAIT = 20        # seconds a long-poll request is held open
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def cpu_seconds(pid: int) -> float:
+    """User + system CPU time of a process, from /proc (Linux only)."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf(os.sysconf_names["SC_CLK_TCK"])
+    return (int(fields[11]) + int(fields[12])) / ticks
+
+
+class Board:
+    """
+    Minimal keep-alive HTTP/1.1 client, one TCP connection per board like the
+    firmware. Much lighter than a general-purpose client, so the load generator
+    is not the bottleneck.
+    """
+
+    def __init__(self, port: int, device_id: str):
+        self.port = port
+        self.device_id = device_id
+        self.reader = self.writer = None
+
+    async def get(self, query: str) -> bytes:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+        self.writer.write(
+            f"GET /device?device_id={self.device_id}{query} HTTP/1.1\r\n"
+            f"Host: hub\r\n\r\n".encode()
+        )
+        headers = await self.reader.readuntil(b"\r\n\r\n")
+        length = 0
+        for line in headers.split(b"\r\n"):
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":", 1)[1])
+        return await self.reader.readexactly(length)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def wait_until_up(port: int):
+    for _ in range(100):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def short_poller(board, stop_at, counter):
+    while time.monotonic() < stop_at:
+        try:
+            await board.get("")
+            counter[0] += 1
+        except (OSError, asyncio.IncompleteReadError):
+            counter[1] += 1
+            board.writer = None
+        await asyncio.sleep(SHORT_INTERVAL)
+
+
+async def long_poller(board, stop_at, counter):
+    while time.monotonic() < stop_at:
+        try:
+            await board.get(f"&wait={LONG_WAIT}")
+            counter[0] += 1
+        except (OSError, asyncio.IncompleteReadError):
+            counter[1] += 1
+            board.writer = None
+
+
+async def run_mode(mode, n, duration, port, pid):
+    counter = [0, 0]  # completed requests, errors
+    poller = short_poller if mode == "short" else long_poller
+    boards = [Board(port, f"esp32-{i}") for i in range(n)]
+    stop_at = time.monotonic() + duration
+    cpu_start = cpu_seconds(pid)
+    started = time.monotonic()
+    tasks = [asyncio.create_task(poller(board, stop_at, counter)) for board in boards]
+    # Long pollers are still parked at the deadline; measure, then cancel them
+    await asyncio.sleep(duration)
+    elapsed = time.monotonic() - started
+    cpu = cpu_seconds(pid) - cpu_start
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for board in boards:
+        board.close()
+
+    # Idle long-pollers only complete a request every LONG_WAIT seconds
+    target = n / SHORT_INTERVAL if mode == "short" else n / LONG_WAIT
+    return {
+        "mode": mode,
+        "devices": n,
+        "req_per_s": counter[0] / elapsed,
+        "target_req_per_s": target,
+        "cpu_pct": 100.0 * cpu / elapsed,
+        "errors": counter[1],
+    }
+
+
+async def main(devices, duration):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--log-level", "warning", "--workers", "1"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        await wait_until_up(port)
+        print(f"short interval={SHORT_INTERVAL}s  long wait={LONG_WAIT}s  duration={duration}s\n")
+        print(f"{'mode':6} {'devices':>8} {'req/s':>10} {'target':>10} {'cpu%':>7} {'errors':>7}")
+        for n in devices:
+            for mode in ("short", "long"):
+                r = await run_mode(mode, n, duration, port, server.pid)
+                print(f"{r['mode']:6} {r['devices']:8d} {r['req_per_s']:10.1f} "
+                      f"{r['target_req_per_s']:10.1f} {r['cpu_pct']:7.1f} {r['errors']:7d}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", default="100,500,1000")
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+    asyncio.run(main([int(n) for n in args.devices.split(",")], args.duration))
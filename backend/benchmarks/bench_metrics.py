@@ -0,0 +1,69 @@
+"""
+Per-command observability cost: the old print() calls vs. level-gated
+logging plus the /metrics counters and histograms.
+
+  - print:    the f-string prints a fast-path command used to make (3 lines),
+              written to /dev/null (a real terminal or journald is slower)
+  - logging:  the same messages as logger.debug at the default INFO level
+  - metrics:  intents_total.inc + intent_seconds.observe + broadcast_seconds.observe
+  - render:   one /metrics scrape with every series populated
+
+Run from the backend directory:
+    python benchmarks/bench_metrics.py
+"""
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from metrics import broadcast_seconds, intent_seconds, intents_total, registry  # noqa: E402
+
+COMMANDS = 200_000
+RESULT = {"action": "turn_on", "device_type": "light", "location": "unknown",
+          "response_text": "OK, turning on the light."}
+
+
+def bench(label: str, fn, n: int = COMMANDS):
+    started = time.perf_counter()
+    for _ in range(n):
+        fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<10} {elapsed / n * 1e6:8.3f} us/call")
+
+
+def main():
+    devnull = open(os.devnull, "w")
+
+    def with_print():
+        print(f"Processing command: {'turn on the light'}", file=devnull)
+        print(f"⚡ FAST PATH TRIGGERED: {'turn_on'} {'light'}", file=devnull)
+        print(f"AI Result: {RESULT}", file=devnull)
+
+    logger = logging.getLogger("smart_home.bench")
+    logger.setLevel(logging.INFO)
+
+    def with_logging():
+        logger.debug("Processing command: %s", "turn on the light")
+        logger.debug("Fast path: %s %s", "turn_on", "light")
+        logger.debug("AI result: %s", RESULT)
+
+    def with_metrics():
+        intents_total.inc("fast")
+        intent_seconds.observe(0.00004, "fast")
+        broadcast_seconds.observe(0.00002, "clients")
+
+    bench("print", with_print)
+    bench("logging", with_logging)
+    bench("metrics", with_metrics)
+
+    for path in ("fast", "followup", "cache", "miss", "slow", "error"):
+        intents_total.inc(path)
+        intent_seconds.observe(0.01, path)
+    bench("render", registry.render, 2_000)
+    print(f"/metrics body: {len(registry.render())} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Multi-worker load test: command throughput for 1, 2, 4 ... uvicorn workers
+sharing state through the SQLite broker (SMART_HOME_STATE_BACKEND=sqlite),
+against the single-process in-memory baseline.
+
+For every worker count it starts `uvicorn main:app --workers N` on a scratch
+database and broker, then:
+  1. Consistency: opens dashboards (spread over the workers by the kernel),
+     sends one command over HTTP and checks that every dashboard saw it, and
+     that commands queued for a polling board are handed out exactly once
+     however many connections poll it.
+  2. Throughput: load-generator processes POST fast-path commands over
+     keep-alive connections for --duration seconds (req/s, p50/p99).
+
+Throughput scales with workers only up to the number of free cores; the load
+generators need cores too, so run it on a machine with several.
+
+Run from the backend directory:
+    python benchmarks/bench_multi_worker.py [--workers 1,2,4] [--duration 10]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+COMMANDS = [b'{"text": "turn on the light"}', b'{"text": "turn off the light"}',
+            b'{"text": "turn on the fan"}', b'{"text": "turn off the fan"}']
+# Keep-alive connections per load-generator process
+CONNECTIONS = 16
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class HTTPConnection:
+    """Minimal keep-alive HTTP/1.1 client, light enough not to be the bottleneck."""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, body: bytes = b"") -> bytes:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: hub\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        headers = await self.reader.readuntil(b"\r\n\r\n")
+        length = 0
+        for line in headers.split(b"\r\n"):
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":", 1)[1])
+        return await self.reader.readexactly(length)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def wait_until_up(port: int, workers: int):
+    """Waits until every worker has joined the bus (GET /cluster reports them all)."""
+    conn = HTTPConnection(port)
+    for _ in range(300):
+        try:
+            stats = json.loads(await conn.request("GET", "/cluster"))
+            if stats["workers"] >= workers:
+                conn.close()
+                return
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            conn = HTTPConnection(port)
+        await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def check_consistency(port: int, workers: int) -> str:
+    # Dashboards land on whichever worker accepts them
+    dashboards = [await websockets.connect(f"ws://127.0.0.1:{port}/ws/client") for _ in range(4 * workers)]
+    for ws in dashboards:
+        for _ in range(6):  # Initial state
+            await ws.recv()
+    conn = HTTPConnection(port)
+    await conn.request("POST", "/command/", b'{"text": "turn on the tv"}')
+    seen = 0
+    for ws in dashboards:
+        try:
+            while await asyncio.wait_for(ws.recv(), 2) != "ACTION:turn_on:tv":
+                pass
+            seen += 1
+        except asyncio.TimeoutError:
+            pass
+    for ws in dashboards:
+        await ws.close()
+
+    # Commands for distinct relays, polled over several connections (so several workers)
+    issued = ["turn on the light", "turn on the fan", "turn on the fridge", "turn off the tv"]
+    await conn.request("GET", "/device?device_id=bench-board")  # Registers the board
+    for text in issued:
+        await conn.request("POST", "/command/", json.dumps({"text": text}).encode())
+    await asyncio.sleep(0.2)
+    pollers = [HTTPConnection(port) for _ in range(4 * workers)]
+    received = []
+    for _ in range(3):
+        for poller in pollers:
+            body = (await poller.request("GET", "/device?device_id=bench-board")).decode()
+            if body != "idle":
+                received.append(body)
+    for poller in pollers + [conn]:
+        poller.close()
+    return (f"dashboards {seen}/{len(dashboards)} got the command, "
+            f"polled {len(received)} of {len(issued)} commands ({len(set(received))} distinct)")
+
+
+async def _generate(port: int, duration: float) -> list:
+    latencies = []
+    stop_at = time.monotonic() + duration
+
+    async def client(i: int):
+        conn = HTTPConnection(port)
+        n = i
+        while time.monotonic() < stop_at:
+            started = time.perf_counter()
+            await conn.request("POST", "/command/", COMMANDS[n % len(COMMANDS)])
+            latencies.append(time.perf_counter() - started)
+            n += 1
+        conn.close()
+
+    await asyncio.gather(*(client(i) for i in range(CONNECTIONS)))
+    return latencies
+
+
+def load_generator(port: int, duration: float, results):
+    results.put(asyncio.run(_generate(port, duration)))
+
+
+def measure_throughput(port: int, duration: float, generators: int):
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=load_generator, args=(port, duration, results))
+             for _ in range(generators)]
+    for p in procs:
+        p.start()
+    latencies = []
+    for _ in procs:
+        latencies.extend(results.get())
+    for p in procs:
+        p.join()
+    latencies.sort()
+    if not latencies:
+        return 0.0, 0.0, 0.0
+    return (len(latencies) / duration, latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000)
+
+
+def run(backend: str, workers: int, duration: float, generators: int):
+    scratch = tempfile.mkdtemp(prefix="smart-home-bench-")
+    port = free_port()
+    env = {**os.environ, "SMART_HOME_STATE_BACKEND": backend,
+           "SMART_HOME_DB_PATH": os.path.join(scratch, "database.db"),
+           "SMART_HOME_BROKER_PATH": os.path.join(scratch, "broker.db"),
+           "SMART_HOME_LOG_LEVEL": "WARNING"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--log-level", "warning", "--workers", str(workers)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        asyncio.run(wait_until_up(port, workers if backend == "sqlite" else 1))
+        consistency = asyncio.run(check_consistency(port, workers))
+        req_per_s, p50, p99 = measure_throughput(port, duration, generators)
+        print(f"{backend:7} {workers:8d} {req_per_s:10.0f} {p50:9.1f} {p99:9.1f}   {consistency}")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--generators", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    args = parser.parse_args()
+
+    print(f"cores={os.cpu_count()}  load generators={args.generators} x {CONNECTIONS} connections  "
+          f"duration={args.duration}s\n")
+    print(f"{'backend':7} {'workers':>8} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9}   consistency")
+    run("memory", 1, args.duration, args.generators)
+    for workers in (int(n) for n in args.workers.split(",")):
+        run("sqlite", workers, args.duration, args.generators)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Semantic cache benchmark for the AIService slow path, against a stub Ollama.
+
+Replays a workload of LLM-bound phrasings (with punctuation / filler-word
+variants) through AIService with and without the SemanticCache, then
+"restarts" by building a fresh cache on the same SQLite file to show entries
+survive. Reports hit rate and LLM time saved.
+
+Run from the backend directory:
+    python benchmarks/bench_semantic_cache.py
+"""
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlmodel import SQLModel, create_engine  # noqa: E402
+
+from ai_service import AIService  # noqa: E402
+from semantic_cache import SemanticCache  # noqa: E402
+
+LLM_LATENCY = 0.02   # Stub inference time per call (real CPU inference is seconds)
+COMMANDS = 1000
+
+# (utterance, intent the stub LLM returns)
+BASE_PHRASES = [
+    ("could you switch the kitchen lamp off", ("turn_off", "kitchen light")),
+    ("could you switch the kitchen lamp on", ("turn_on", "kitchen light")),
+    ("make it breezy in here", ("turn_on", "fan")),
+    ("i'm going to watch a movie", ("turn_on", "tv")),
+    ("kill the lights in the bedroom", ("turn_off", "light")),
+    ("it's too dark in the bedroom", ("turn_on", "light")),
+    ("shut down the telly", ("turn_off", "tv")),
+    ("power up the sound system", ("turn_on", "hometheater")),
+]
+VARIANTS = ["{}", "{}.", "please {}", "{} please", "hey, {}!", "{} now"]
+
+
+class StubOllama:
+    """Answers like mistral would, after a fixed delay."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self.intents = {text: intent for text, intent in BASE_PHRASES}
+
+    def chat(self, model, messages):
+        self.calls += 1
+        time.sleep(self.latency)
+        prompt = messages[0]["content"]
+        action, device = "turn_on", "light"
+        for text, intent in self.intents.items():
+            if text in prompt:
+                action, device = intent
+        body = json.dumps({"action": action, "device_type": device,
+                           "location": "unknown", "response_text": "OK."})
+        return {"message": {"content": f"```json\n{body}\n```"}}
+
+
+def workload(n):
+    rng = random.Random(42)
+    weights = [1 / (i + 1) for i in range(len(BASE_PHRASES))]  # Zipf-ish
+    out = []
+    for _ in range(n):
+        text, _ = rng.choices(BASE_PHRASES, weights)[0]
+        out.append(rng.choice(VARIANTS).format(text))
+    return out
+
+
+def replay(service, commands):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for text in commands:
+            service.process_command(text)
+    return time.perf_counter() - start
+
+
+def main():
+    commands = workload(COMMANDS)
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{db_path}")
+    SQLModel.metadata.create_all(engine)
+
+    print(f"{COMMANDS} slow-path commands, stub LLM latency {LLM_LATENCY * 1000:.0f} ms\n")
+
+    stub = StubOllama(LLM_LATENCY)
+    uncached = replay(AIService(client=stub), commands)
+    print(f"no cache:       {uncached:7.2f} s   LLM calls={stub.calls}")
+
+    for label, threshold in (("exact only", None), ("exact + fuzzy", 0.8)):
+        stub = StubOllama(LLM_LATENCY)
+        cache = SemanticCache(engine, fuzzy_threshold=threshold)
+        cache.clear()
+        elapsed = replay(AIService(client=stub, cache=cache), commands)
+        s = cache.stats()
+        print(f"{label + ':':15} {elapsed:7.2f} s   LLM calls={stub.calls:4d}   "
+              f"hit rate={s['hit_rate']:6.1%}   saved={s['seconds_saved']:.2f} s")
+
+    # Simulated restart: a fresh cache on the same database
+    stub = StubOllama(LLM_LATENCY)
+    cache = SemanticCache(engine)
+    elapsed = replay(AIService(client=stub, cache=cache), commands)
+    s = cache.stats()
+    print(f"{'after restart:':15} {elapsed:7.2f} s   LLM calls={stub.calls:4d}   "
+          f"hit rate={s['hit_rate']:6.1%}   entries loaded={s['entries']}")
+
+
+if __name__ == "__main__":
+    main()
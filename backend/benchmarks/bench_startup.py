@@ -0,0 +1,157 @@
+"""
+Cold start: import time and time to the first answered requests.
+
+  1. `import main` in a fresh interpreter, with the Ollama client imported
+     eagerly (as before) vs. lazily on first slow-path use.
+  2. `uvicorn main:app` from process start to the first GET / answer, then
+     the first fast-path command, GET /devices/ and slow-path command:
+       - first boot on an empty database (create_all runs)
+       - restart, eager client import (the old startup)
+       - restart (schema check skipped via user_version, client lazy)
+       - restart with SMART_HOME_WARMUP=fast / llm
+     The slow-path command is sent a second after the server is up. OLLAMA_HOST
+     points at a closed port, so it measures the client import (unless a
+     warm-up did it) plus a refused connection, not inference.
+  3. The schema check itself: create_all on an up-to-date file vs. user_version.
+
+Run from the backend directory:
+    python benchmarks/bench_startup.py [--repeat 5]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_multi_worker import BACKEND_DIR, HTTPConnection, free_port  # noqa: E402
+
+IMPORT_EAGER = "import time; t = time.perf_counter(); import ollama, main; print(time.perf_counter() - t)"
+IMPORT_LAZY = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+# The old startup: the client is already imported when main loads
+SERVE_EAGER = "import sys, ollama, uvicorn; uvicorn.run('main:app', port=int(sys.argv[1]), log_level='warning')"
+SERVE = "import sys, uvicorn; uvicorn.run('main:app', port=int(sys.argv[1]), log_level='warning')"
+
+SCHEMA_CHECK = """
+import time
+from sqlmodel import SQLModel
+import models
+from database import create_db_and_tables, engine
+create_db_and_tables()
+runs = 50
+t = time.perf_counter()
+for _ in range(runs):
+    SQLModel.metadata.create_all(engine)
+create_all = (time.perf_counter() - t) / runs
+t = time.perf_counter()
+for _ in range(runs):
+    create_db_and_tables()
+check = (time.perf_counter() - t) / runs
+print(create_all, check)
+"""
+
+
+def environment(db_path: str, **extra) -> dict:
+    return {**os.environ, "SMART_HOME_DB_PATH": db_path, "SMART_HOME_LOG_LEVEL": "WARNING",
+            "OLLAMA_HOST": f"127.0.0.1:{free_port()}", **extra}
+
+
+def time_import(code: str, db_path: str) -> float:
+    out = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=environment(db_path),
+                         capture_output=True, text=True, check=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+async def first_requests(port: int, launched: float) -> dict:
+    timings = {}
+    while True:
+        conn = HTTPConnection(port)
+        try:
+            await conn.request("GET", "/")
+            timings["ready"] = time.perf_counter() - launched
+            break
+        except (OSError, asyncio.IncompleteReadError):
+            conn.close()
+            await asyncio.sleep(0.005)
+    for label, method, path, body in (("fast command", "POST", "/command/", b'{"text": "turn on the fan"}'),
+                                      ("GET /devices/", "GET", "/devices/", b""),
+                                      ("slow, 1 s in", "POST", "/command/", b'{"text": "make it breezy"}')):
+        if label.startswith("slow"):
+            # Gives a background warm-up the time a real LLM request would arrive in
+            conn.close()
+            await asyncio.sleep(max(0.0, launched + timings["ready"] + 1 - time.perf_counter()))
+            conn = HTTPConnection(port)
+        started = time.perf_counter()
+        await conn.request(method, path, body)
+        timings[label] = time.perf_counter() - started
+    conn.close()
+    return timings
+
+
+def serve_once(code: str, db_path: str, **extra) -> dict:
+    port = free_port()
+    launched = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-c", code, str(port)], cwd=BACKEND_DIR,
+                              env=environment(db_path, **extra), stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        return asyncio.run(first_requests(port, launched))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def median_of(runs) -> dict:
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="smart-home-bench-")
+    db_path = os.path.join(scratch, "database.db")
+    try:
+        print("import main")
+        eager = statistics.median(time_import(IMPORT_EAGER, db_path) for _ in range(args.repeat))
+        lazy = statistics.median(time_import(IMPORT_LAZY, db_path) for _ in range(args.repeat))
+        print(f"  eager Ollama client {eager * 1000:8.0f} ms\n  lazy               {lazy * 1000:8.0f} ms"
+              f"   ({(eager - lazy) * 1000:.0f} ms saved)")
+
+        cases = []
+        fresh = []
+        for i in range(args.repeat):
+            path = os.path.join(scratch, f"fresh-{i}.db")
+            fresh.append(serve_once(SERVE, path))
+        cases.append(("first boot, empty db", median_of(fresh)))
+        serve_once(SERVE, db_path)  # The restarts below find the schema in place
+        cases.append(("restart, eager client", median_of([serve_once(SERVE_EAGER, db_path)
+                                                          for _ in range(args.repeat)])))
+        cases.append(("restart", median_of([serve_once(SERVE, db_path) for _ in range(args.repeat)])))
+        for warmup in ("fast", "llm"):
+            cases.append((f"restart, warm-up {warmup}",
+                          median_of([serve_once(SERVE, db_path, SMART_HOME_WARMUP=warmup)
+                                     for _ in range(args.repeat)])))
+
+        labels = list(cases[0][1])
+        print(f"\n{'uvicorn main:app (ms)':24}" + "".join(f"{label:>15}" for label in labels))
+        for name, timings in cases:
+            print(f"  {name:22}" + "".join(f"{timings[label] * 1000:15.1f}" for label in labels))
+
+        out = subprocess.run([sys.executable, "-c", SCHEMA_CHECK], cwd=BACKEND_DIR, env=environment(db_path),
+                             capture_output=True, text=True, check=True).stdout
+        create_all, check = (float(x) for x in out.split())
+        print(f"\nschema on an up-to-date file: create_all {create_all * 1000:.2f} ms, "
+              f"user_version check {check * 1000:.2f} ms")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Device-state persistence throughput: per-event commits vs. write-behind batches.
+
+Writes EVENTS state changes to a temporary SQLite database:
+  - per-event: one DeviceLog row + commit per change, on the event loop
+    (what a naive synchronous implementation would do)
+  - write-behind: StateWriter.record() per change, drained in batches
+Reports sustained events per second and the worst event-loop stall seen by
+a 1 ms ticker running alongside (i.e. how long WebSockets would freeze).
+The batches are written from the threadpool, so what reaches the loop is
+the GIL hand-off and the garbage collector: write-behind allocates enough
+to trigger full collections, which scan every imported object. It is
+measured before and after gc.freeze(), which the app calls at startup.
+
+Run from the backend directory:
+    python benchmarks/bench_state_writer.py
+"""
+import asyncio
+import gc
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlmodel import Session, SQLModel, create_engine  # noqa: E402
+
+from device_registry import DEVICE_TYPES  # noqa: E402
+from models import DeviceLog  # noqa: E402
+from state_store import StateWriter  # noqa: E402
+
+EVENTS = 20_000
+
+
+def fresh_engine():
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+def events():
+    for i in range(EVENTS):
+        yield DEVICE_TYPES[i % len(DEVICE_TYPES)], "on" if (i // len(DEVICE_TYPES)) % 2 else "off"
+
+
+async def ticker(stop, stalls):
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(0.001)
+        now = time.perf_counter()
+        stalls.append(now - last)
+        last = now
+
+
+async def measure(label, body, n=EVENTS):
+    stop, stalls = asyncio.Event(), []
+    tick = asyncio.create_task(ticker(stop, stalls))
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    await body()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+    print(f"{label:14} {n / elapsed:10,.0f} events/s   "
+          f"worst loop stall={max(stalls) * 1000:8.1f} ms")
+
+
+async def main():
+    print(f"{EVENTS:,} state changes\n")
+
+    engine = fresh_engine()
+    n_naive = EVENTS // 10  # per-event commits are slow; a sample is enough
+
+    async def per_event():
+        for i, (device, state) in enumerate(events()):
+            if i >= n_naive:
+                break
+            with Session(engine) as session:
+                session.add(DeviceLog(device_type=device, action=f"turned_{state}"))
+                session.commit()
+            await asyncio.sleep(0)
+
+    await measure("per-event", per_event, n_naive)
+
+    for label in ("write-behind", "+ gc.freeze"):
+        if label == "+ gc.freeze":
+            gc.collect()
+            gc.freeze()
+        writer = StateWriter(fresh_engine())
+        await writer.start()
+
+        async def write_behind():
+            for i, (device, state) in enumerate(events()):
+                writer.record(device, state)
+                if i % 100 == 0:
+                    await asyncio.sleep(0)  # Let the loop breathe like a real server
+            await writer.flush()
+
+        await measure(label, write_behind)
+        stats = writer.stats()
+        await writer.stop()
+    print(f"\nwrite-behind: {stats}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+"""
+Frames and bytes per command for the text and compact WebSocket protocols.
+
+Connects CLIENTS fake dashboards and BOARDS fake ESP32s to the real
+ConnectionManager, then runs commands through the dispatcher and counts
+what each socket would have put on the wire:
+  - connect:  the initial state sent to one new dashboard
+  - single:   "turn on the light"
+  - all:      "turn everything on/off"
+"+deflate" estimates permessage-deflate (the default in uvicorn's websockets
+implementation when the browser offers it): one compressor per socket with
+context takeover, as RFC 7692 does.
+
+Run from the backend directory:
+    python benchmarks/bench_ws_protocol.py
+"""
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from command_queue import CommandQueue  # noqa: E402
+from connection_manager import ConnectionManager  # noqa: E402
+from dispatcher import CommandDispatcher  # noqa: E402
+from ws_protocol import PROTO_COMPACT, PROTO_MSGPACK, PROTO_TEXT, msgpack  # noqa: E402
+
+CLIENTS = 500
+BOARDS = 20
+ROUNDS = 10
+
+
+class FakeSocket:
+    def __init__(self, protocol: str):
+        self.query_params = {"proto": protocol}
+        self.headers = {}
+        self.frames = 0
+        self.bytes = 0
+        self.deflated = 0
+        self._deflate = zlib.compressobj(wbits=-15)
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    def _count(self, data: bytes):
+        self.frames += 1
+        self.bytes += len(data)
+        # Sync-flushed deflate block minus the 00 00 ff ff tail, per RFC 7692
+        self.deflated += len(self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+    async def send_text(self, message: str):
+        self._count(message.encode())
+
+    async def send_bytes(self, message: bytes):
+        self._count(message)
+
+    async def close(self, code: int = 1000):
+        pass
+
+    def reset(self):
+        self.frames = self.bytes = self.deflated = 0
+
+
+def totals(sockets):
+    return (sum(s.frames for s in sockets), sum(s.bytes for s in sockets),
+            sum(s.deflated for s in sockets))
+
+
+async def flush(manager):
+    for channel in list(manager.client_channels.values()):
+        await channel.flush()
+
+
+async def measure(protocol: str):
+    manager = ConnectionManager()
+    dispatcher = CommandDispatcher(manager, CommandQueue())
+    clients = [FakeSocket(protocol) for _ in range(CLIENTS)]
+    boards = [FakeSocket(protocol) for _ in range(BOARDS)]
+    for ws in clients:
+        await manager.connect_client(ws)
+    for i, ws in enumerate(boards):
+        await manager.connect_device(f"esp32-{i}", ws)
+    await flush(manager)
+
+    rows = [("connect", totals(clients[:1]), (0, 0, 0), 1)]
+    for label, intents in (
+        ("single", [{"action": "turn_on", "device_type": "light"},
+                    {"action": "turn_off", "device_type": "light"}]),
+        ("all", [{"action": "turn_on", "device_type": "all"},
+                 {"action": "turn_off", "device_type": "all"}]),
+    ):
+        for ws in clients + boards:
+            ws.reset()
+        for i in range(ROUNDS):
+            await dispatcher.dispatch_intent(intents[i % len(intents)])
+        await flush(manager)
+        rows.append((label, totals(clients), totals(boards), ROUNDS))
+
+    for channel in list(manager.client_channels.values()):
+        channel.close()
+    return rows
+
+
+async def main_async():
+    protocols = [PROTO_TEXT, PROTO_COMPACT] + ([PROTO_MSGPACK] if msgpack else [])
+    print(f"{CLIENTS} dashboards + {BOARDS} boards, per command (connect: per new dashboard)\n")
+    print(f"{'':8} {'protocol':9} {'client frames':>14} {'client bytes':>13} {'+deflate':>9}"
+          f" {'board frames':>13} {'board bytes':>12}")
+    for protocol in protocols:
+        with contextlib.redirect_stdout(io.StringIO()):
+            rows = await measure(protocol)
+        for label, (cf, cb, cd), (bf, bb, _), n in rows:
+            print(f"{label:8} {protocol:9} {cf / n:14,.0f} {cb / n:13,.0f} {cd / n:9,.0f}"
+                  f" {bf / n:13,.0f} {bb / n:12,.0f}")
+        print()
+    if not msgpack:
+        print("msgpack skipped (pip install msgpack)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main_async())
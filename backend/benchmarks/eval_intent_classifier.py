@@ -0,0 +1,269 @@
+"""
+Evaluates the local intent classifier tier (intent_classifier.py).
+
+A hand-written set of utterances, none of them copied from the training
+templates, is run through the resolution order without the LLM:
+  regex fast path -> local classifier -> (would go to Ollama)
+Reported:
+  - share of traffic kept off the LLM: regex alone vs. regex + classifier
+  - accuracy of the answers given locally (a non-command that gets answered
+    counts as wrong), and each mistake
+  - false actuations: commands that must reach the LLM (negated, excluding a
+    device, scheduled for later, naming a device there is no relay for) but
+    were answered locally, i.e. a relay switched that shouldn't have been
+  - classifier latency per utterance
+  - coverage / accuracy / false actuations at other confidence thresholds;
+    ("threshold alone": what the classifier would actuate without its
+    qualifier, vocabulary and device-name checks). CONFIDENCE_THRESHOLD is
+    the highest threshold that keeps the best coverage with no false actuation.
+
+With --db, the commands the LLM already answered (the IntentCache table of
+that database) are scored too, with the LLM's answer as the label: the share
+the classifier resolves is the share of those LLM calls it would have saved.
+If the model was trained on the same database these overlap its training data.
+
+Run from the backend directory:
+    python benchmarks/eval_intent_classifier.py [--model intent_model.json] [--db ../database/database.db]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlmodel import create_engine  # noqa: E402
+
+from ai_service import match_intent, normalize_command  # noqa: E402
+from intent_classifier import (CONFIDENCE_THRESHOLD, DEVICE_LABELS, MODEL_PATH, NONE,  # noqa: E402
+                               IntentClassifier, logged_examples, qualified)
+
+THRESHOLDS = (0.5, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95)
+
+# (utterance, action, device); action "none" for things that are not device commands
+EVAL_SET = [
+    # Exact fast-path phrasings
+    ("turn on the light", "turn_on", "light"),
+    ("turn off the fan", "turn_off", "fan"),
+    ("switch on the tv", "turn_on", "tv"),
+    ("turn off the fridge", "turn_off", "refrigerator"),
+    ("turn on the kitchen light", "turn_on", "kitchen light"),
+    ("switch off everything", "turn_off", "all"),
+    ("turn on number 6", "turn_on", "hometheater"),
+    ("turn off the home theater", "turn_off", "hometheater"),
+    # Near misses
+    ("lights on please", "turn_on", "light"),
+    ("kill the fan", "turn_off", "fan"),
+    ("fan off", "turn_off", "fan"),
+    ("tv on", "turn_on", "tv"),
+    ("could you please switch the telly off", "turn_off", "tv"),
+    ("turn the lights off in the bedroom", "turn_off", "light"),
+    ("switch the kitchen lights on", "turn_on", "kitchen light"),
+    ("kitchen light off now", "turn_off", "kitchen light"),
+    ("put the television on", "turn_on", "tv"),
+    ("shut the fan down", "turn_off", "fan"),
+    ("power down the speakers", "turn_off", "hometheater"),
+    ("start the home theatre", "turn_on", "hometheater"),
+    ("hey can you get the fan going", "turn_on", "fan"),
+    ("lamp off", "turn_off", "light"),
+    ("switch the lamp on please", "turn_on", "light"),
+    ("turn everything off", "turn_off", "all"),
+    ("all devices off", "turn_off", "all"),
+    ("fridge back on", "turn_on", "refrigerator"),
+    ("turn teh light on", "turn_on", "light"),
+    ("swich off the fan", "turn_off", "fan"),
+    ("turn on the ceiling fan", "turn_on", "fan"),
+    ("i'd like the tv off", "turn_off", "tv"),
+    ("cut the lights", "turn_off", "light"),
+    ("fire up the sound system", "turn_on", "hometheater"),
+    ("lights out", "turn_off", "light"),
+    ("please switch on relay 2", "turn_on", "fan"),
+    ("television off please", "turn_off", "tv"),
+    ("kitchen lamp on", "turn_on", "kitchen light"),
+    ("switch off the lights in the kitchen", "turn_off", "kitchen light"),
+    ("disable the fan", "turn_off", "fan"),
+    ("enable the lights", "turn_on", "light"),
+    ("stop the telly", "turn_off", "tv"),
+    # Harder: should reach the LLM rather than be guessed
+    ("it's too dark in here", "turn_on", "light"),
+    ("make it breezy", "turn_on", "fan"),
+    ("i'm going to watch a movie", "turn_on", "tv"),
+    ("it's getting hot", "turn_on", "fan"),
+    # Not device commands
+    ("is the fan on", NONE, None),
+    ("did i leave the kitchen light on", NONE, None),
+    ("how much power does the tv use", NONE, None),
+    ("what's the weather tomorrow", NONE, None),
+    ("tell me something funny", NONE, None),
+    ("what time is it in london", NONE, None),
+    ("play my workout playlist", NONE, None),
+    ("thanks a lot", NONE, None),
+]
+
+# Must not be answered locally: any local answer switches a relay the user didn't ask for
+DEFER_SET = [
+    # Negation
+    "don't turn on the fan",
+    "do not switch off the fridge",
+    "never turn off the refrigerator",
+    "i didn't ask you to turn on the tv",
+    "please don't switch the lights off",
+    "the fan should not be on",
+    # Exclusion
+    "lights off except the kitchen",
+    "turn everything off but the fridge",
+    "switch off all devices except the tv",
+    "turn off everything besides the fan",
+    # Time
+    "fan off in 10 minutes",
+    "turn on the light at 7 pm",
+    "switch the tv off after this episode",
+    "turn on the kitchen light tomorrow morning",
+    "turn off the fan when i leave",
+    "lights on at sunset every day",
+    # Devices without a relay
+    "turn the heater on",
+    "switch on the ac",
+    "turn on the oven",
+    "turn off the washing machine",
+    "start the dishwasher",
+    "lights on in the garage",
+    "turn on the coffee maker",
+    "open the garage door",
+    # Ambiguous or not a request: nothing the guards catch, so the threshold has to
+    "fan on or off",
+    "the tv is on",
+    "i think the fan is off",
+    "the lights were on all night",
+    "it's too dark in the bedroom",
+    "is the fridge on",
+    "leave the lights as they are",
+    "the kitchen light keeps turning off",
+    "light",
+    "tv remote",
+]
+
+
+def regex_answer(text: str):
+    """The fast path as AIService runs it: qualified commands never reach the regex."""
+    text = normalize_command(text)
+    intent = None if qualified(text) else match_intent(text)
+    return (intent[0], intent[2]) if intent else None
+
+
+def local_answer(classifier: IntentClassifier, text: str):
+    """(tier, (action, device)) for a command answered without the LLM, else (tier, None)."""
+    answer = regex_answer(text)
+    if answer is not None:
+        return "regex", answer
+    predicted = classifier.classify(normalize_command(text))
+    return "classifier", predicted[:2] if predicted is not None else None
+
+
+def score(classifier: IntentClassifier, examples, threshold: float):
+    """Returns (kept off the LLM by regex, by regex + classifier, correct local answers, mistakes)."""
+    classifier.threshold = threshold
+    by_regex = by_classifier = correct = 0
+    mistakes = []
+    for text, action, device in examples:
+        expected = (action, device) if action != NONE else None
+        tier, answer = local_answer(classifier, text)
+        if answer is None:
+            continue
+        if tier == "regex":
+            by_regex += 1
+        else:
+            by_classifier += 1
+        if answer == expected:
+            correct += 1
+        else:
+            mistakes.append((text, tier, answer, expected))
+    answered = by_regex + by_classifier
+    return by_regex, answered, correct, mistakes
+
+
+def false_actuations(classifier: IntentClassifier, threshold: float):
+    """
+    [(text, tier, answer)] for the DEFER_SET commands answered locally with a
+    relay (or "all"); the regex answering "ac" or "heater" switches nothing.
+    """
+    classifier.threshold = threshold
+    found = []
+    for text in DEFER_SET:
+        tier, answer = local_answer(classifier, text)
+        if answer is not None and answer[1] in DEVICE_LABELS:
+            found.append((text, tier, answer))
+    return found
+
+
+def unguarded_actuations(classifier: IntentClassifier, threshold: float) -> int:
+    """False actuations if the classifier relied on its threshold alone (no qualifier / vocabulary / name checks)."""
+    count = 0
+    for text in DEFER_SET:
+        if regex_answer(text) is None:
+            action, device, confidence = classifier.predict(normalize_command(text))
+            count += action != NONE and confidence >= threshold
+    return count
+
+
+def by_tier(actuated) -> str:
+    return ", ".join(f"{tier} {sum(t == tier for _, t, _ in actuated)}" for tier in ("regex", "classifier"))
+
+
+def report(label: str, classifier: IntentClassifier, examples, threshold: float):
+    n = len(examples)
+    by_regex, answered, correct, mistakes = score(classifier, examples, threshold)
+    print(f"{label}: {n} utterances")
+    print(f"  kept off the LLM: regex {by_regex / n:6.1%}   regex + classifier {answered / n:6.1%}")
+    print(f"  local answers correct: {correct}/{answered} ({correct / max(1, answered):.1%})")
+    for text, tier, answer, expected in mistakes:
+        print(f"    {tier:10} {text!r}: {answer} (expected {expected})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--db", default=None, help="Also score the LLM-answered commands logged in this database")
+    args = parser.parse_args()
+
+    classifier = IntentClassifier(args.model)
+    if not classifier.ready:
+        sys.exit(f"No model at {args.model}: train one with `python intent_classifier.py`")
+
+    report("Evaluation set", classifier, EVAL_SET, CONFIDENCE_THRESHOLD)
+    actuated = false_actuations(classifier, CONFIDENCE_THRESHOLD)
+    print(f"\nMust reach the LLM: {len(DEFER_SET)} utterances, false actuations: {by_tier(actuated)}")
+    for text, tier, answer in actuated:
+        print(f"    {tier:10} {text!r}: {answer}")
+
+    texts = [normalize_command(text) for text, _, _ in EVAL_SET]
+    times = []
+    for _ in range(20):
+        for text in texts:
+            started = time.perf_counter()
+            classifier.predict(text)
+            times.append(time.perf_counter() - started)
+    times.sort()
+    print(f"\nclassifier latency: median {statistics.median(times) * 1e6:.0f} us, "
+          f"p99 {times[int(len(times) * 0.99)] * 1e6:.0f} us")
+
+    print(f"\n{'threshold':>10} {'off the LLM':>12} {'accuracy':>10}   false actuations"
+          f"{'':15}threshold alone")
+    for threshold in THRESHOLDS:
+        _, answered, correct, _ = score(classifier, EVAL_SET, threshold)
+        actuated = false_actuations(classifier, threshold)
+        print(f"{threshold:10.2f} {answered / len(EVAL_SET):12.1%} {correct / max(1, answered):10.1%}   "
+              f"{by_tier(actuated):30} {unguarded_actuations(classifier, threshold):3}")
+
+    if args.db:
+        logged = logged_examples(create_engine(f"sqlite:///{args.db}"))
+        if logged:
+            print()
+            report("Logged LLM commands", classifier, logged, CONFIDENCE_THRESHOLD)
+        else:
+            print(f"\nNo logged LLM commands in {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Synthetic DeviceLog history for usage analytics: every device switches on
+and off at random (exponential on/off periods) over the last --days days,
+--events rows in total, written in time order like the state writer does.
+
+Writes to --db, which is required: point it at a scratch file, never at the
+app database (the app would restore the synthetic states on its next start).
+The tables are created if missing. Rollups are not touched: the app rolls
+the log up on its first start against a file that was never rolled up, so
+rows appended to a file the app already used never reach them. See
+bench_analytics.py for the rollups on a generated log.
+
+Run from the backend directory:
+    python benchmarks/generate_device_logs.py --db /tmp/usage.db --events 20000000
+"""
+import argparse
+import heapq
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlmodel import SQLModel, create_engine  # noqa: E402
+
+import models  # noqa: E402,F401  (registers the tables)
+from device_registry import DEVICE_TYPES  # noqa: E402
+
+# Rows per executemany
+WRITE_CHUNK = 100_000
+# Share of the time a device is on
+ON_SHARE = 0.3
+
+
+def device_types(count: int) -> List[str]:
+    """The registry's relays first, then "relay-7", "relay-8" ... for bigger installations."""
+    names = list(DEVICE_TYPES[:count])
+    names.extend(f"relay-{i + 1}" for i in range(len(names), count))
+    return names
+
+
+def device_events(device_type: str, start: datetime, end: datetime, count: int,
+                  rng: random.Random) -> Iterator[Tuple[datetime, str, str]]:
+    """About count alternating on/off events for one device between start and end."""
+    mean_cycle = (end - start).total_seconds() / max(1, count // 2)
+    ts = start + timedelta(seconds=rng.uniform(0, mean_cycle))
+    on = False
+    while ts < end:
+        on = not on
+        yield ts, device_type, "turned_on" if on else "turned_off"
+        mean = mean_cycle * (ON_SHARE if on else 1 - ON_SHARE)
+        ts += timedelta(seconds=rng.expovariate(1 / mean))
+
+
+def generate(db_path: str, events: int, devices: int = 6, days: int = 365, seed: int = 1,
+             end: datetime = None) -> int:
+    """Appends about `events` rows to DeviceLog in db_path. Returns how many were written."""
+    SQLModel.metadata.create_all(create_engine(f"sqlite:///{db_path}"))
+    rng = random.Random(seed)
+    end = end or datetime.utcnow()
+    start = end - timedelta(days=days)
+    names = device_types(devices)
+    streams = [device_events(name, start, end, events // len(names), rng) for name in names]
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    written = 0
+    chunk = []
+    # Merged across devices so ids follow time, as with the real log
+    for ts, device_type, action in heapq.merge(*streams):
+        # SQLAlchemy's SQLite DateTime format
+        chunk.append((device_type, action, ts.strftime("%Y-%m-%d %H:%M:%S.%f")))
+        if len(chunk) >= WRITE_CHUNK:
+            conn.executemany("INSERT INTO devicelog (device_type, action, timestamp) VALUES (?, ?, ?)", chunk)
+            conn.commit()
+            written += len(chunk)
+            chunk = []
+    if chunk:
+        conn.executemany("INSERT INTO devicelog (device_type, action, timestamp) VALUES (?, ?, ?)", chunk)
+        conn.commit()
+        written += len(chunk)
+    conn.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="Scratch SQLite file to append to")
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--devices", type=int, default=6)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    written = generate(args.db, args.events, args.devices, args.days, args.seed)
+    print(f"Wrote {written:,} events for {args.devices} devices over {args.days} days to {args.db} "
+          f"in {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from database import sqlite_file_name
+
+# "memory": one process, nothing shared (the default).
+# "sqlite": several uvicorn workers share state, broadcasts and poll queues
+#           through a local SQLite broker file (uvicorn main:app --workers 4).
+STATE_BACKEND = os.getenv("SMART_HOME_STATE_BACKEND", "memory")
+# Broker file; kept apart from the main database so bus traffic never waits on DeviceLog writes
+BROKER_PATH = os.getenv("SMART_HOME_BROKER_PATH",
+                        os.path.join(os.path.dirname(sqlite_file_name), "broker.db"))
+# How often each worker checks for other workers' messages (a PRAGMA data_version read)
+BUS_POLL_INTERVAL = float(os.getenv("SMART_HOME_BUS_POLL_MS", "5")) / 1000
+# Messages older than this are deleted; a worker only reads messages newer than its start
+BUS_RETENTION = 60.0
+
+BROKER_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS bus (id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL,"
+    " channel TEXT NOT NULL, payload TEXT NOT NULL, created REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS device_state (device_type TEXT PRIMARY KEY, state TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS poll_board (device_id TEXT PRIMARY KEY)",
+    "CREATE TABLE IF NOT EXISTS poll_command (id INTEGER PRIMARY KEY AUTOINCREMENT, device_id TEXT NOT NULL,"
+    " relay TEXT NOT NULL, command TEXT NOT NULL, UNIQUE (device_id, relay))",
+)
+
+logger = logging.getLogger("smart_home.broker")
+
+# on_message(origin, channel, payload), called on the event loop
+MessageHandler = Callable[[str, str, Dict], None]
+
+
+def new_worker_id() -> str:
+    return f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class LocalBroker:
+    """Single-process backend: every socket, queue and state lives in this process, so nothing is sent."""
+
+    shared = False
+
+    def __init__(self):
+        self.worker_id = new_worker_id()
+
+    async def start(self, on_message: MessageHandler):
+        pass
+
+    async def stop(self):
+        pass
+
+    def publish(self, channel: str, payload: Dict):
+        pass
+
+    def load_states(self) -> Dict[str, str]:
+        return {}
+
+    def stats(self) -> Dict:
+        return {"backend": "memory", "worker": self.worker_id}
+
+
+class SQLiteBroker:
+    """
+    Local broker for several worker processes on one host, in a WAL-mode SQLite file.
+    - One thread per worker owns the connection. Jobs from the event loop
+      (publishes, poll-queue reads and writes) run on it in order, batched into
+      one transaction per wake-up, so the loop never waits on SQLite.
+    - Pub/sub: published messages are rows in `bus`. The thread checks
+      PRAGMA data_version every BUS_POLL_INTERVAL (it only changes when another
+      connection commits) and hands new rows from other workers to the loop.
+    - The latest state of every device is kept in `device_state`, so a worker
+      that starts later (or restarts) begins with the current house state.
+    """
+
+    shared = True
+
+    def __init__(self, path: str = BROKER_PATH, poll_interval: float = BUS_POLL_INTERVAL,
+                 retention: float = BUS_RETENTION):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.worker_id = new_worker_id()
+        self._jobs: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._loop: asyncio.AbstractEventLoop = None
+        self._on_message: MessageHandler = None
+        self._last_id = 0
+
+        # Stats
+        self.published = 0
+        self.received = 0
+        self.transactions = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    async def start(self, on_message: MessageHandler):
+        self._loop = asyncio.get_running_loop()
+        self._on_message = on_message
+        conn = self._connect()
+        for statement in BROKER_SCHEMA:
+            conn.execute(statement)
+        # Only messages published from now on are for us
+        self._last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM bus").fetchone()[0]
+        self._running = True
+        self._thread = threading.Thread(target=self._run, args=(conn,), name="state-broker", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        """Runs the jobs already submitted, then closes the connection."""
+        if self._thread is None:
+            return
+        self._running = False
+        self._jobs.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+        self._thread = None
+
+    def submit(self, job: Callable[[sqlite3.Connection], object]) -> concurrent.futures.Future:
+        """Runs job(connection) on the broker thread, inside a write transaction."""
+        future = concurrent.futures.Future()
+        self._jobs.put((job, future))
+        return future
+
+    async def call(self, job: Callable[[sqlite3.Connection], object]):
+        return await asyncio.wrap_future(self.submit(job))
+
+    def publish(self, channel: str, payload: Dict):
+        """Sends a message to every other worker. Returns immediately."""
+        body = json.dumps(payload)
+        self.published += 1
+        self.submit(lambda conn: self.write_message(conn, channel, payload, body))
+
+    def write_message(self, conn: sqlite3.Connection, channel: str, payload: Dict, body: str = None):
+        """publish() from inside a job, in the same transaction as the job's own writes."""
+        conn.execute("INSERT INTO bus (origin, channel, payload, created) VALUES (?, ?, ?, ?)",
+                     (self.worker_id, channel, body if body is not None else json.dumps(payload), time.time()))
+        if channel == "state":
+            conn.executemany("INSERT OR REPLACE INTO device_state (device_type, state) VALUES (?, ?)",
+                             payload["states"].items())
+
+    def load_states(self) -> Dict[str, str]:
+        """Latest state per device as published by any worker (empty on a fresh broker)."""
+        conn = self._connect()
+        try:
+            for statement in BROKER_SCHEMA:
+                conn.execute(statement)
+            return dict(conn.execute("SELECT device_type, state FROM device_state").fetchall())
+        finally:
+            conn.close()
+
+    def _run(self, conn: sqlite3.Connection):
+        data_version = None
+        last_prune = time.monotonic()
+        try:
+            while True:
+                jobs = self._take_jobs()
+                if jobs:
+                    self._execute(conn, jobs)
+                elif not self._running:
+                    break
+
+                version = conn.execute("PRAGMA data_version").fetchone()[0]
+                if version != data_version:
+                    data_version = version
+                    self._receive(conn)
+
+                if time.monotonic() - last_prune > self.retention:
+                    last_prune = time.monotonic()
+                    self._execute(conn, [(self._prune, None)])
+        except Exception:
+            logger.exception("State broker stopped")
+        finally:
+            conn.close()
+
+    def _take_jobs(self) -> List:
+        try:
+            first = self._jobs.get(timeout=self.poll_interval)
+        except queue.Empty:
+            return []
+        jobs = [first]
+        while True:
+            try:
+                jobs.append(self._jobs.get_nowait())
+            except queue.Empty:
+                break
+        # None is the stop marker
+        return [job for job in jobs if job is not None]
+
+    def _execute(self, conn: sqlite3.Connection, jobs: List):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job, future in jobs:
+                try:
+                    results.append((future, job(conn), None))
+                except sqlite3.Error as e:
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.error("Broker transaction failed, %d jobs lost: %s", len(jobs), e)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(future, None, e) for _, future in jobs]
+        self.transactions += 1
+        for future, result, error in results:
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _prune(self, conn: sqlite3.Connection):
+        conn.execute("DELETE FROM bus WHERE created < ?", (time.time() - self.retention,))
+
+    def _receive(self, conn: sqlite3.Connection):
+        rows = conn.execute("SELECT id, origin, channel, payload FROM bus WHERE id > ? ORDER BY id",
+                            (self._last_id,)).fetchall()
+        if not rows:
+            return
+        self._last_id = rows[-1][0]
+        messages = [(origin, channel, payload) for _, origin, channel, payload in rows
+                    if origin != self.worker_id]
+        if messages:
+            self.received += len(messages)
+            self._loop.call_soon_threadsafe(self._deliver, messages)
+
+    def _deliver(self, messages):
+        for origin, channel, payload in messages:
+            try:
+                self._on_message(origin, channel, json.loads(payload))
+            except Exception:
+                logger.exception("Bus message %s from %s failed", channel, origin)
+
+    def stats(self) -> Dict:
+        return {"backend": "sqlite", "worker": self.worker_id, "published": self.published,
+                "received": self.received, "transactions": self.transactions}
+
+
+broker = SQLiteBroker() if STATE_BACKEND == "sqlite" else LocalBroker()
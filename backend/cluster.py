@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from command_acks import AckTracker
+from connection_manager import ConnectionManager
+from device_cache import DeviceListCache
+from dispatcher import GROUP, CommandDispatcher, CommandPlan
+from session_context import SessionContextStore
+
+# Seconds between announcements of this worker's ack-capable boards
+GOSSIP_INTERVAL = 2.0
+# Another worker's boards are forgotten after this long without an announcement (it died)
+GOSSIP_TIMEOUT = 3 * GOSSIP_INTERVAL
+
+logger = logging.getLogger("smart_home.cluster")
+
+
+class ClusterSync:
+    """
+    Keeps the per-process state of several uvicorn workers in step through
+    the broker. Each worker still owns its sockets; what crosses over:
+      "state"    device states after a broadcast -> other workers update
+                 device_states and their own dashboards (only the origin persists)
+      "command"  a dispatched plan -> other workers send it to their ESP32 sockets
+                 (ack-capable boards there are tracked by that worker's AckTracker)
+      "boards"   which ack-capable boards a worker has, so every worker knows
+                 which devices wait for an ack
+      "session"  follow-up offers ("Shall I turn on the Home Theater?")
+      "devices"  device list cache invalidations
+      "poll"     a command was queued for HTTP-polling boards: wake long polls
+      "automations"  a scene or schedule changed: reload them (only one worker
+                 fires each occurrence, see AutomationEngine)
+    With the in-memory broker (one worker) nothing is registered at all.
+    """
+
+    def __init__(self, broker, connections: ConnectionManager, dispatcher: CommandDispatcher,
+                 acks: AckTracker, sessions: SessionContextStore, device_cache: DeviceListCache,
+                 command_queue, automations=None, gossip_interval: float = GOSSIP_INTERVAL):
+        self.broker = broker
+        self.connections = connections
+        self.dispatcher = dispatcher
+        self.acks = acks
+        self.sessions = sessions
+        self.device_cache = device_cache
+        self.command_queue = command_queue
+        self.automations = automations
+        self.gossip_interval = gossip_interval
+        # worker_id -> (time.monotonic() of its last announcement, its ack-capable boards)
+        self.remote_boards: Dict[str, Tuple[float, Dict[str, Optional[List[str]]]]] = {}
+        # Ack-capable boards in the last announcement
+        self._announced: Set[str] = set()
+        self._task: asyncio.Task = None
+
+    async def start(self):
+        if not self.broker.shared:
+            return
+        self.connections.broadcast_listeners.append(self._on_broadcast)
+        self.connections.board_listeners.append(self._on_board)
+        self.dispatcher.listeners.append(self._on_dispatch)
+        self.sessions.listeners.append(self._on_session)
+        self.device_cache.listeners.append(self._on_devices)
+        if self.automations is not None:
+            self.automations.listeners.append(self._on_automations)
+        await self.broker.start(self.on_message)
+        self._task = asyncio.create_task(self._gossip())
+        logger.info("Worker %s joined via %s", self.broker.worker_id, type(self.broker).__name__)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # Other workers drop our boards right away instead of after GOSSIP_TIMEOUT
+        self.broker.publish("boards", {"boards": {}, "leaving": True})
+        await self.broker.stop()
+
+    # --- Outgoing ---
+
+    def _on_broadcast(self, states: Dict[str, str], text_frames: List[str]):
+        self.broker.publish("state", {"states": states, "frames": text_frames})
+
+    def _on_dispatch(self, plan: CommandPlan):
+        message = {"action": plan.action, "device_type": plan.device_type}
+        if plan.device_type == GROUP:
+            message["targets"] = plan.targets
+        self.broker.publish("command", message)
+
+    def _on_board(self, device_id: str):
+        # Only ack-capable boards change what other workers do
+        if device_id in self.connections.ack_boards or device_id in self._announced:
+            self._announce()
+
+    def _on_session(self, session_id: str, offer: Optional[str]):
+        self.broker.publish("session", {"session_id": session_id, "offer": offer})
+
+    def _on_devices(self, device_ids: Optional[List[str]]):
+        self.broker.publish("devices", {"ids": device_ids})
+
+    def _on_automations(self):
+        self.broker.publish("automations", {})
+
+    def _announce(self):
+        boards = {}
+        for board in self.connections.ack_boards:
+            owned = self.connections.board_devices.get(board)
+            boards[board] = sorted(owned) if owned is not None else None
+        self._announced = set(boards)
+        self.broker.publish("boards", {"boards": boards})
+
+    async def _gossip(self):
+        while True:
+            self._announce()
+            await asyncio.sleep(self.gossip_interval)
+            now = time.monotonic()
+            expired = [w for w, (seen, _) in self.remote_boards.items() if now - seen > GOSSIP_TIMEOUT]
+            for worker in expired:
+                logger.warning("Worker %s went silent, forgetting its boards", worker)
+                del self.remote_boards[worker]
+            if expired:
+                self._merge_boards()
+
+    # --- Incoming ---
+
+    def on_message(self, origin: str, channel: str, payload: Dict):
+        if channel == "state":
+            states = payload["states"]
+            self.connections.device_states.update(states)
+            self.connections.deliver_states(states, payload["frames"])
+        elif channel == "command":
+            if payload["device_type"] == GROUP:
+                plan = self.dispatcher.group_plan(payload["action"], tuple(payload["targets"]))
+            else:
+                plan = self.dispatcher.plan(payload["action"], payload["device_type"])
+            if plan is not None:
+                asyncio.create_task(self.dispatcher.send_to_devices(plan, time.perf_counter()))
+        elif channel == "poll":
+            self.command_queue.wake()
+        elif channel == "boards":
+            if payload.get("leaving"):
+                self.remote_boards.pop(origin, None)
+            else:
+                self.remote_boards[origin] = (time.monotonic(), payload["boards"])
+            self._merge_boards()
+        elif channel == "session":
+            self.sessions.replace(payload["session_id"], payload["offer"])
+        elif channel == "devices":
+            self.device_cache.expire(payload["ids"])
+        elif channel == "automations" and self.automations is not None:
+            asyncio.create_task(self.automations.reload())
+
+    def _merge_boards(self):
+        merged = {}
+        for _, boards in self.remote_boards.values():
+            for board, devices in boards.items():
+                merged[board] = frozenset(devices) if devices is not None else None
+        self.acks.remote_boards = merged
+
+    def stats(self) -> Dict:
+        return {**self.broker.stats(), "workers": len(self.remote_boards) + 1,
+                "remote_ack_boards": len(self.acks.remote_boards)}
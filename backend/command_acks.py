@@ -0,0 +1,265 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from connection_manager import ConnectionManager
+from device_registry import BOARD_NAMES
+from latency import LatencyRecorder, command_latency
+from ws_protocol import COMMAND, PROTO_TEXT, client_text_frames, encode
+
+# Seconds before the first resend of an unacknowledged command
+ACK_TIMEOUT = 1.0
+# Each further resend waits this much longer (1 s, 2 s, 4 s)
+ACK_BACKOFF = 2.0
+# Sends per command, including the first, before giving up
+MAX_ATTEMPTS = 4
+# Unacknowledged commands kept before the oldest is given up
+MAX_PENDING_ACKS = 1000
+
+logger = logging.getLogger("smart_home.acks")
+
+
+class PendingCommand:
+    __slots__ = ("seq", "board", "action", "state", "devices", "protocol", "frame", "started", "sent_at",
+                 "attempts", "deadline")
+
+    def __init__(self, seq: int, board: str, action: str, devices: Tuple[str, ...], protocol: str,
+                 started: float):
+        self.seq = seq
+        self.board = board
+        self.action = action
+        self.state = "on" if action == "turn_on" else "off"
+        self.devices = devices
+        self.protocol = protocol
+        self.frame = command_frame(seq, action, devices, protocol)
+        self.started = started
+        self.sent_at = None
+        self.attempts = 0
+        self.deadline = 0.0
+
+
+def command_frame(seq: int, action: str, devices: Tuple[str, ...], protocol: str):
+    """
+    Sequence-tagged command for an ack-capable board.
+    Text: "turn_on:light#17" (one device per frame). Compact: {"c": {...}, "q": 17}.
+    """
+    if protocol == PROTO_TEXT:
+        return f"{action}:{devices[0]}#{seq}"
+    value = 1 if action == "turn_on" else 0
+    return encode({COMMAND: {d: value for d in devices}, "q": seq}, protocol)
+
+
+class AckTracker:
+    """
+    Commands to boards that connected with ?ack=1.
+    - Each command gets a sequence id; the board replies "ack:<seq>" once the relay switched.
+    - Only then is the state applied (and persisted, and shown on dashboards):
+      device_states stays authoritative for those devices.
+    - Unacknowledged commands are resent with exponential backoff and given up
+      after MAX_ATTEMPTS, at which point dashboards are re-sent the state that
+      really holds. A resend only repeats the same switch, because a newer
+      command for the same board and device replaces the pending one: it is
+      no longer resent, and a late ack for it applies nothing.
+    - Boards can also report state on their own: "status:<device>:<on|off>".
+    Boards without ?ack=1 keep the optimistic path and never see sequence ids.
+    """
+
+    def __init__(self, connections: ConnectionManager, latency: LatencyRecorder = command_latency,
+                 ack_timeout: float = ACK_TIMEOUT, backoff: float = ACK_BACKOFF,
+                 max_attempts: int = MAX_ATTEMPTS, max_pending: int = MAX_PENDING_ACKS):
+        self.connections = connections
+        self.latency = latency
+        self.ack_timeout = ack_timeout
+        self.backoff = backoff
+        self.max_attempts = max_attempts
+        self.max_pending = max_pending
+        self.pending: Dict[int, PendingCommand] = {}
+        # (board, device) -> seq of the pending command that last targeted it
+        self._latest: Dict[Tuple[str, str], int] = {}
+        # Ack-capable boards connected to other workers: board -> devices (None = every device)
+        self.remote_boards: Dict[str, Optional[FrozenSet[str]]] = {}
+        # (deadline, seq) min-heap for resends; entries for acked commands are skipped
+        self._timers: List[Tuple[float, int]] = []
+        self._wakeup: asyncio.Event = None
+        self._task: asyncio.Task = None
+        self._seq = itertools.count(1)
+
+        # Stats
+        self.acked = 0
+        self.retries = 0
+        self.failed = 0
+        self.reports = 0
+        self.superseded = 0
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def routes(self, targets) -> Dict[str, Tuple[str, ...]]:
+        """Ack-capable boards driving any of targets -> the targets each one drives."""
+        routes = {}
+        for board in self.connections.ack_boards:
+            owned = self.connections.board_devices.get(board)
+            devices = tuple(targets) if owned is None else tuple(d for d in targets if d in owned)
+            if devices:
+                routes[board] = devices
+        return routes
+
+    def confirmed(self, targets) -> Set[str]:
+        """Targets driven by an ack-capable board in any worker: their state waits for the ack."""
+        if not self.connections.ack_boards and not self.remote_boards:
+            return set()
+        owners = [self.connections.board_devices.get(b) for b in self.connections.ack_boards]
+        owners.extend(self.remote_boards.values())
+        if any(owned is None for owned in owners):
+            return set(targets)
+        return {d for d in targets if any(d in owned for owned in owners)}
+
+    async def issue(self, action: str, routes: Dict[str, Tuple[str, ...]], started: float):
+        """Sends sequence-tagged commands to ack-capable boards and waits for their acks in the background."""
+        sends = []
+        for board, devices in routes.items():
+            protocol = self.connections.device_protocols.get(board, PROTO_TEXT)
+            # Text frames name one device each, so each gets its own seq
+            groups = [(d,) for d in devices] if protocol == PROTO_TEXT else [devices]
+            for group in groups:
+                command = PendingCommand(next(self._seq), board, action, group, protocol, started)
+                self._track(command)
+                sends.append(self._send(command))
+        await asyncio.gather(*sends)
+
+    def _track(self, command: PendingCommand):
+        for device in command.devices:
+            older = self.pending.get(self._latest.get((command.board, device)))
+            if older is not None:
+                self._supersede(older, device)
+            self._latest[command.board, device] = command.seq
+        if len(self.pending) >= self.max_pending:
+            self._give_up(self.pending[next(iter(self.pending))])
+        self.pending[command.seq] = command
+
+    def _supersede(self, command: PendingCommand, device: str):
+        """Takes device out of an older pending command; the command is dropped once nothing is left."""
+        self.superseded += 1
+        command.devices = tuple(d for d in command.devices if d != device)
+        if command.devices:
+            # Resends of the rest must not switch device back
+            command.frame = command_frame(command.seq, command.action, command.devices, command.protocol)
+        else:
+            del self.pending[command.seq]
+
+    def _release(self, command: PendingCommand):
+        self.pending.pop(command.seq, None)
+        for device in command.devices:
+            if self._latest.get((command.board, device)) == command.seq:
+                del self._latest[command.board, device]
+
+    async def _send(self, command: PendingCommand):
+        command.attempts += 1
+        now = time.perf_counter()
+        if command.sent_at is None:
+            command.sent_at = now
+        # Wait ack_timeout, then 2x, 4x ... before the next resend
+        command.deadline = now + self.ack_timeout * self.backoff ** (command.attempts - 1)
+        heapq.heappush(self._timers, (command.deadline, command.seq))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        # A board that is offline right now may reconnect before the resend
+        await self.connections.send_command_to_device(command.board, command.frame)
+
+    async def _run(self):
+        while True:
+            timeout = None
+            if self._timers:
+                timeout = max(0.0, self._timers[0][0] - time.perf_counter())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+            now = time.perf_counter()
+            while self._timers and self._timers[0][0] <= now:
+                _, seq = heapq.heappop(self._timers)
+                command = self.pending.get(seq)
+                if command is None or command.deadline > now:
+                    continue  # Acked meanwhile, or a newer timer exists
+                if command.attempts >= self.max_attempts:
+                    self._give_up(command)
+                    continue
+                self.retries += 1
+                asyncio.create_task(self._send(command))
+
+    def _give_up(self, command: PendingCommand):
+        self._release(command)
+        self.failed += 1
+        logger.warning("Command #%d to %s not acknowledged after %d sends", command.seq, command.board,
+                       command.attempts)
+        # Dashboards may show what the user asked for; re-send what really holds
+        states = {d: self.connections.device_states.get(d, "off") for d in command.devices}
+        asyncio.create_task(self.connections.broadcast_states(states, client_text_frames(states)))
+
+    async def ack(self, board: str, seq: int) -> bool:
+        """A board confirmed command seq: apply its state now."""
+        command = self.pending.get(seq)
+        if command is None or command.board != board:
+            return False  # Unknown, already acked (a resend was acked twice), superseded or not this board's
+        self._release(command)
+        now = time.perf_counter()
+        self.latency.observe("ack", now - command.sent_at)
+        self.latency.observe("end_to_end", now - command.started)
+        self.acked += 1
+        await self.apply(dict.fromkeys(command.devices, command.state))
+        return True
+
+    async def apply(self, states: Dict[str, str]):
+        """Authoritative state from a board: update, persist and show on dashboards."""
+        for state in set(states.values()):
+            self.connections.apply_states([d for d, s in states.items() if s == state], state)
+        await self.connections.broadcast_states(states, client_text_frames(states))
+
+    async def handle_report(self, board: str, message: str) -> bool:
+        """
+        Parses a board message. Returns True if it was an ack or a state report:
+          "ack:<seq>"                  command seq done
+          "status:<device>:<on|off>"   the relay's actual state (e.g. a wall switch)
+        Other text ("status:connected") is left to the caller.
+        """
+        kind, _, rest = message.partition(":")
+        if kind == "ack":
+            try:
+                seq = int(rest)
+            except ValueError:
+                return False
+            await self.ack(board, seq)
+            return True
+        if kind == "status":
+            device, _, state = rest.rpartition(":")
+            if not device or state not in ("on", "off"):
+                return False
+            self.reports += 1
+            await self.apply({BOARD_NAMES.get(device, device): state})
+            return True
+        return False
+
+    def pending_for(self, board: Optional[str] = None) -> int:
+        if board is None:
+            return len(self.pending)
+        return sum(1 for c in self.pending.values() if c.board == board)
+
+    def stats(self) -> Dict:
+        return {"pending": len(self.pending), "acked": self.acked, "retries": self.retries,
+                "failed": self.failed, "reports": self.reports, "superseded": self.superseded}
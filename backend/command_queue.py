@@ -0,0 +1,243 @@
+import asyncio
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from broker import SQLiteBroker, broker
+
+# Boards that poll GET /device without a device_id share this queue
+DEFAULT_DEVICE_ID = "default"
+# Upper bound per board; with relay coalescing this is rarely reached
+MAX_PENDING_PER_DEVICE = 32
+# Longest a long-poll request may be held open (seconds)
+MAX_LONG_POLL = 60.0
+# Polling boards remembered (each gets broadcast commands); beyond this the least
+# recently polled are forgotten, as board ids come from clients
+MAX_POLL_BOARDS = 1024
+
+
+class DeviceCommandQueue:
+    """
+    Pending commands for one HTTP-polling board.
+    Keeps at most one command per relay: a newer command for the same relay
+    replaces the older one and moves to the back, so issue order is preserved.
+    """
+
+    def __init__(self, max_pending: int = MAX_PENDING_PER_DEVICE):
+        self.max_pending = max_pending
+        # relay -> "action:relay"
+        self.pending: "OrderedDict[str, str]" = OrderedDict()
+        # Set whenever a command is pushed; long-poll requests wait on it
+        self.ready = asyncio.Event()
+        # Long-poll requests holding this queue; it is never forgotten while > 0
+        self.waiters = 0
+
+    def push(self, command: str):
+        _, _, relay = command.partition(":")
+        if relay == "all":
+            # "all" supersedes every individual relay command queued before it
+            self.pending.clear()
+        else:
+            self.pending.pop(relay, None)
+        self.pending[relay] = command
+
+        while len(self.pending) > self.max_pending:
+            self.pending.popitem(last=False)
+        self.ready.set()
+
+    def pop(self) -> Optional[str]:
+        if not self.pending:
+            return None
+        return self.pending.popitem(last=False)[1]
+
+    def drain(self) -> List[str]:
+        commands = list(self.pending.values())
+        self.pending.clear()
+        return commands
+
+    def __len__(self):
+        return len(self.pending)
+
+
+class CommandQueue:
+    """
+    Per-device-id command queues for ESP32s using the /device poll endpoint.
+    Boards are kept in poll order; past max_boards the least recently polled
+    idle one is forgotten (with its pending commands), never the default queue.
+    """
+
+    def __init__(self, max_boards: int = MAX_POLL_BOARDS):
+        self.max_boards = max_boards
+        self.devices: "OrderedDict[str, DeviceCommandQueue]" = OrderedDict(
+            [(DEFAULT_DEVICE_ID, DeviceCommandQueue())])
+        self.forgotten = 0
+
+    def _queue_for(self, device_id: str) -> DeviceCommandQueue:
+        queue = self.devices.get(device_id)
+        if queue is None:
+            # A board is known from its first poll onwards
+            queue = self.devices[device_id] = DeviceCommandQueue()
+            if len(self.devices) > self.max_boards:
+                self._forget_one()
+        return queue
+
+    def _forget_one(self):
+        for device_id, queue in self.devices.items():
+            if device_id != DEFAULT_DEVICE_ID and queue.waiters == 0:
+                del self.devices[device_id]
+                self.forgotten += 1
+                return
+
+    def _polled(self, device_id: str) -> DeviceCommandQueue:
+        queue = self._queue_for(device_id)
+        self.devices.move_to_end(device_id)
+        return queue
+
+    def publish(self, command: str, device_ids: Optional[List[str]] = None):
+        """Queues a command for the given boards, or for every known board."""
+        targets = device_ids if device_ids is not None else list(self.devices)
+        for device_id in targets:
+            self._queue_for(device_id).push(command)
+
+    def poll(self, device_id: str = DEFAULT_DEVICE_ID, batch: bool = False) -> List[str]:
+        """Returns the next command (or every pending command when batch=True)."""
+        queue = self._polled(device_id)
+        if batch:
+            return queue.drain()
+        command = queue.pop()
+        return [command] if command else []
+
+    async def wait(self, device_id: str = DEFAULT_DEVICE_ID, timeout: float = 30.0,
+                   batch: bool = False) -> List[str]:
+        """
+        Long-poll variant of poll(): waits until a command for this board
+        arrives or the timeout passes. Returns [] on timeout; timeout=0 is a plain poll.
+        """
+        queue = self._polled(device_id)
+        deadline = time.monotonic() + min(timeout, MAX_LONG_POLL)
+        queue.waiters += 1
+        try:
+            while not queue.pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                queue.ready.clear()
+                try:
+                    await asyncio.wait_for(queue.ready.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return []
+                # Another waiter for the same board may have taken the commands,
+                # in which case we loop and keep waiting
+        finally:
+            queue.waiters -= 1
+        return self.poll(device_id, batch=batch)
+
+    def pending_count(self, device_id: str) -> int:
+        queue = self.devices.get(device_id)
+        return len(queue) if queue else 0
+
+    def pending(self) -> Dict[str, int]:
+        """Pending commands per known board."""
+        return {device_id: len(queue) for device_id, queue in self.devices.items()}
+
+
+class SharedCommandQueue:
+    """
+    CommandQueue for several workers, kept in the broker's poll_command table:
+    a board may poll any worker and still gets each command exactly once.
+    Same rules as DeviceCommandQueue (one command per relay, "all" replaces
+    the rest, MAX_PENDING_PER_DEVICE). A take is a select + delete in one
+    broker transaction, so two workers can never hand out the same command.
+    poll_board is kept in poll order (rowid) and capped at max_boards, like
+    CommandQueue.devices.
+    """
+
+    def __init__(self, broker: SQLiteBroker, max_pending: int = MAX_PENDING_PER_DEVICE,
+                 max_boards: int = MAX_POLL_BOARDS):
+        self.broker = broker
+        self.max_pending = max_pending
+        self.max_boards = max_boards
+        # Long-poll waiters per board in this worker; set when any worker queues a command.
+        # Removed when the board's last waiter returns, so it only holds open requests.
+        self._ready: Dict[str, asyncio.Event] = {}
+        self._waiters: Dict[str, int] = {}
+
+    def publish(self, command: str, device_ids: Optional[List[str]] = None):
+        """Queues a command for the given boards, or for every board known to any worker."""
+        _, _, relay = command.partition(":")
+
+        def push(conn: sqlite3.Connection):
+            targets = device_ids
+            if targets is None:
+                targets = {row[0] for row in conn.execute("SELECT device_id FROM poll_board")}
+                targets.add(DEFAULT_DEVICE_ID)
+            for device_id in targets:
+                if relay == "all":
+                    conn.execute("DELETE FROM poll_command WHERE device_id = ?", (device_id,))
+                # REPLACE gives the row a new id, so it moves to the back like DeviceCommandQueue.push
+                conn.execute("INSERT OR REPLACE INTO poll_command (device_id, relay, command) VALUES (?, ?, ?)",
+                             (device_id, relay, command))
+                conn.execute("DELETE FROM poll_command WHERE device_id = ? AND id NOT IN "
+                             "(SELECT id FROM poll_command WHERE device_id = ? ORDER BY id DESC LIMIT ?)",
+                             (device_id, device_id, self.max_pending))
+            # Wakes long polls held by the other workers
+            self.broker.write_message(conn, "poll", {})
+
+        loop = asyncio.get_running_loop()
+        self.broker.submit(push).add_done_callback(lambda _: loop.call_soon_threadsafe(self.wake))
+
+    def wake(self):
+        for ready in self._ready.values():
+            ready.set()
+
+    def _take(self, conn: sqlite3.Connection, device_id: str, batch: bool) -> List[str]:
+        # A board is known from its first poll onwards; re-inserting moves it to the newest rowid
+        known = conn.execute("DELETE FROM poll_board WHERE device_id = ?", (device_id,)).rowcount
+        conn.execute("INSERT INTO poll_board (device_id) VALUES (?)", (device_id,))
+        if not known:
+            self._forget_boards(conn)
+        rows = conn.execute("SELECT id, command FROM poll_command WHERE device_id = ? ORDER BY id"
+                            + ("" if batch else " LIMIT 1"), (device_id,)).fetchall()
+        if rows:
+            conn.executemany("DELETE FROM poll_command WHERE id = ?", [(row[0],) for row in rows])
+        return [row[1] for row in rows]
+
+    def _forget_boards(self, conn: sqlite3.Connection):
+        """Drops the least recently polled boards past max_boards, with their pending commands."""
+        stale = [(row[0],) for row in conn.execute(
+            "SELECT device_id FROM poll_board WHERE device_id != ? ORDER BY rowid DESC LIMIT -1 OFFSET ?",
+            (DEFAULT_DEVICE_ID, self.max_boards - 1))]
+        conn.executemany("DELETE FROM poll_board WHERE device_id = ?", stale)
+        conn.executemany("DELETE FROM poll_command WHERE device_id = ?", stale)
+
+    async def wait(self, device_id: str = DEFAULT_DEVICE_ID, timeout: float = 30.0,
+                   batch: bool = False) -> List[str]:
+        """Same as CommandQueue.wait(); timeout=0 is a plain poll."""
+        ready = self._ready.setdefault(device_id, asyncio.Event())
+        self._waiters[device_id] = self._waiters.get(device_id, 0) + 1
+        deadline = time.monotonic() + min(timeout, MAX_LONG_POLL)
+        try:
+            while True:
+                ready.clear()
+                commands = await self.broker.call(lambda conn: self._take(conn, device_id, batch))
+                remaining = deadline - time.monotonic()
+                if commands or remaining <= 0:
+                    return commands
+                try:
+                    await asyncio.wait_for(ready.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return []
+        finally:
+            self._waiters[device_id] -= 1
+            if not self._waiters[device_id]:
+                del self._waiters[device_id]
+                del self._ready[device_id]
+
+    def pending(self) -> Dict[str, int]:
+        """Pending commands per board (blocks on the broker; call it from a thread)."""
+        query = "SELECT device_id, COUNT(*) FROM poll_command GROUP BY device_id"
+        return dict(self.broker.submit(lambda conn: conn.execute(query).fetchall()).result(timeout=1))
+
+
+command_queue = SharedCommandQueue(broker) if broker.shared else CommandQueue()
@@ -1,70 +1,375 @@
-from typing import List, Dict
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Sequence, Set
 from fastapi import WebSocket
 
+from device_registry import BOARD_NAMES, DEVICES, canonical_name
+from metrics import broadcast_seconds
+from ws_protocol import (PROTO_TEXT, SNAPSHOT, UPDATE, Frame, client_text_frames, command_message,
+                         encode, negotiate, state_message)
+
+# Max frames buffered per frontend client before the slow-consumer policy applies
+CLIENT_QUEUE_SIZE = 64
+# What to do when a client's queue is full:
+#   "drop"       -> discard the oldest queued frame and keep the newest state
+#   "disconnect" -> close the socket, the dashboard reconnects and gets a fresh snapshot
+SLOW_CLIENT_POLICY = "drop"
+# Seconds to wait on a single ESP32 send before treating the socket as dead
+DEVICE_SEND_TIMEOUT = 5.0
+
+logger = logging.getLogger("smart_home.connections")
+
+
+class ClientChannel:
+    """
+    Bounded outbound queue for one frontend WebSocket.
+    A dedicated writer task drains the queue, so a slow tablet only
+    delays its own frames instead of the whole broadcast.
+    """
+
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager",
+                 max_queue: int = CLIENT_QUEUE_SIZE, policy: str = SLOW_CLIENT_POLICY,
+                 protocol: str = PROTO_TEXT):
+        self.websocket = websocket
+        self.manager = manager
+        self.policy = policy
+        self.protocol = protocol
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.task = asyncio.create_task(self._writer())
+
+    def offer(self, message: Frame) -> bool:
+        """Queues a frame without blocking. Returns False if the frame was not queued as-is."""
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.policy == "disconnect":
+            self.manager.drop_client(self.websocket, close_code=1013)
+            return False
+
+        # Drop oldest: the newest frame carries the latest state
+        try:
+            self.queue.get_nowait()
+            self.queue.task_done()
+        except asyncio.QueueEmpty:
+            pass
+        self.dropped += 1
+        self.queue.put_nowait(message)
+        return False
+
+    async def _writer(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                try:
+                    if isinstance(message, bytes):
+                        await self.websocket.send_bytes(message)
+                    else:
+                        await self.websocket.send_text(message)
+                finally:
+                    self.queue.task_done()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Broken socket: remove it so future broadcasts skip it
+            logger.warning("Client send failed, removing: %s", e)
+            self.manager.drop_client(self.websocket)
+
+    async def flush(self):
+        """Waits until every queued frame has been written (used by tests/benchmarks)."""
+        await self.queue.join()
+
+    def close(self):
+        self.task.cancel()
+
+
 class ConnectionManager:
     def __init__(self):
         # Active connections: device_id -> WebSocket
         self.active_devices: Dict[str, WebSocket] = {}
+        # Wire protocol per connected ESP32 (see ws_protocol)
+        self.device_protocols: Dict[str, str] = {}
+        # Routing: the device types each board drives, and the reverse index.
+        # Boards that never declared anything are wildcards and get every command.
+        self.board_devices: Dict[str, FrozenSet[str]] = {}
+        self.device_routes: Dict[str, Set[str]] = {}
+        self.wildcard_boards: Set[str] = set()
+        # Boards that acknowledge sequence-tagged commands (see command_acks); they
+        # get their commands from the AckTracker instead of broadcast_command
+        self.ack_boards: Set[str] = set()
         # Active frontend clients
         self.active_clients: List[WebSocket] = []
+        # Outbound queue + writer task per frontend client
+        self.client_channels: Dict[WebSocket, ClientChannel] = {}
         # Store last known state: device_type -> "on" | "off"
-        self.device_states: Dict[str, str] = {
-            "light": "off",
-            "fan": "off",
-            "kitchen light": "off",
-            "refrigerator": "off",  # Default match for 'fridge'
-            "tv": "off",
-            "hometheater": "off"
-        }
-
-    async def connect_device(self, device_id: str, websocket: WebSocket):
-        await websocket.accept()
+        self.device_states: Dict[str, str] = {d.name: "off" for d in DEVICES}
+        self._essential = {d.name for d in DEVICES if d.essential}
+        # Called as listener(device_type, state) for every actual state change
+        self.state_listeners: List[Callable[[str, str], None]] = []
+        # Called as listener(states, text_frames) after each broadcast_states
+        self.broadcast_listeners: List[Callable[[Dict[str, str], List[str]], None]] = []
+        # Called as listener(device_id) when a board connects, leaves or changes its devices
+        self.board_listeners: List[Callable[[str], None]] = []
+
+    async def connect_device(self, device_id: str, websocket: WebSocket, devices: Optional[Iterable[str]] = None,
+                             ack: bool = False):
+        """
+        devices: the device types this board drives (None = every command).
+        ack: the board acknowledges sequence-tagged commands.
+        """
+        protocol, subprotocol = negotiate(websocket)
+        await websocket.accept(subprotocol=subprotocol)
+        previous = self.active_devices.get(device_id)
+        if previous is not None and previous is not websocket:
+            # The board reconnected (flaky Wi-Fi); the old socket is half-open at best
+            asyncio.create_task(self._close_quietly(previous, 1000))
         self.active_devices[device_id] = websocket
-        print(f"Device connected: {device_id}")
+        self.device_protocols[device_id] = protocol
+        if ack:
+            self.ack_boards.add(device_id)
+        else:
+            self.ack_boards.discard(device_id)
+        self.set_board_devices(device_id, devices)
+        owned = ", ".join(sorted(self.board_devices[device_id])) if device_id in self.board_devices else "all"
+        logger.info("Device connected: %s (%s, devices: %s%s)", device_id, protocol, owned, ", acks" if ack else "")
 
-    def disconnect_device(self, device_id: str):
+    def disconnect_device(self, device_id: str, websocket: WebSocket = None):
+        """Removes a board. With websocket, only if that socket is still the board's current one."""
+        if websocket is not None and self.active_devices.get(device_id) is not websocket:
+            return
         if device_id in self.active_devices:
             del self.active_devices[device_id]
-            print(f"Device disconnected: {device_id}")
+            self.device_protocols.pop(device_id, None)
+            self.ack_boards.discard(device_id)
+            self._unroute(device_id)
+            self._board_changed(device_id)
+            logger.info("Device disconnected: %s", device_id)
+
+    def evict_device(self, device_id: str, close_code: int) -> bool:
+        """Closes and removes a board's socket (e.g. missed heartbeats). Returns False if not connected."""
+        websocket = self.active_devices.get(device_id)
+        if websocket is None:
+            return False
+        self.disconnect_device(device_id)
+        asyncio.create_task(self._close_quietly(websocket, close_code))
+        return True
+
+    def set_board_devices(self, device_id: str, devices: Optional[Iterable[str]]):
+        """
+        Declares which device types a board drives ("kitchen", "fridge" etc. are
+        accepted). None, an empty list or "all" makes it a wildcard again.
+        """
+        self._unroute(device_id)
+        owned = frozenset(BOARD_NAMES.get(d, d) for d in (n.strip() for n in devices or ()) if d)
+        if not owned or "all" in owned:
+            self.wildcard_boards.add(device_id)
+        else:
+            self.board_devices[device_id] = owned
+            for device_type in owned:
+                self.device_routes.setdefault(device_type, set()).add(device_id)
+        if device_id in self.active_devices:
+            self._board_changed(device_id)
+
+    def _board_changed(self, device_id: str):
+        for listener in self.board_listeners:
+            listener(device_id)
+
+    def _unroute(self, device_id: str):
+        self.wildcard_boards.discard(device_id)
+        for device_type in self.board_devices.pop(device_id, ()):
+            boards = self.device_routes.get(device_type)
+            if boards is not None:
+                boards.discard(device_id)
+                if not boards:
+                    del self.device_routes[device_type]
+
+    def boards_for(self, devices: Iterable[str]) -> Set[str]:
+        """Connected boards that should receive a command for these device types."""
+        boards = set(self.wildcard_boards)
+        for device_type in devices:
+            boards.update(self.device_routes.get(device_type, ()))
+        return boards
 
     async def connect_client(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_clients.append(websocket)
+        protocol, subprotocol = negotiate(websocket)
+        await websocket.accept(subprotocol=subprotocol)
+        channel = self.register_client(websocket, protocol)
         # Send current state to the new client
-        print("Sending initial state to client...")
-        for device, state in self.device_states.items():
-            action = "turn_on" if state == "on" else "turn_off"
-            await websocket.send_text(f"ACTION:{action}:{device}")
-
-    def update_state(self, device_type: str, action: str):
-        """Updates the internal state based on action."""
-        # Normalize
-        if device_type == "fridge": device_type = "refrigerator"
-        if device_type == "home theater": device_type = "hometheater"
-        
+        logger.debug("Sending initial state to client (%s)", protocol)
+        if protocol == PROTO_TEXT:
+            for frame in client_text_frames(self.device_states):
+                channel.offer(frame)
+        else:
+            # The whole house in a single frame
+            channel.offer(encode(state_message(SNAPSHOT, self.device_states), protocol))
+
+    def register_client(self, websocket: WebSocket, protocol: str = PROTO_TEXT) -> ClientChannel:
+        """Adds an already-accepted socket to the broadcast set."""
+        channel = ClientChannel(websocket, self, protocol=protocol)
+        self.client_channels[websocket] = channel
+        self.active_clients.append(websocket)
+        return channel
+
+    def add_state_listener(self, listener: Callable[[str, str], None]):
+        self.state_listeners.append(listener)
+
+    def update_state(self, device_type: str, action: str) -> List[str]:
+        """Updates the internal state based on action. Returns the device types that changed."""
+        # Normalize ("fridge" -> "refrigerator", "home theater" -> "hometheater")
+        device_type = canonical_name(device_type)
+
         state = "on" if action == "turn_on" else "off"
-        
+
         if device_type == "all":
-            for d in self.device_states:
-                # Essential appliance protection: Do NOT turn off fridge in batch
-                if d in ["refrigerator", "fridge"] and action == "turn_off":
-                    continue
-                self.device_states[d] = state
+            # Essential appliance protection: Do NOT turn off fridge in batch
+            targets = [d for d in self.device_states
+                       if not (d in self._essential and action == "turn_off")]
         else:
-            self.device_states[device_type] = state
+            targets = [device_type]
+        return self.apply_states(targets, state)
+
+    def apply_states(self, targets, state: str) -> List[str]:
+        """Sets already-resolved device types to state. Returns the ones that changed."""
+        changed = [d for d in targets if self.device_states.get(d) != state]
+        for d in changed:
+            self.device_states[d] = state
+            for listener in self.state_listeners:
+                listener(d, state)
+        return changed
 
     def disconnect_client(self, websocket: WebSocket):
         if websocket in self.active_clients:
             self.active_clients.remove(websocket)
+        channel = self.client_channels.pop(websocket, None)
+        if channel:
+            channel.close()
+
+    def drop_client(self, websocket: WebSocket, close_code: int = None):
+        """Removes a broken or too-slow client, optionally closing its socket."""
+        if websocket not in self.client_channels:
+            return
+        self.disconnect_client(websocket)
+        if close_code is not None:
+            asyncio.create_task(self._close_quietly(websocket, close_code))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    def send_to_client(self, websocket: WebSocket, message: str) -> bool:
+        """Queues a frame for one frontend client (keeps ordering with broadcasts)."""
+        channel = self.client_channels.get(websocket)
+        return channel.offer(message) if channel else False
 
     async def send_command_to_device(self, device_id: str, command: str):
-        if device_id in self.active_devices:
-            await self.active_devices[device_id].send_text(command)
+        websocket = self.active_devices.get(device_id)
+        if websocket is None:
+            return False
+        return await self._send_to_device(device_id, websocket, command)
+
+    async def _send_to_device(self, device_id: str, websocket: WebSocket, command: Frame) -> bool:
+        try:
+            if isinstance(command, bytes):
+                await asyncio.wait_for(websocket.send_bytes(command), DEVICE_SEND_TIMEOUT)
+            else:
+                await asyncio.wait_for(websocket.send_text(command), DEVICE_SEND_TIMEOUT)
             return True
-        return False
+        except Exception as e:
+            logger.warning("Send to %s failed, removing: %r", device_id, e)
+            # Only remove if it was not replaced by a reconnect in the meantime
+            if self.active_devices.get(device_id) is websocket:
+                self.disconnect_device(device_id)
+            return False
+
+    async def broadcast_to_devices(self, command: str) -> int:
+        """Sends a command to every connected ESP32 concurrently. Returns the number delivered."""
+        if not self.active_devices:
+            return 0
+        results = await asyncio.gather(*(
+            self._send_to_device(device_id, ws, command)
+            for device_id, ws in list(self.active_devices.items())
+        ))
+        return sum(results)
+
+    async def _send_frames(self, device_id: str, websocket: WebSocket, frames: List[Frame]) -> bool:
+        # In order on one board; stops at the first failure (the board is gone)
+        for frame in frames:
+            if not await self._send_to_device(device_id, websocket, frame):
+                return False
+        return True
+
+    async def broadcast_command(self, action: str, devices: Sequence[str], text_commands: Sequence[str],
+                                frames: Dict = None) -> int:
+        """
+        Sends one command to the ESP32s that drive any of `devices`, and to
+        wildcard boards (ack-capable boards are left to the AckTracker). text_commands[i] is the text frame for devices[i]
+        (e.g. "turn_on:light"); each board only gets the devices it owns, as
+        text frames or a single compact frame. Each encoding is built once,
+        however many boards share it; pass the same frames dict for repeated
+        commands to reuse encodings across calls.
+        """
+        if not self.active_devices:
+            return 0
+        started = time.perf_counter()
+        if frames is None:
+            frames = {}
+        sends = []
+        for device_id in self.boards_for(devices):
+            ws = self.active_devices.get(device_id)
+            if ws is None or device_id in self.ack_boards:
+                continue
+            protocol = self.device_protocols.get(device_id, PROTO_TEXT)
+            owned = self.board_devices.get(device_id)
+            subset = tuple(devices) if owned is None else tuple(d for d in devices if d in owned)
+            key = (protocol, subset)
+            if key not in frames:
+                if protocol == PROTO_TEXT:
+                    frames[key] = [c for d, c in zip(devices, text_commands) if d in subset]
+                else:
+                    frames[key] = [encode(command_message(action, subset), protocol)]
+            sends.append(self._send_frames(device_id, ws, frames[key]))
+        sent = sum(await asyncio.gather(*sends))
+        broadcast_seconds.observe(time.perf_counter() - started, "devices")
+        return sent
 
     async def broadcast_status(self, message: str):
-        for connection in self.active_clients:
-            await connection.send_text(message)
+        # Fan-out only enqueues; each client's writer task does the actual send
+        for channel in list(self.client_channels.values()):
+            channel.offer(message)
+
+    async def broadcast_states(self, states: Dict[str, str], text_frames: List[str],
+                               frames: Dict[str, List[Frame]] = None):
+        """
+        Publishes the device states after one command. Text clients get
+        text_frames, compact clients one update frame with every device in it.
+        Each encoding is built once for the whole fan-out (and reused across
+        calls when the same frames dict is passed again).
+        """
+        self.deliver_states(states, text_frames, frames)
+        for listener in self.broadcast_listeners:
+            listener(states, text_frames)
+
+    def deliver_states(self, states: Dict[str, str], text_frames: List[str],
+                       frames: Dict[str, List[Frame]] = None):
+        """broadcast_states for this process's clients only (states from another worker)."""
+        if not self.client_channels:
+            return
+        started = time.perf_counter()
+        if frames is None:
+            frames = {}
+        frames[PROTO_TEXT] = text_frames
+        for channel in list(self.client_channels.values()):
+            if channel.protocol not in frames:
+                frames[channel.protocol] = [encode(state_message(UPDATE, states), channel.protocol)]
+            for frame in frames[channel.protocol]:
+                channel.offer(frame)
+        broadcast_seconds.observe(time.perf_counter() - started, "clients")
 
 manager = ConnectionManager()
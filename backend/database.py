@@ -1,18 +1,151 @@
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
 from sqlmodel import SQLModel, create_engine, Session
+from fastapi.concurrency import run_in_threadpool
 
 import os
+import time
+import zlib
+
+from metrics import db_query_seconds
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-# Database is now in sibling directory 'database'
-sqlite_file_name = os.path.join(BASE_DIR, "..", "database", "database.db")
+# Database is now in sibling directory 'database' (SMART_HOME_DB_PATH overrides it)
+sqlite_file_name = os.getenv("SMART_HOME_DB_PATH", os.path.join(BASE_DIR, "..", "database", "database.db"))
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 
-engine = create_engine(sqlite_url, echo=True)
+# --- Database profile ---
+# "production":  WAL journal, synchronous=NORMAL, pooled connections, no SQL echo
+# "development": SQLite defaults with every statement echoed (the old behaviour)
+DB_PROFILE = os.getenv("SMART_HOME_DB_PROFILE", "production")
+# SQL logging only when asked for (defaults to on in development)
+SQL_ECHO = os.getenv("SMART_HOME_SQL_ECHO", "1" if DB_PROFILE == "development" else "0") == "1"
+# Connections kept open for the threadpool; FastAPI runs sync endpoints on up to 40 threads
+DB_POOL_SIZE = int(os.getenv("SMART_HOME_DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("SMART_HOME_DB_MAX_OVERFLOW", "30"))
+# "1": serve run_db() from an aiosqlite engine (pip install aiosqlite). It frees
+# threadpool slots but aiosqlite has lower raw throughput, so it is opt-in.
+DB_ASYNC = os.getenv("SMART_HOME_DB_ASYNC", "0") == "1"
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # Readers no longer block the writer (and vice versa)
+    "PRAGMA synchronous=NORMAL",    # Safe with WAL, avoids an fsync per commit
+    "PRAGMA busy_timeout=5000",     # Wait for a lock instead of failing with "database is locked"
+    "PRAGMA cache_size=-8000",      # 8 MB page cache per connection
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def _apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+# Statement timing for /metrics; the start time rides on the execution context
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    db_query_seconds.observe(time.perf_counter() - context._query_started)
+
+
+def _time_queries(sync_engine):
+    event.listen(sync_engine, "before_cursor_execute", _before_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_execute)
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+
+if DB_PROFILE == "production":
+    engine = create_engine(
+        sqlite_url,
+        echo=SQL_ECHO,
+        # Connections are handed between threadpool threads by the pool
+        connect_args={"check_same_thread": False},
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+    )
+    event.listen(engine, "connect", _apply_pragmas)
+else:
+    engine = create_engine(sqlite_url, echo=SQL_ECHO)
+_time_queries(engine)
+
+# Optional async engine: lets endpoints query without occupying a threadpool slot
+async_engine = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{sqlite_file_name}", echo=SQL_ECHO,
+                                       pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    if DB_PROFILE == "production":
+        event.listen(async_engine.sync_engine, "connect", _apply_pragmas)
+    _time_queries(async_engine.sync_engine)
+
+def schema_version() -> int:
+    """Fingerprint of the tables, columns and indexes the models declare (fits SQLite's user_version)."""
+    parts = []
+    for table in SQLModel.metadata.sorted_tables:
+        parts.append(table.name)
+        parts.extend(f"{c.name}:{type(c.type).__name__}:{c.nullable}:{c.primary_key}" for c in table.columns)
+        parts.extend(sorted(index.name for index in table.indexes))
+    return zlib.crc32("|".join(parts).encode()) & 0x7FFFFFFF
+
+def create_db_and_tables() -> bool:
+    """
+    Creates missing tables. Skipped when the file's user_version already
+    matches schema_version(): one PRAGMA read instead of probing every table.
+    Returns whether create_all ran.
+    """
+    version = schema_version()
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA user_version").scalar() == version:
+            return False
+    try:
+        SQLModel.metadata.create_all(engine)
+    except OperationalError:
+        # Workers starting together on a fresh file: another one created a table
+        # between our check and our CREATE. The second pass sees it and skips it.
+        SQLModel.metadata.create_all(engine)
+    with engine.begin() as conn:
+        upgrade_schema(conn)
+        conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+    return True
+
+def upgrade_schema(conn):
+    """
+    Changes to tables that older files already have (create_all only adds
+    missing tables). Each step checks the columns first, so it runs once.
+    """
+    def columns(table):
+        return {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+
+    if "device_type" not in columns("devicelog"):
+        # DeviceLog.device_id used to be NOT NULL; state changes aren't always tied
+        # to a board. SQLite can't relax NOT NULL in place, so the table is rebuilt.
+        conn.exec_driver_sql("ALTER TABLE devicelog RENAME TO devicelog_old")
+        SQLModel.metadata.tables["devicelog"].create(conn)
+        conn.exec_driver_sql("INSERT INTO devicelog (id, device_id, action, timestamp) "
+                             "SELECT id, device_id, action, timestamp FROM devicelog_old")
+        conn.exec_driver_sql("DROP TABLE devicelog_old")
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+async def run_db(fn):
+    """
+    Runs fn(session) and returns its result.
+    Uses the async engine when available, otherwise a threadpool thread.
+    fn should stick to the plain SQLAlchemy Session API (execute/get/add/commit).
+    """
+    if async_engine is not None:
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            return await session.run_sync(fn)
+
+    def call():
+        with Session(engine, expire_on_commit=False) as session:
+            return fn(session)
+    return await run_in_threadpool(call)
@@ -0,0 +1,111 @@
+import json
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+
+from database import run_db
+from models import Device
+
+
+class DeviceListCache:
+    """
+    Read-through cache of the Device table for GET /devices/.
+    - The serialized JSON body is built once per version and reused.
+    - version increases on every invalidation. It follows the wall clock in
+      milliseconds, so versions (and ETags) from before a restart are never
+      reused and versions from different workers can be compared.
+    - Each device remembers the version it last changed at, for ?since= deltas.
+    """
+
+    def __init__(self):
+        self.version = int(time.time() * 1000)
+        # Changes before this version are unknown (boot / full invalidation)
+        self._baseline = self.version
+        self._body: Optional[bytes] = None
+        self._devices: Dict[str, Dict] = {}
+        self._changed_at: Dict[str, int] = {}
+        self._ids_by_type: Dict[str, List[str]] = {}
+        # Called as listener(device_ids or None) on every invalidation made by this process
+        self.listeners: List[Callable[[Optional[List[str]]], None]] = []
+
+        # Stats
+        self.hits = 0
+        self.loads = 0
+
+    @property
+    def etag(self) -> str:
+        return f'W/"{self.version}"'
+
+    async def _load(self):
+        """
+        Reads the table. Returns (devices, body, version): the rows are at least
+        as new as version. body is None when an invalidation arrived meanwhile;
+        nothing is cached then and the next request reloads.
+        """
+        version = self.version
+        rows = await run_db(lambda session: session.execute(select(Device)).scalars().all())
+        if version != self.version:
+            return [row.model_dump(mode="json") for row in rows], None, version
+        devices = [row.model_dump(mode="json") for row in rows]
+        self._devices = {d["id"]: d for d in devices}
+        self._ids_by_type = {}
+        for d in devices:
+            self._ids_by_type.setdefault(d["type"], []).append(d["id"])
+        self._body = json.dumps(devices).encode()
+        self.loads += 1
+        return devices, self._body, version
+
+    async def body(self) -> bytes:
+        """Serialized device list for the current version."""
+        if self._body is not None:
+            self.hits += 1
+            return self._body
+        devices, body, _ = await self._load()
+        return body if body is not None else json.dumps(devices).encode()
+
+    async def changes_since(self, since: int) -> Dict:
+        """Devices changed after `since`; the full list when that can't be answered."""
+        if self._body is None:
+            # The rows just read, with the version they match: a change that raced
+            # the read is newer than it, so the client's next ?since= picks it up
+            loaded, _, version = await self._load()
+            devices = {d["id"]: d for d in loaded}
+        else:
+            self.hits += 1
+            devices, version = self._devices, self.version
+        if since < self._baseline:
+            return {"version": version, "full": True, "devices": list(devices.values())}
+        changed = [devices[i] for i, v in self._changed_at.items() if v > since and i in devices]
+        return {"version": version, "full": False, "devices": changed}
+
+    def invalidate(self, device_ids: Optional[Iterable[str]] = None):
+        """Drops the cached list. Without device_ids, deltas restart from a full list."""
+        if device_ids is not None:
+            device_ids = list(device_ids)
+        self.expire(device_ids)
+        for listener in self.listeners:
+            listener(device_ids)
+
+    def expire(self, device_ids: Optional[Iterable[str]] = None):
+        """invalidate() without notifying listeners (changes made by another worker)."""
+        self.version = max(self.version + 1, int(time.time() * 1000))
+        self._body = None
+        if device_ids is None:
+            self._baseline = self.version
+            self._changed_at.clear()
+        else:
+            for device_id in device_ids:
+                self._changed_at[device_id] = self.version
+
+    def invalidate_types(self, device_types: Iterable[str]):
+        """State-change hook: Device.status changed for every row of these types."""
+        ids = [i for t in device_types for i in self._ids_by_type.get(t, ())]
+        if ids:
+            self.invalidate(ids)
+
+    def stats(self) -> Dict:
+        return {"version": self.version, "hits": self.hits, "loads": self.loads}
+
+
+device_cache = DeviceListCache()
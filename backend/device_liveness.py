@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import Session, select, update
+
+from connection_manager import ConnectionManager
+from models import Device
+
+# Seconds between "ping" frames to every connected ESP32
+HEARTBEAT_INTERVAL = 15.0
+# A board that answers pings is evicted after this long without any message (3 missed pings)
+IDLE_TIMEOUT = 45.0
+# Seconds between batched Device.last_seen / ip_address writes
+LAST_SEEN_FLUSH_INTERVAL = 30.0
+# Close code sent to evicted boards (1001: going away; the firmware reconnects)
+EVICT_CLOSE_CODE = 1001
+# Disconnected boards remembered for the online/offline view; beyond this the
+# longest-silent are forgotten (board ids come from clients)
+MAX_OFFLINE_BOARDS = 256
+
+logger = logging.getLogger("smart_home.liveness")
+
+
+class DeviceLiveness:
+    """
+    Heartbeat and presence tracking for /ws/device/{device_id} sockets.
+    - Every HEARTBEAT_INTERVAL each board gets a "ping" text frame. Old firmware
+      ignores it (no ':'); boards that answer "pong" are heartbeat-capable.
+    - A heartbeat-capable board silent for IDLE_TIMEOUT is a half-open socket:
+      it is closed and removed, so commands stop being sent into the void.
+      Boards that never answered are left to send failures and the server's
+      protocol-level pings (uvicorn's ws_ping_interval).
+    - Any message marks the board as seen. last_seen / ip_address are kept in
+      memory and written to the Device rows in one transaction per flush.
+      Once written, disconnected boards beyond max_offline are forgotten.
+    """
+
+    def __init__(self, connections: ConnectionManager, engine,
+                 interval: float = HEARTBEAT_INTERVAL, idle_timeout: float = IDLE_TIMEOUT,
+                 flush_interval: float = LAST_SEEN_FLUSH_INTERVAL, max_offline: int = MAX_OFFLINE_BOARDS):
+        self.connections = connections
+        self.engine = engine
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.flush_interval = flush_interval
+        self.max_offline = max_offline
+        # device_id -> time.monotonic() of the last message
+        self.last_activity: Dict[str, float] = {}
+        self.addresses: Dict[str, str] = {}
+        self.heartbeat_boards: Set[str] = set()
+        self._dirty: Set[str] = set()
+        self._last_flush = time.monotonic()
+        self._task: asyncio.Task = None
+        # Called with the Device ids written after each flush
+        self.flush_listeners: List[Callable[[List[str]], None]] = []
+
+        # Stats
+        self.pings = 0
+        self.evicted = 0
+        self.flushes = 0
+        self.forgotten = 0
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the heartbeat and writes pending last_seen values."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    def connected(self, device_id: str, ip_address: Optional[str]):
+        if ip_address:
+            self.addresses[device_id] = ip_address
+        self.touch(device_id)
+
+    def touch(self, device_id: str):
+        """Called for every message from a board. Memory only."""
+        self.last_activity[device_id] = time.monotonic()
+        self._dirty.add(device_id)
+
+    def pong(self, device_id: str):
+        self.heartbeat_boards.add(device_id)
+        self.touch(device_id)
+
+    def disconnected(self, device_id: str):
+        # A reconnect may already have replaced this socket
+        if device_id not in self.connections.active_devices:
+            self.heartbeat_boards.discard(device_id)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.exception("Heartbeat failed: %r", e)
+
+    async def tick(self):
+        """One heartbeat round: evict idle boards, ping the rest, flush last_seen when due."""
+        now = time.monotonic()
+        for device_id in list(self.heartbeat_boards):
+            if now - self.last_activity.get(device_id, 0) > self.idle_timeout:
+                self.evict(device_id)
+
+        if self.connections.active_devices:
+            # Sends that fail remove the board right away
+            await self.connections.broadcast_to_devices("ping")
+            self.pings += 1
+
+        if now - self._last_flush >= self.flush_interval:
+            await self.flush()
+        self.forget_offline()
+
+    def forget_offline(self):
+        """Drops the longest-silent disconnected boards beyond max_offline (not those awaiting a flush)."""
+        offline = [d for d in self.last_activity
+                   if d not in self.connections.active_devices and d not in self._dirty]
+        excess = len(offline) - self.max_offline
+        if excess <= 0:
+            return
+        offline.sort(key=self.last_activity.__getitem__)
+        for device_id in offline[:excess]:
+            del self.last_activity[device_id]
+            self.addresses.pop(device_id, None)
+            self.heartbeat_boards.discard(device_id)
+        self.forgotten += excess
+
+    def evict(self, device_id: str):
+        logger.info("Device %s missed its heartbeats, evicting", device_id)
+        self.heartbeat_boards.discard(device_id)
+        if self.connections.evict_device(device_id, EVICT_CLOSE_CODE):
+            self.evicted += 1
+
+    def last_seen(self, device_id: str) -> Optional[datetime]:
+        """Wall-clock time of the last message (derived from the monotonic timestamp)."""
+        seen = self.last_activity.get(device_id)
+        if seen is None:
+            return None
+        return datetime.utcnow() - timedelta(seconds=time.monotonic() - seen)
+
+    async def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._dirty:
+            return
+        updates = {d: (self.last_seen(d), self.addresses.get(d)) for d in self._dirty}
+        self._dirty.clear()
+        try:
+            device_ids = await run_in_threadpool(self._write, updates)
+        except SQLAlchemyError as e:
+            logger.error("last_seen write failed for %d boards: %s", len(updates), e)
+            return
+        self.flushes += 1
+        if device_ids:
+            for listener in self.flush_listeners:
+                listener(device_ids)
+
+    def _write(self, updates: Dict) -> List[str]:
+        # Device rows of a board: id "<board>" or "<board>:<relay>" (see /ws/device)
+        written = []
+        with Session(self.engine) as session:
+            for board, (seen, ip_address) in updates.items():
+                ids = session.exec(select(Device.id).where(or_(
+                    Device.id == board, Device.id.startswith(f"{board}:", autoescape=True)))).all()
+                if not ids:
+                    continue
+                values = {"last_seen": seen}
+                if ip_address:
+                    values["ip_address"] = ip_address
+                session.exec(update(Device).where(Device.id.in_(ids)).values(**values))
+                written.extend(ids)
+            session.commit()
+        return written
+
+    def status(self) -> Dict:
+        """Online/offline view from memory: connected boards and the most recently seen others."""
+        boards = []
+        for device_id in sorted(self.last_activity.keys() | self.connections.active_devices.keys()):
+            owned = self.connections.board_devices.get(device_id)
+            seen = self.last_seen(device_id)
+            boards.append({
+                "device_id": device_id,
+                "online": device_id in self.connections.active_devices,
+                "heartbeat": device_id in self.heartbeat_boards,
+                "last_seen": seen.isoformat() if seen else None,
+                "ip_address": self.addresses.get(device_id),
+                "devices": sorted(owned) if owned is not None else "all",
+            })
+        return {
+            "online": sum(b["online"] for b in boards),
+            "offline": sum(not b["online"] for b in boards),
+            "boards": boards,
+        }
+
+    def stats(self) -> Dict:
+        return {"pings": self.pings, "evicted": self.evicted, "flushes": self.flushes,
+                "pending_last_seen": len(self._dirty), "boards": len(self.last_activity),
+                "forgotten": self.forgotten}
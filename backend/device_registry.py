@@ -0,0 +1,57 @@
+from typing import Dict, NamedTuple, Optional, Tuple
+
+
+class DeviceSpec(NamedTuple):
+    name: str                 # Canonical device_type used in device_states and the UI
+    number: int               # Spoken index: "turn on number 3" / "turn on 3"
+    synonyms: Tuple[str, ...]  # Words the fast path recognizes for this device
+    esp32_name: str           # Device name in "action:device" commands for polling boards
+    essential: bool = False   # Never switched off by an "all" command
+    watts: float = 0.0        # Nominal draw, for energy estimates in usage reports
+
+
+# Single source of truth for the six relays on the ESP32 board
+DEVICES: Tuple[DeviceSpec, ...] = (
+    DeviceSpec("light", 1, ("light",), "light", watts=10),
+    DeviceSpec("fan", 2, ("fan",), "fan", watts=60),
+    DeviceSpec("kitchen light", 3, (), "kitchen", watts=10),
+    DeviceSpec("refrigerator", 4, ("fridge", "refrigerator"), "refrigerator", essential=True, watts=150),
+    DeviceSpec("tv", 5, ("tv",), "tv", watts=100),
+    DeviceSpec("hometheater", 6, ("home theater", "hometheater"), "hometheater", watts=200),
+)
+
+# Recognized by the intent parser but not wired to a relay
+GENERIC_TYPES: Tuple[str, ...] = ("relay", "ac", "heater")
+
+# Words meaning "every device"
+ALL_WORDS: Tuple[str, ...] = ("all", "everything")
+
+DEVICE_TYPES: Tuple[str, ...] = tuple(d.name for d in DEVICES)
+BY_NAME: Dict[str, DeviceSpec] = {d.name: d for d in DEVICES}
+BY_NUMBER: Dict[str, str] = {str(d.number): d.name for d in DEVICES}
+
+# Any spoken alias -> canonical name
+ALIASES: Dict[str, str] = {d.name: d.name for d in DEVICES}
+for _device in DEVICES:
+    for _synonym in _device.synonyms:
+        ALIASES[_synonym] = _device.name
+
+# Names a board may declare for its relays: aliases plus the polling names ("kitchen")
+BOARD_NAMES: Dict[str, str] = dict(ALIASES)
+for _device in DEVICES:
+    BOARD_NAMES.setdefault(_device.esp32_name, _device.name)
+
+
+def canonical_name(device_type: str) -> str:
+    """Maps aliases like 'fridge' or 'home theater' to the canonical device_type."""
+    return ALIASES.get(device_type, device_type)
+
+
+def spoken_vocabulary() -> Tuple[str, ...]:
+    """Every device word the fast path should match, longest first so regex alternation is greedy."""
+    words = [s for d in DEVICES for s in d.synonyms] + list(GENERIC_TYPES) + list(ALL_WORDS)
+    return tuple(sorted(dict.fromkeys(words), key=len, reverse=True))
+
+
+def lookup(device_type: str) -> Optional[DeviceSpec]:
+    return BY_NAME.get(canonical_name(device_type))
@@ -0,0 +1,292 @@
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from command_acks import AckTracker
+from command_queue import CommandQueue, command_queue
+from connection_manager import ConnectionManager, manager
+from device_registry import ALL_WORDS, BOARD_NAMES, DEVICES, GENERIC_TYPES, canonical_name, lookup
+from latency import LatencyRecorder, command_latency
+from ws_protocol import Frame, client_text_frames
+
+ACTIONS = ("turn_on", "turn_off")
+# device_type of plans built for an explicit set of devices (scenes, bulk commands)
+GROUP = "group"
+# Bulk command selectors besides the "all" words: every device currently on / off
+STATE_SELECTORS = ("on", "off")
+# Group plans kept for reuse; scenes repeat, one-off device sets shouldn't grow the table forever
+MAX_GROUP_PLANS = 1024
+
+
+class CommandPlan(NamedTuple):
+    """Everything one command needs, worked out once and reused for every dispatch."""
+    action: str                      # "turn_on" | "turn_off"
+    device_type: str                 # Canonical device_type, "all" or GROUP
+    state: str                       # "on" | "off"
+    targets: Tuple[str, ...]         # Devices switched ("all" expanded, essentials protected)
+    states: Dict[str, str]           # target -> state, for compact update frames
+    client_frames: List[str]         # Text dashboard frames
+    device_commands: List[str]       # Text WebSocket ESP32 frames
+    poll_commands: Tuple[str, ...]   # Lines for HTTP-polling ESP32s
+    # Encoded frames per protocol (and per board device set), filled on first use
+    client_cache: Dict[str, List[Frame]]
+    device_cache: Dict[Tuple[str, Tuple[str, ...]], List[Frame]]
+
+
+def build_plan(action: str, device_type: str) -> CommandPlan:
+    state = "on" if action == "turn_on" else "off"
+    device_type = "all" if device_type in ALL_WORDS else canonical_name(device_type)
+
+    if device_type == "all":
+        # Essential appliance protection: Do NOT turn off fridge in batch
+        targets = tuple(d.name for d in DEVICES if not (d.essential and action == "turn_off"))
+        # Individual updates to ensure robust sync, plus the 'all' simplified message for UI convenience
+        client_frames = [f"ACTION:{action}:{d}" for d in targets] + [f"ACTION:{action}:all"]
+        # WebSocket firmware switches by canonical name; polling firmware understands "all"
+        device_commands = [f"{action}:{d}" for d in targets]
+        poll_commands = (f"{action}:all",)
+    else:
+        targets = (device_type,)
+        client_frames = [f"ACTION:{action}:{device_type}"]
+        device_commands = [f"{action}:{device_type}"]
+        poll_commands = (poll_line(action, device_type),)
+
+    return CommandPlan(action, device_type, state, targets, {d: state for d in targets},
+                       client_frames, device_commands, poll_commands, {}, {})
+
+
+def poll_line(action: str, device_type: str) -> str:
+    # Polling boards use their own short names ("kitchen light" -> "kitchen")
+    spec = lookup(device_type)
+    return f"{action}:{spec.esp32_name if spec else device_type}"
+
+
+def build_group_plan(action: str, targets: Tuple[str, ...]) -> CommandPlan:
+    """Plan for one action on an explicit set of canonical device types."""
+    state = "on" if action == "turn_on" else "off"
+    return CommandPlan(action, GROUP, state, targets, {d: state for d in targets},
+                       [f"ACTION:{action}:{d}" for d in targets], [f"{action}:{d}" for d in targets],
+                       tuple(poll_line(action, d) for d in targets), {}, {})
+
+
+def expand_states(states: Dict[str, str]) -> Dict[str, str]:
+    """
+    Canonical device_type -> "on" | "off" for a requested mix of states.
+    "all" / "everything" stands for every registry device (the fridge is left
+    alone on "off"); devices named individually override it.
+    """
+    expanded: Dict[str, str] = {}
+    for name, state in states.items():
+        if name in ALL_WORDS:
+            expanded.update({d.name: state for d in DEVICES if not (d.essential and state == "off")})
+    for name, state in states.items():
+        if name not in ALL_WORDS:
+            expanded[canonical_name(name)] = state
+    return expanded
+
+
+def normalize_states(states: Dict[str, str]) -> Dict[str, str]:
+    """Validated device states: name -> "on" | "off", names made canonical ("all" kept)."""
+    if not isinstance(states, dict) or not states:
+        raise ValueError("No device states given")
+    normalized = {}
+    for name, state in states.items():
+        state = str(state).lower()
+        if state not in ("on", "off"):
+            raise ValueError(f"State for {name!r} must be 'on' or 'off'")
+        name = str(name).strip().lower()
+        if name not in ALL_WORDS and name not in GENERIC_TYPES:
+            if name not in BOARD_NAMES:
+                raise ValueError(f"Unknown device {name!r}")
+            name = BOARD_NAMES[name]
+        normalized[name] = state
+    return normalized
+
+
+class CommandDispatcher:
+    """
+    Single command pipeline for the HTTP, voice and WebSocket paths.
+    Plans for every registry device (and every UI message naming one) are
+    built at startup, so a dispatch is a dict lookup plus the fan-out:
+    state + persistence, dashboards, WebSocket ESP32s and the poll queue.
+    Devices driven by ack-capable boards are left to the AckTracker, which
+    applies their state once the board confirms.
+    With several workers, listeners pass each plan on to the other workers,
+    which run send_to_devices() for the boards connected to them.
+    """
+
+    def __init__(self, connections: ConnectionManager, queue: CommandQueue, acks: AckTracker = None,
+                 latency: LatencyRecorder = command_latency):
+        self.connections = connections
+        self.queue = queue
+        self.acks = acks
+        self.latency = latency
+        self._dispatch_seconds = latency.stage("dispatch")
+        self.plans: Dict[Tuple[str, str], CommandPlan] = {}
+        # Exact UI messages ("ACTION:turn_on:light") -> plan
+        self.messages: Dict[str, CommandPlan] = {}
+        # (action, targets) -> plan, for scenes and bulk commands
+        self.group_plans: Dict[Tuple[str, Tuple[str, ...]], CommandPlan] = {}
+        # Called as listener(plan) after every dispatch
+        self.listeners: List[Callable[[CommandPlan], None]] = []
+        names = [d.name for d in DEVICES] + [s for d in DEVICES for s in d.synonyms] + list(GENERIC_TYPES)
+        for action in ACTIONS:
+            for name in dict.fromkeys(names + list(ALL_WORDS)):
+                plan = build_plan(action, name)
+                self.plans[(action, name)] = plan
+                self.messages[f"ACTION:{action}:{name}"] = plan
+
+        # Stats
+        self.dispatched = 0
+
+    def plan(self, action: str, device_type: str) -> Optional[CommandPlan]:
+        """Plan for a command, or None if it is not a switch action."""
+        if action not in ACTIONS or not device_type:
+            return None
+        plan = self.plans.get((action, device_type))
+        # Unknown device names are planned per call and not kept, so they can't grow the table
+        return plan if plan is not None else build_plan(action, device_type)
+
+    def parse_client_message(self, data: str) -> Optional[CommandPlan]:
+        """Plan for a dashboard frame: "ACTION:turn_on:light" or "toggle:light"."""
+        plan = self.messages.get(data)
+        if plan is not None:
+            return plan
+
+        # SUPPORT SIMPLE PROTOCOL: "toggle:device"
+        if data.startswith("toggle:"):
+            device_type = canonical_name(data[len("toggle:"):])
+            # Determine next state based on current state
+            current_state = self.connections.device_states.get(device_type, "off")
+            return self.plan("turn_off" if current_state == "on" else "turn_on", device_type)
+
+        # Parse command: "ACTION:turn_on:light"
+        parts = data.split(":")
+        if len(parts) >= 3 and parts[0] == "ACTION":
+            return self.plan(parts[1], parts[2])
+        return None
+
+    async def dispatch(self, plan: CommandPlan, started: float = None) -> List[str]:
+        """
+        Applies a plan everywhere in one pass. Returns the device types that changed.
+        started: time.perf_counter() when the request arrived, for end-to-end latency.
+        """
+        dispatched_at = time.perf_counter()
+        confirmed = self.acks.confirmed(plan.targets) if self.acks else None
+
+        if not confirmed:
+            # State + persistence (the state writer listens on the manager)
+            changed = self.connections.apply_states(plan.targets, plan.state)
+            # Dashboards: queued per client, text or one compact frame
+            await self.connections.broadcast_states(plan.states, plan.client_frames, plan.client_cache)
+        else:
+            # Only devices no ack-capable board drives are applied optimistically
+            states = {d: plan.state for d in plan.targets if d not in confirmed}
+            changed = self.connections.apply_states(list(states), plan.state)
+            if states:
+                await self.connections.broadcast_states(states, client_text_frames(states))
+
+        # HTTP-polling ESP32s
+        for command in plan.poll_commands:
+            self.queue.publish(command)
+        # WebSocket ESP32s (ack-capable ones are connected ones too)
+        if self.connections.active_devices:
+            await self.send_to_devices(plan, started or dispatched_at)
+        for listener in self.listeners:
+            listener(plan)
+
+        self._dispatch_seconds.observe(time.perf_counter() - dispatched_at)
+        self.dispatched += 1
+        return changed
+
+    def group_plan(self, action: str, targets: Tuple[str, ...]) -> CommandPlan:
+        plan = self.group_plans.get((action, targets))
+        if plan is None:
+            if len(self.group_plans) >= MAX_GROUP_PLANS:
+                del self.group_plans[next(iter(self.group_plans))]
+            plan = self.group_plans[(action, targets)] = build_group_plan(action, targets)
+        return plan
+
+    def bulk_states(self, commands: List[Dict[str, str]] = (), select: Optional[str] = None,
+                    action: Optional[str] = None) -> Dict[str, str]:
+        """
+        Resolves a bulk command to canonical device_type -> state:
+        (device_type, action) pairs, and/or one action for a group selected by
+        select: "all" / "everything", or "on" / "off" for the devices in that
+        state now. Pairs override the group. Raises ValueError on bad input.
+        """
+        requested: Dict[str, str] = {}
+        if select is not None:
+            if action not in ACTIONS:
+                raise ValueError("A selector needs an action: turn_on or turn_off")
+            state = "on" if action == "turn_on" else "off"
+            if select in ALL_WORDS:
+                requested[select] = state
+            elif select in STATE_SELECTORS:
+                # Like "all", a group never switches the fridge off
+                requested.update({d.name: state for d in DEVICES
+                                  if self.connections.device_states.get(d.name, "off") == select
+                                  and not (d.essential and state == "off")})
+            else:
+                raise ValueError(f"Unknown selector {select!r}: use all, on or off")
+        for command in commands:
+            if not isinstance(command, dict) or command.get("action") not in ACTIONS:
+                raise ValueError("Each command needs an action (turn_on / turn_off) and a device_type")
+            requested[str(command.get("device_type"))] = "on" if command["action"] == "turn_on" else "off"
+        if not requested:
+            return {}
+        return expand_states(normalize_states(requested))
+
+    async def dispatch_states(self, states: Dict[str, str], started: float = None) -> List[str]:
+        """
+        Applies a mix of states (a scene, a bulk command) in one pass:
+        canonical device_type -> "on" | "off" (see expand_states).
+        Dashboards get one broadcast with every device in it; ESP32s get at
+        most one command per action. Returns the device types that changed.
+        """
+        dispatched_at = time.perf_counter()
+        by_state: Dict[str, List[str]] = {}
+        for device_type, state in states.items():
+            by_state.setdefault(state, []).append(device_type)
+        plans = [self.group_plan("turn_on" if state == "on" else "turn_off", tuple(targets))
+                 for state, targets in by_state.items()]
+
+        # Devices an ack-capable board drives change state once it confirms
+        confirmed = self.acks.confirmed(states) if self.acks else None
+        optimistic = {d: s for d, s in states.items() if not confirmed or d not in confirmed}
+        changed = []
+        for plan in plans:
+            changed.extend(self.connections.apply_states([d for d in plan.targets if d in optimistic], plan.state))
+        if optimistic:
+            await self.connections.broadcast_states(optimistic, client_text_frames(optimistic))
+
+        for plan in plans:
+            for command in plan.poll_commands:
+                self.queue.publish(command)
+            if self.connections.active_devices:
+                await self.send_to_devices(plan, started or dispatched_at)
+            for listener in self.listeners:
+                listener(plan)
+
+        self._dispatch_seconds.observe(time.perf_counter() - dispatched_at)
+        self.dispatched += 1
+        return changed
+
+    async def send_to_devices(self, plan: CommandPlan, started: float):
+        """The WebSocket ESP32 part of a dispatch, for the boards connected to this process."""
+        # Boards that drive one of the targets
+        await self.connections.broadcast_command(plan.action, plan.targets, plan.device_commands,
+                                                 plan.device_cache)
+        routes = self.acks.routes(plan.targets) if self.acks and self.connections.ack_boards else None
+        if routes:
+            await self.acks.issue(plan.action, routes, started)
+
+    async def dispatch_intent(self, result: dict, started: float = None) -> Optional[List[str]]:
+        """Applies a turn_on/turn_off intent from the AI service; other intents are ignored."""
+        plan = self.plan(result.get("action"), result.get("device_type"))
+        if plan is None:
+            return None
+        return await self.dispatch(plan, started)
+
+
+ack_tracker = AckTracker(manager)
+dispatcher = CommandDispatcher(manager, command_queue, ack_tracker)
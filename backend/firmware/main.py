@@ -10,9 +10,23 @@ import ujson
 SERVER_IP = "10.209.6.232" 
 SERVER_PORT = 8000
 DEVICE_ID = "esp32_home"
+# Compact protocol: one JSON frame per command ({"c": {"light": 1, "fan": 1}})
+# instead of one "turn_on:light" frame per device. Set False for old servers.
+COMPACT = True
+# Acknowledge commands: the server tags them with a sequence id ("turn_on:light#17"
+# or {"c": {...}, "q": 17}), we answer "ack:17" once the pin is set, and it
+# resends anything we miss. Set False for old servers.
+ACK = True
 
 # Construct URI
 URI = "ws://{}:{}/ws/device/{}".format(SERVER_IP, SERVER_PORT, DEVICE_ID)
+params = []
+if COMPACT:
+    params.append("proto=compact")
+if ACK:
+    params.append("ack=1")
+if params:
+    URI += "?" + "&".join(params)
 
 # --- HARDWARE SETUP ---
 # GPIO 2: Built-in LED (Status)
@@ -38,16 +52,36 @@ for p in pins.values():
 
 def handle_command(message):
     """
-    Parses "turn_on:light" or "turn_off:fan"
+    Parses "turn_on:light" or "turn_off:fan" (optionally "#<seq>" at the end),
+    or a compact frame {"c": {"light": 1, "fan": 1}} (optionally with "q": <seq>).
+    Returns the sequence id to acknowledge, or None.
     """
     try:
+        if message.startswith("{"):
+            frame = ujson.loads(message)
+            for device_key, value in frame.get("c", {}).items():
+                set_device("turn_on" if value else "turn_off", device_key)
+            return frame.get("q")
+
         if ":" not in message: 
-            return
+            return None
+
+        seq = None
+        if "#" in message:
+            message, seq = message.rsplit("#", 1)
             
         parts = message.split(":")
         action = parts[0]       # "turn_on"
         device_key = parts[1]   # "light"
-        
+        set_device(action, device_key)
+        return seq
+            
+    except Exception as e:
+        print("Command Error:", e)
+        return None
+
+def set_device(action, device_key):
+    try:
         # Normalize
         if device_key == "fridge": device_key = "refrigerator"
         if device_key == "home theater": device_key = "hometheater"
@@ -82,24 +116,31 @@ def run():
             
             # Send initial Greeting
             ws.send("status:connected")
+            # Tell the server which relays this board drives, so it only
+            # receives commands for them
+            ws.send("hello:" + ",".join(pins))
             
             # Loop for Messages
             while True:
                 try:
                     # 1. Try to receive message
                     data = ws.recv()
-                    if data:
+                    if data == "ping":
+                        # Server heartbeat: answer so the server knows we're alive
+                        ws.send("pong")
+                    elif data:
                         print("RX:", data)
-                        handle_command(str(data))
+                        seq = handle_command(str(data))
+                        if seq is not None:
+                            # Pins are set: confirm so the server applies the state
+                            ws.send("ack:{}".format(seq))
                         
                 except OSError:
                     # Timeout (Normal behavior for non-blocking)
                     pass
                 
-                # 2. Keep Connection Alive (Optional "Ping" if server supports it, 
-                # or just rely on TCP keepalive. Here we just sleep briefly)
-                # If you need to send a heartbeat:
-                # ws.send("ping") 
+                # 2. Keep Connection Alive: the server pings every 15 s and
+                # we answer above. Here we just sleep briefly
                 
                 time.sleep(0.1)
                 
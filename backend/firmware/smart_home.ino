@@ -84,6 +84,11 @@ void webSocketEvent(WStype_t type, uint8_t * payload, size_t length) {
       break;
     case WStype_TEXT:
       String text = (char*)payload;
+      // Server heartbeat: answer so the server knows we're alive
+      if (text == "ping") {
+        webSocket.sendTXT("pong");
+        break;
+      }
       Serial.printf("[WSc] Received: %s\n", payload);
       processCommand(text);
       break;
@@ -0,0 +1,445 @@
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from device_registry import ALL_WORDS, DEVICES, canonical_name
+
+# Trained model, written by `python intent_classifier.py` (SMART_HOME_INTENT_MODEL overrides)
+MODEL_PATH = os.getenv("SMART_HOME_INTENT_MODEL",
+                       os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_model.json"))
+# Minimum calibrated P(action) x P(device) to answer without the LLM; below it the LLM
+# decides. The highest that keeps full coverage in benchmarks/eval_intent_classifier.py
+CONFIDENCE_THRESHOLD = float(os.getenv("SMART_HOME_INTENT_CONFIDENCE", "0.7"))
+# Action label for utterances that are not device commands (questions, chit-chat)
+NONE = "none"
+ACTION_LABELS = ("turn_on", "turn_off", NONE)
+DEVICE_LABELS = tuple(d.name for d in DEVICES) + ("all",)
+
+# Training: passes over the data, starting learning rate, weights dropped below this when saved
+EPOCHS = 12
+LEARNING_RATE = 0.5
+PRUNE_BELOW = 0.01
+# Logged commands count this many times over the generated templates
+LOGGED_WEIGHT = 3
+# One phrasing in this many is held out of a first fit to calibrate the confidences
+CALIBRATION_FOLDS = 5
+# Softmax temperatures tried when calibrating (scores are divided by it)
+TEMPERATURES = tuple(t / 4 for t in range(4, 41))
+
+# Words that change what a command means in ways the model can't represent;
+# an utterance containing one goes to the LLM. "t" is the tail of "don't", "can't", "isn't".
+NEGATION_WORDS = frozenset({"not", "never", "no", "don", "dont", "doesn", "didn", "won", "wont", "cannot", "cant",
+                            "nothing", "nobody", "neither", "nor", "t"})
+EXCLUSION_WORDS = frozenset({"except", "but", "besides", "unless", "excluding", "apart", "without", "only"})
+TIME_WORDS = frozenset({"second", "seconds", "sec", "secs", "minute", "minutes", "min", "mins", "hour", "hours",
+                        "tonight", "tomorrow", "today", "later", "after", "before", "until", "till", "when",
+                        "while", "am", "pm", "oclock", "noon", "midnight", "morning", "evening", "night",
+                        "every", "daily", "timer", "schedule", "soon", "once"})
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_QUALIFIER_WORDS = NEGATION_WORDS | EXCLUSION_WORDS | TIME_WORDS
+
+logger = logging.getLogger("smart_home.intent_classifier")
+
+# --- Generated training data ---
+
+# Ways people name each device beyond the registry synonyms
+EXTRA_NAMES: Dict[str, Tuple[str, ...]] = {
+    "light": ("lights", "lamp", "lamps", "bedroom light", "bedroom lights", "living room light", "ceiling light"),
+    "fan": ("fans", "ceiling fan"),
+    "kitchen light": ("kitchen lights", "kitchen lamp", "light in the kitchen", "lights in the kitchen"),
+    "refrigerator": ("freezer",),
+    "tv": ("television", "telly"),
+    "hometheater": ("home theatre", "sound system", "speakers", "surround sound"),
+    "all": ("every device", "all devices", "everything in the house"),
+}
+ON_TEMPLATES = (
+    "turn on the {d}", "turn the {d} on", "switch on the {d}", "switch the {d} on", "{d} on", "{d} on please",
+    "put the {d} on", "power on the {d}", "power up the {d}", "start the {d}", "enable the {d}",
+    "i want the {d} on", "can you turn on the {d}", "could you switch the {d} on", "please turn the {d} on",
+    "activate the {d}", "fire up the {d}", "get the {d} going", "{d} needs to be on",
+)
+OFF_TEMPLATES = (
+    "turn off the {d}", "turn the {d} off", "switch off the {d}", "switch the {d} off", "{d} off", "{d} off please",
+    "put the {d} off", "power off the {d}", "power down the {d}", "stop the {d}", "disable the {d}",
+    "i want the {d} off", "can you turn off the {d}", "could you switch the {d} off", "please turn the {d} off",
+    "kill the {d}", "shut off the {d}", "shut down the {d}", "cut the {d}",
+)
+# Mentions a device but asks something: left to the LLM
+QUESTION_TEMPLATES = (
+    "is the {d} on", "is the {d} off", "how long was the {d} on", "why is the {d} on", "what does the {d} use",
+    "when did the {d} turn off", "how much power does the {d} use", "did i leave the {d} on",
+)
+# Statements about a device or a room with no on/off in them ("too dark" may mean
+# the light, but that is for the LLM to work out)
+STATEMENT_TEMPLATES = (
+    "the {d} is broken", "the {d} is making a weird noise", "where is the {d}", "i like the {d}",
+    "the {d} is too loud", "the {d} needs cleaning", "buy a new {d}", "what brand is the {d}", "{d}",
+    "the {d} again", "something is wrong with the {d}", "i love my new {d}",
+)
+ROOMS = ("bedroom", "kitchen", "living room", "here", "the house")
+ROOM_STATEMENTS = (
+    "it's too dark in the {r}", "it's too bright in the {r}", "it's too hot in the {r}", "it's cold in the {r}",
+    "it's stuffy in the {r}", "the {r} is a mess", "clean the {r}", "i'm in the {r}", "it's quiet in the {r}",
+)
+NOT_COMMANDS = (
+    "what time is it", "tell me a joke", "what's the weather like", "how are you", "play some music",
+    "set a timer for ten minutes", "what is the temperature outside", "hello", "thank you", "who are you",
+    "what can you do", "remind me to buy milk", "good morning", "how do i reset my password",
+    "what's on my calendar today", "order a pizza", "call mom", "read me the news", "never mind", "stop talking",
+)
+
+
+def device_names(label: str) -> Tuple[str, ...]:
+    if label == "all":
+        return tuple(ALL_WORDS) + EXTRA_NAMES["all"]
+    spec = next(d for d in DEVICES if d.name == label)
+    return tuple(dict.fromkeys((spec.name,) + spec.synonyms + EXTRA_NAMES.get(label, ())))
+
+
+def held_out(phrasing: str) -> bool:
+    """Whether a template (or a logged utterance) is in the calibration fold."""
+    return zlib.crc32(phrasing.encode()) % CALIBRATION_FOLDS == 0
+
+
+def generated_examples(fold: Optional[bool] = None) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    (utterance, action, device) from the device registry and the templates above.
+    fold=True keeps only the held-out phrasings, fold=False only the others.
+    """
+    examples = []
+
+    def add(templates, action, device=None, **names):
+        examples.extend((t.format(**names).replace("the here", "here"), action, device)
+                        for t in templates if fold is None or held_out(t) == fold)
+
+    for label in DEVICE_LABELS:
+        for name in device_names(label):
+            add(ON_TEMPLATES, "turn_on", label, d=name)
+            add(OFF_TEMPLATES, "turn_off", label, d=name)
+            if label != "all":
+                add(QUESTION_TEMPLATES + STATEMENT_TEMPLATES, NONE, d=name)
+    # Numbered relays, as the fast path knows them
+    for spec in DEVICES:
+        add(ON_TEMPLATES[:6], "turn_on", spec.name, d=f"relay {spec.number}")
+        add(OFF_TEMPLATES[:6], "turn_off", spec.name, d=f"relay {spec.number}")
+    for room in ROOMS:
+        add(ROOM_STATEMENTS, NONE, r=room)
+    add(NOT_COMMANDS, NONE)
+    return examples
+
+
+def logged_examples(engine) -> List[Tuple[str, str, Optional[str]]]:
+    """Slow-path commands the LLM answered, from the semantic cache's IntentCache table."""
+    from sqlalchemy import inspect
+    from sqlmodel import Session, select
+
+    from models import IntentCache
+
+    if not inspect(engine).has_table(IntentCache.__tablename__):
+        return []
+    examples = []
+    with Session(engine) as session:
+        for key, intent in session.exec(select(IntentCache.key, IntentCache.intent)):
+            example = labeled(key, json.loads(intent))
+            if example is not None:
+                examples.append(example)
+    return examples
+
+
+def labeled(text: str, intent: Dict) -> Optional[Tuple[str, str, Optional[str]]]:
+    """A training example from an LLM-style intent, or None when it names no known device."""
+    action = intent.get("action")
+    device = canonical_name(str(intent.get("device_type") or "").strip().lower())
+    if action not in ("turn_on", "turn_off"):
+        return text, NONE, None
+    if device in ALL_WORDS:
+        device = "all"
+    if device not in DEVICE_LABELS:
+        return None
+    return text, action, device
+
+
+# --- Model ---
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def qualified(text: str) -> bool:
+    """
+    True for utterances with a negation ("don't turn on the fan"), an
+    exclusion ("lights off except the kitchen") or a time ("fan off in 10
+    minutes"): acting on the device words alone would do the wrong thing.
+    """
+    return not _QUALIFIER_WORDS.isdisjoint(tokenize(text))
+
+
+def features(text: str) -> List[str]:
+    """Words, word pairs and character trigrams (the trigrams absorb plurals and typos)."""
+    tokens = tokenize(text)
+    found = ["bias"]
+    found.extend("w:" + t for t in tokens)
+    found.extend(f"b:{a}_{b}" for a, b in zip(tokens, tokens[1:]))
+    for token in tokens:
+        padded = f"<{token}>"
+        found.extend("c:" + padded[i:i + 3] for i in range(len(padded) - 2))
+    return found
+
+
+def softmax(scores: List[float], temperature: float = 1.0) -> List[float]:
+    top = max(scores)
+    exps = [math.exp((s - top) / temperature) for s in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+
+class LinearModel:
+    """Multinomial logistic regression over sparse string features: feature -> one weight per label."""
+
+    def __init__(self, labels: Sequence[str], weights: Dict[str, List[float]] = None, temperature: float = 1.0):
+        self.labels = tuple(labels)
+        self.weights = weights or {}
+        # Fitted on held-out phrasings (calibrate), so the probabilities mean what they say
+        self.temperature = temperature
+
+    def scores(self, found: Iterable[str]) -> List[float]:
+        scores = [0.0] * len(self.labels)
+        for feature in found:
+            row = self.weights.get(feature)
+            if row is not None:
+                for i, weight in enumerate(row):
+                    scores[i] += weight
+        return scores
+
+    def predict(self, found: Iterable[str]) -> Tuple[str, float]:
+        probabilities = softmax(self.scores(found), self.temperature)
+        best = max(range(len(probabilities)), key=probabilities.__getitem__)
+        return self.labels[best], probabilities[best]
+
+    def calibrate(self, examples: List[Tuple[List[str], int]]) -> float:
+        """Sets the temperature with the lowest log loss on examples the model wasn't fitted on."""
+        scored = [(self.scores(found), target) for found, target in examples]
+        if not scored:
+            return self.temperature
+
+        def loss(temperature: float) -> float:
+            return -sum(math.log(max(softmax(scores, temperature)[target], 1e-12)) for scores, target in scored)
+
+        self.temperature = min(TEMPERATURES, key=loss)
+        return self.temperature
+
+    def fit(self, examples: List[Tuple[List[str], int]], epochs: int = EPOCHS, rate: float = LEARNING_RATE,
+            seed: int = 1):
+        """Plain SGD on the log loss, with a decaying learning rate. Deterministic for a given seed."""
+        rng = random.Random(seed)
+        n = len(self.labels)
+        examples = list(examples)
+        for epoch in range(epochs):
+            rng.shuffle(examples)
+            step = rate / (1 + epoch)
+            for found, target in examples:
+                gradient = softmax(self.scores(found))
+                gradient[target] -= 1.0
+                for feature in found:
+                    row = self.weights.get(feature)
+                    if row is None:
+                        row = self.weights[feature] = [0.0] * n
+                    for i in range(n):
+                        row[i] -= step * gradient[i]
+
+    def to_dict(self) -> Dict:
+        weights = {f: [round(w, 3) for w in row] for f, row in self.weights.items()
+                   if max(abs(w) for w in row) >= PRUNE_BELOW}
+        return {"labels": list(self.labels), "temperature": self.temperature, "weights": weights}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LinearModel":
+        return cls(data["labels"], data["weights"], data.get("temperature", 1.0))
+
+
+class IntentClassifier:
+    """
+    Local intent tier between the fast-path regex and the LLM: two small
+    linear models over n-gram features, one for the action (turn_on /
+    turn_off / none) and one for the device. Answers only when
+    P(action) x P(device) reaches the threshold, every word was seen in
+    training, the device is actually named and nothing qualifies the
+    command (negation, exclusion, time); anything else goes to Ollama.
+    Trained offline (`python intent_classifier.py`) from the registry's
+    phrasings plus the commands the LLM already answered, with the
+    confidences calibrated on held-out phrasings.
+    The model file is loaded on first use.
+    """
+
+    def __init__(self, path: Optional[str] = MODEL_PATH, threshold: float = CONFIDENCE_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.actions: Optional[LinearModel] = None
+        self.devices: Optional[LinearModel] = None
+        # Words seen in training; an utterance with any other word is left to the LLM
+        self.vocabulary: FrozenSet[str] = frozenset()
+        self._loaded = path is None
+        self._lock = threading.Lock()
+
+        # Stats
+        self.answered = 0
+        self.deferred = 0
+        self.refused = 0  # Deferred before scoring: qualified, unknown words or no device named
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning("Intent classifier disabled, no model at %s: %s", self.path, e)
+                return
+            self.actions = LinearModel.from_dict(data["actions"])
+            self.devices = LinearModel.from_dict(data["devices"])
+            self.vocabulary = frozenset(data["vocabulary"])
+
+    @property
+    def ready(self) -> bool:
+        if not self._loaded:
+            self.load()
+        return self.actions is not None
+
+    def predict(self, text: str) -> Tuple[str, Optional[str], float]:
+        """(action, device, confidence) whatever the confidence; device is None for "none". Needs a model (ready)."""
+        if not self._loaded:
+            self.load()
+        found = features(text)
+        action, p_action = self.actions.predict(found)
+        if action == NONE:
+            return NONE, None, p_action
+        device, p_device = self.devices.predict(found)
+        return action, device, p_action * p_device
+
+    def classify(self, text: str) -> Optional[Tuple[str, str, float]]:
+        """(action, device, confidence) when confident enough for a device command, else None."""
+        if not self.ready:
+            return None
+        tokens = tokenize(text)
+        if qualified(text) or not self.vocabulary.issuperset(tokens):
+            self.deferred += 1
+            self.refused += 1
+            return None
+        action, device, confidence = self.predict(text)
+        if action == NONE or confidence < self.threshold:
+            self.deferred += 1
+            return None
+        if not names_device(tokens, device):
+            # "turn the heater on" scores as the home theater on shared trigrams alone
+            self.deferred += 1
+            self.refused += 1
+            return None
+        self.answered += 1
+        return action, device, confidence
+
+    @classmethod
+    def train(cls, examples: Sequence[Tuple[str, str, Optional[str]]],
+              calibration: Tuple[Sequence, Sequence] = None, **kwargs) -> "IntentClassifier":
+        """
+        examples: (utterance, action, device); device is ignored for action "none".
+        calibration: (fit, held out) examples; a first model is fitted on the
+        first and its temperatures set on the second, then reused for the model
+        fitted on all examples.
+        """
+        classifier = cls(None, **kwargs)
+        classifier.actions = LinearModel(ACTION_LABELS)
+        classifier.devices = LinearModel(DEVICE_LABELS)
+        actions, devices = _featurized(examples)
+        classifier.actions.fit(actions)
+        classifier.devices.fit(devices)
+        classifier.vocabulary = frozenset(word for text, _, _ in examples for word in tokenize(text))
+        if calibration is not None:
+            fit, held = calibration
+            probe = cls.train(fit)
+            held_actions, held_devices = _featurized(held)
+            classifier.actions.temperature = probe.actions.calibrate(held_actions)
+            classifier.devices.temperature = probe.devices.calibrate(held_devices)
+        return classifier
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"trained_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                       "actions": self.actions.to_dict(), "devices": self.devices.to_dict(),
+                       "vocabulary": sorted(self.vocabulary)},
+                      f, separators=(",", ":"))
+
+    def stats(self) -> Dict:
+        return {"answered": self.answered, "deferred": self.deferred, "refused": self.refused,
+                "threshold": self.threshold,
+                "loaded": self.actions is not None}
+
+
+def _featurized(examples) -> Tuple[List[Tuple[List[str], int]], List[Tuple[List[str], int]]]:
+    """Training rows for the action model and for the device model."""
+    actions, devices = [], []
+    for text, action, device in examples:
+        found = features(text)
+        actions.append((found, ACTION_LABELS.index(action)))
+        if action != NONE:
+            devices.append((found, DEVICE_LABELS.index(device)))
+    return actions, devices
+
+
+def names_device(tokens: Sequence[str], label: str) -> bool:
+    """Whether the utterance names the device (any of its names, or its relay number) as whole words."""
+    text = f" {' '.join(tokens)} "
+    names = device_names(label)
+    spec = next((d for d in DEVICES if d.name == label), None)
+    if spec is not None:
+        names += (f"relay {spec.number}", f"number {spec.number}")
+    return any(f" {' '.join(tokenize(name))} " in text for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the local intent classifier")
+    parser.add_argument("--db", default=None, help="SQLite file with logged LLM commands (default: the app database)")
+    parser.add_argument("--commands", default=None,
+                        help='Extra JSON lines of {"text": ..., "action": ..., "device_type": ...}')
+    parser.add_argument("--out", default=MODEL_PATH)
+    args = parser.parse_args()
+
+    from sqlmodel import create_engine
+
+    if args.db is None:
+        from database import sqlite_file_name
+        args.db = sqlite_file_name
+    logged = logged_examples(create_engine(f"sqlite:///{args.db}"))
+    if args.commands:
+        with open(args.commands) as f:
+            lines = (json.loads(line) for line in f if line.strip())
+            logged.extend(e for e in (labeled(c["text"], c) for c in lines) if e is not None)
+    generated = generated_examples()
+    logged_fit = [e for e in logged if not held_out(e[0])]
+    logged_held = [e for e in logged if held_out(e[0])]
+    calibration = (generated_examples(fold=False) + logged_fit * LOGGED_WEIGHT,
+                   generated_examples(fold=True) + logged_held)
+
+    started = time.perf_counter()
+    classifier = IntentClassifier.train(generated + logged * LOGGED_WEIGHT, calibration)
+    elapsed = time.perf_counter() - started
+    classifier.save(args.out)
+    correct = sum(classifier.predict(text)[:2] == (action, device) for text, action, device in generated + logged)
+    print(f"Trained on {len(generated)} generated + {len(logged)} logged examples in {elapsed:.1f} s; "
+          f"training accuracy {correct / (len(generated) + len(logged)):.1%}; temperatures: "
+          f"action {classifier.actions.temperature:.2f}, device {classifier.devices.temperature:.2f}; "
+          f"{os.path.getsize(args.out) / 1024:.0f} kB written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import json
+from typing import Dict, Optional
+
+
+class JSONObjectExtractor:
+    """
+    Finds the first complete top-level JSON object in a stream of text chunks,
+    e.g. LLM tokens arriving one by one. Text outside the object (markdown
+    fences, chatter) is skipped, and braces inside strings are ignored, so the
+    object is returned the moment its closing brace arrives.
+    """
+
+    def __init__(self):
+        self.result: Optional[Dict] = None
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> Optional[Dict]:
+        """Consumes a chunk; returns the object once it is complete, else None."""
+        if self.result is not None:
+            return self.result
+
+        for ch in chunk:
+            if self._depth == 0 and ch != "{":
+                continue
+            self._buffer.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    text = "".join(self._buffer)
+                    self._buffer = []
+                    try:
+                        obj = json.loads(text)
+                    except ValueError:
+                        # Not valid JSON after all; keep scanning for the next object
+                        continue
+                    if isinstance(obj, dict):
+                        self.result = obj
+                        return obj
+        return None
@@ -0,0 +1,77 @@
+import bisect
+from typing import Dict, Iterable, List
+
+# Histogram bucket upper bounds in milliseconds (the last bucket is +Inf)
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram. observe() is O(log buckets) and allocation-free."""
+
+    def __init__(self, buckets_ms: Iterable[float] = BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+
+    def observe(self, seconds: float):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.buckets_ms, ms)] += 1
+        self.count += 1
+        self.sum_ms += ms
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile (0 < q <= 1), in ms."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets_ms[i] if i < len(self.buckets_ms) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> Dict:
+        cumulative: List[int] = []
+        total = 0
+        for n in self.counts:
+            total += n
+            cumulative.append(total)
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum_ms / self.count, 2) if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p90_ms": self.percentile(0.9),
+            "p99_ms": self.percentile(0.99),
+            # Cumulative counts per upper bound, Prometheus style
+            "buckets": {**{str(b): c for b, c in zip(self.buckets_ms, cumulative)}, "+Inf": cumulative[-1]},
+        }
+
+
+class LatencyRecorder:
+    """A named set of histograms, one per pipeline stage."""
+
+    def __init__(self, stages: Iterable[str]):
+        self.histograms: Dict[str, LatencyHistogram] = {stage: LatencyHistogram() for stage in stages}
+
+    def stage(self, stage: str) -> LatencyHistogram:
+        """The histogram for stage; hot paths keep it instead of looking it up per observe()."""
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = LatencyHistogram()
+        return histogram
+
+    def observe(self, stage: str, seconds: float):
+        self.stage(stage).observe(seconds)
+
+    def snapshot(self) -> Dict:
+        return {stage: h.snapshot() for stage, h in self.histograms.items()}
+
+
+# Where a command's time goes, from the voice/UI request to the relay:
+#   intent:     request received -> intent resolved (fast path, cache or LLM)
+#   dispatch:   intent -> state, dashboards, poll queue and WebSocket sends done
+#   ack:        first send to a board -> the board's ack (network + relay)
+#   end_to_end: request received -> ack (commands to ack-capable boards only)
+command_latency = LatencyRecorder(("intent", "dispatch", "ack", "end_to_end"))
@@ -0,0 +1,152 @@
+import asyncio
+import itertools
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+# Inferences allowed to run at once (Ollama on a small box handles ~1-2 well)
+MAX_CONCURRENT_INFERENCES = 2
+# Requests allowed to wait for a slot; beyond this callers get SchedulerBusy
+MAX_QUEUED_INFERENCES = 16
+# Seconds a caller waits for its result before giving up
+INFERENCE_TIMEOUT = 30.0
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0  # Voice / dashboard commands
+PRIORITY_BACKGROUND = 10  # Automations and other non-interactive work
+
+
+class SchedulerBusy(Exception):
+    """Raised when the inference queue is full."""
+
+
+class _Job:
+    def __init__(self, key: Optional[Hashable], fn: Callable, args: tuple):
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Avoid "exception never retrieved" warnings when every caller gave up
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.waiters = 0
+        self.started = False
+
+
+class InferenceScheduler:
+    """
+    Runs blocking LLM calls in the threadpool with a fixed concurrency limit.
+    - Jobs wait in a priority queue; interactive work goes before background work.
+    - Identical in-flight requests (same key) share one inference.
+    - A full queue fails fast with SchedulerBusy instead of piling up threads.
+    - Callers time out individually; a queued job nobody waits for anymore
+      is skipped instead of run.
+    """
+
+    def __init__(self, concurrency: int = MAX_CONCURRENT_INFERENCES,
+                 max_queue: int = MAX_QUEUED_INFERENCES, timeout: float = INFERENCE_TIMEOUT):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers = []
+        self._inflight: Dict[Hashable, _Job] = {}
+        self._seq = itertools.count()
+        # Jobs waiting for a slot that someone still waits for. Abandoned ones stay
+        # in the PriorityQueue until a worker skips them, so qsize() overcounts.
+        self.queued = 0
+
+        # Stats
+        self.completed = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.running = 0
+
+    def _ensure_started(self):
+        if self._workers:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def submit(self, key: Optional[Hashable], fn: Callable, *args: Any,
+                     priority: int = PRIORITY_INTERACTIVE, timeout: Optional[float] = None):
+        """
+        Runs fn(*args) in the threadpool once a slot is free and returns its result.
+        Callers passing the same non-None key while a job is pending share it.
+        Raises SchedulerBusy when the queue is full and asyncio.TimeoutError on timeout.
+        """
+        self._ensure_started()
+
+        job = self._inflight.get(key) if key is not None else None
+        if job is not None:
+            self.coalesced += 1
+        else:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise SchedulerBusy("Inference queue is full")
+            job = _Job(key, fn, args)
+            if key is not None:
+                self._inflight[key] = job
+            self._queue.put_nowait((priority, next(self._seq), job))
+            self.queued += 1
+
+        job.waiters += 1
+        try:
+            # shield: one caller timing out must not cancel the shared inference
+            return await asyncio.wait_for(asyncio.shield(job.future),
+                                          self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            job.waiters -= 1
+            if job.waiters == 0 and not job.started:
+                # Nobody is waiting anymore; don't spend an inference on it
+                job.future.cancel()
+                self.queued -= 1
+                self._forget(job)
+
+    def _forget(self, job: _Job):
+        if job.key is not None and self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            if job.future.done():
+                self.skipped += 1
+                continue
+            job.started = True
+            self.queued -= 1
+            self.running += 1
+            try:
+                result = await run_in_threadpool(job.fn, *job.args)
+                job.future.set_result(result)
+            except Exception as e:
+                job.future.set_exception(e)
+            finally:
+                self.running -= 1
+                self.completed += 1
+                self._forget(job)
+
+    async def shutdown(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "skipped": self.skipped,
+        }
+
+
+llm_scheduler = InferenceScheduler()
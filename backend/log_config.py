@@ -0,0 +1,59 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# DEBUG shows every command, poll and socket message; INFO only connects, disconnects and failures
+LOG_LEVEL = os.getenv("SMART_HOME_LOG_LEVEL", "INFO").upper()
+# "text" for humans, "json" (one object per line) for log shippers
+LOG_FORMAT = os.getenv("SMART_HOME_LOG_FORMAT", "text")
+
+_listener: logging.handlers.QueueListener = None
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """
+    Sets up the "smart_home" loggers. Records are handed to a queue and written
+    to stderr by a listener thread, so the event loop never blocks on terminal IO.
+    Calling it again only changes the level.
+    """
+    global _listener
+    root = logging.getLogger("smart_home")
+    root.setLevel(level)
+    if _listener is not None:
+        return
+
+    handler = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(name)s: %(message)s"))
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.propagate = False
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+
+
+def stop_logging():
+    """Writes out queued records; call on shutdown."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,21 +1,82 @@
-from datetime import datetime
+import asyncio
+import gc
+import json
+import logging
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
 from threading import Thread
-from typing import List, Dict
+from typing import List, Dict, Optional
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Body
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Body, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlmodel import Session, select
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select
 
 from models import Device, DeviceLog, User
-from database import create_db_and_tables, get_session, engine
+from database import create_db_and_tables, engine, run_db
 from connection_manager import manager
-from ai_service import ai_service
+from ai_service import WARMUP, WARMUP_TIMEOUT, ai_service
+from command_queue import command_queue, DEFAULT_DEVICE_ID, MAX_LONG_POLL
+from device_registry import canonical_name
+from dispatcher import ack_tracker, dispatcher
+from latency import command_latency
+from llm_scheduler import llm_scheduler, PRIORITY_BACKGROUND, SchedulerBusy
+from log_config import configure_logging, stop_logging
+from metrics import CONTENT_TYPE, device_messages_total, polls_total, registry
+from profiler import profiler
+from semantic_cache import normalize_key
+from session_context import DEFAULT_SESSION
+from state_store import StateWriter
+from device_cache import device_cache
+from device_liveness import DeviceLiveness
+from broker import broker
+from cluster import ClusterSync
+from automations import AutomationEngine
+from analytics import UsageAnalytics
+
+configure_logging()
+logger = logging.getLogger("smart_home.api")
 
 app = FastAPI()
 
-# Global variable to store the latest command for ESP32 polling
-# Format: "action:device" or "idle"
-pending_esp32_command = "idle"
+# Write-behind log of device state changes (DeviceLog + Device.status)
+state_writer = StateWriter(engine)
+# Hourly/daily on-time rollups of the state log, and its retention
+analytics = UsageAnalytics(engine)
+# Heartbeats, idle eviction and batched last_seen for ESP32 sockets
+device_liveness = DeviceLiveness(manager, engine)
+# Scenes and time-of-day schedules
+automations = AutomationEngine(dispatcher)
+# Shared state across uvicorn workers (SMART_HOME_STATE_BACKEND=sqlite); inert with one worker
+cluster = ClusterSync(broker, manager, dispatcher, ack_tracker, ai_service.sessions, device_cache, command_queue,
+                      automations)
+# Startup warm-up jobs still running, referenced until they finish
+warmup_tasks = set()
+# Streamed dashboard voice commands in flight; the loop only keeps weak references to tasks
+voice_tasks = set()
+
+# Gauges are read when /metrics is scraped, so they cost nothing in between
+registry.gauge("smart_home_websocket_clients", "Connected dashboard sockets", lambda: len(manager.client_channels))
+registry.gauge("smart_home_websocket_devices", "Connected ESP32 sockets", lambda: len(manager.active_devices))
+registry.gauge("smart_home_websocket_ack_devices", "Connected ESP32 sockets using acks", lambda: len(manager.ack_boards))
+registry.gauge("smart_home_poll_queue_pending", "Commands waiting for HTTP-polling boards",
+               command_queue.pending, "device_id")
+registry.gauge("smart_home_llm_scheduler", "LLM inference scheduler counters", llm_scheduler.stats, "stat")
+registry.gauge("smart_home_state_writer", "Write-behind state log counters", lambda: state_writer.stats(), "stat")
+registry.gauge("smart_home_command_acks", "Ack pipeline counters", ack_tracker.stats, "stat")
+registry.gauge("smart_home_heartbeat", "ESP32 heartbeat counters", device_liveness.stats, "stat")
+registry.gauge("smart_home_semantic_cache", "LLM result cache counters",
+               lambda: ai_service.cache.stats() if ai_service.cache is not None else {}, "stat")
+registry.gauge("smart_home_intent_classifier", "Local intent classifier counters",
+               lambda: ai_service.classifier.stats() if ai_service.classifier is not None else {}, "stat")
+registry.gauge("smart_home_cluster", "Worker message bus counters", cluster.stats, "stat")
+registry.gauge("smart_home_analytics", "Usage rollup and retention counters", analytics.stats, "stat")
+registry.gauge("smart_home_automations", "Scene and schedule counters", automations.stats, "stat")
+registry.recorder("smart_home_command_latency_seconds", "Command pipeline latency by stage", command_latency)
 
 # CORS for development
 app.add_middleware(
@@ -27,162 +88,332 @@ app.add_middleware(
 )
 
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     create_db_and_tables()
+    # Rebuild relay states from the event log, then persist every change
+    manager.device_states.update(state_writer.restore_states())
+    # With several workers the broker has the latest states, including unflushed ones
+    manager.device_states.update(broker.load_states())
+    manager.add_state_listener(state_writer.record)
+    # Rollups are brought up to date before the writer adds to the log, then kept in its transactions
+    await analytics.start()
+    state_writer.batch_hooks.append(analytics.apply_batch)
+    # Device.status is written by the state writer; refresh the list once it lands
+    state_writer.flush_listeners.append(device_cache.invalidate_types)
+    await state_writer.start()
+    device_liveness.flush_listeners.append(device_cache.invalidate)
+    await device_liveness.start()
+    await ack_tracker.start()
+    await cluster.start()
+    await automations.start()
+    # Warm the LLM result cache from SQLite so lookups never hit disk
+    if ai_service.cache is not None:
+        ai_service.cache.load()
+    # Optional (SMART_HOME_WARMUP): the fast path inline, the model in the background
+    if WARMUP in ("fast", "llm"):
+        ai_service.warm_up()
+    if WARMUP == "llm":
+        task = asyncio.create_task(llm_scheduler.submit(None, ai_service.load_model, priority=PRIORITY_BACKGROUND,
+                                                        timeout=WARMUP_TIMEOUT))
+        warmup_tasks.add(task)
+        task.add_done_callback(warmup_done)
+    # Modules, routes and metadata never become garbage: keep them out of full
+    # collections, which otherwise scan them all and stall every thread ~50 ms
+    gc.collect()
+    gc.freeze()
+
+def warmup_done(task: asyncio.Task):
+    warmup_tasks.discard(task)
+    # Busy or timed out: the first slow-path command loads the model instead
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("LLM warm-up did not finish: %r", task.exception())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    for task in list(warmup_tasks):
+        task.cancel()
+    await llm_scheduler.shutdown()
+    await automations.stop()
+    await cluster.stop()
+    await ack_tracker.stop()
+    await device_liveness.stop()
+    await state_writer.stop()
+    await analytics.stop()
+    profiler.stop()
+    stop_logging()
 
 
 # API Endpoints
+# Database work runs through run_db: on the async engine when enabled
+# (SMART_HOME_DB_ASYNC=1), so these endpoints don't hold threadpool slots
 @app.get("/devices/", response_model=List[Device])
-def get_devices(session: Session = Depends(get_session)):
-    devices = session.exec(select(Device)).all()
-    return devices
+async def get_devices(request: Request, since: Optional[int] = None):
+    """
+    Device list, served from an in-process cache.
+    Sends an ETag; a matching If-None-Match gets 304 without touching the DB.
+    ?since=<version> returns {"version", "full", "devices"} with only the
+    devices changed after that version (the full list if it's too old).
+    """
+    headers = {"ETag": device_cache.etag}
+    if since is not None:
+        return JSONResponse(await device_cache.changes_since(since), headers=headers)
+    if request.headers.get("if-none-match") == device_cache.etag:
+        return Response(status_code=304, headers=headers)
+    body = await device_cache.body()
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.post("/devices/")
-def register_device(device: Device, session: Session = Depends(get_session)):
-    # Check if device exists
-    existing_device = session.get(Device, device.id)
-    if existing_device:
-        return existing_device
-    
-    session.add(device)
-    session.commit()
-    session.refresh(device)
-    return device
+async def register_device(device: Device):
+    def register(session):
+        # Check if device exists
+        existing_device = session.get(Device, device.id)
+        if existing_device:
+            return existing_device
+        
+        session.add(device)
+        session.commit()
+        session.refresh(device)
+        return device
+
+    result = await run_db(register)
+    if result is device:
+        device_cache.invalidate([device.id])
+    return result
+
+# Columns a bulk registration sets on an existing device; status and last_seen stay as they are
+BULK_UPDATE_COLUMNS = ("name", "type", "pin", "ip_address")
+# Columns a device can't be stored without, and their types
+BULK_REQUIRED_COLUMNS = {"name": str, "type": str, "pin": int}
+
+def bulk_device_error(device: Device) -> Optional[str]:
+    """
+    What is wrong with one row of a bulk registration, or None.
+    Table models aren't validated when the body is parsed, so a bad row
+    would otherwise fail the whole insert with a 500.
+    """
+    if not device.id or not isinstance(device.id, str):
+        return "Every device needs a string id"
+    for column, kind in BULK_REQUIRED_COLUMNS.items():
+        value = getattr(device, column)
+        if value is None:
+            return f"Device {device.id!r} has no {column}"
+        if not isinstance(value, kind) or isinstance(value, bool):
+            return f"Device {device.id!r}: {column} must be {'an integer' if kind is int else 'a string'}"
+    if device.ip_address is not None and not isinstance(device.ip_address, str):
+        return f"Device {device.id!r}: ip_address must be a string"
+    return None
+
+@app.post("/devices/bulk")
+async def register_devices(devices: List[Device]):
+    """
+    Registers or updates many devices (a building of boards) in one transaction.
+    Unlike POST /devices/, an existing id gets the new name, type, pin and address.
+    """
+    rows = {}
+    for device in devices:
+        error = bulk_device_error(device)
+        if error:
+            raise HTTPException(status_code=400, detail=error)
+        # The same id twice: the last one wins, as it would with one request each
+        rows[device.id] = {**device.model_dump(include={"id", *BULK_UPDATE_COLUMNS}),
+                           "status": False, "last_seen": None}
+    if not rows:
+        return {"received": 0, "inserted": 0, "updated": 0}
+
+    statement = sqlite_insert(Device)
+    statement = statement.on_conflict_do_update(
+        index_elements=[Device.id], set_={column: statement.excluded[column] for column in BULK_UPDATE_COLUMNS})
+
+    def upsert(session):
+        count = select(func.count()).select_from(Device)
+        before = session.execute(count).scalar()
+        session.execute(statement, list(rows.values()))
+        after = session.execute(count).scalar()
+        session.commit()
+        return after - before
+
+    inserted = await run_db(upsert)
+    device_cache.invalidate(list(rows))
+    return {"received": len(rows), "inserted": inserted, "updated": len(rows) - inserted}
+
+@app.get("/devices/online")
+def get_devices_online():
+    """Which ESP32 sockets are connected, with last_seen and address. Memory only, no DB query."""
+    return {**device_liveness.status(), "heartbeat": device_liveness.stats()}
+
+async def resolve_intent(text: str, session_id: str = DEFAULT_SESSION, on_token=None) -> dict:
+    """
+    Turns command text into an intent.
+    Fast path (regex, follow-ups, semantic cache) is cheap: run it inline.
+    Raises SchedulerBusy / asyncio.TimeoutError from the slow path.
+    """
+    started = time.perf_counter()
+    result = ai_service.resolve_fast(text, session_id)
+    if result is None:
+        # Slow path goes through the bounded inference scheduler, which runs
+        # Ollama in the threadpool so WebSockets stay responsive. Identical
+        # utterances already in flight share one inference, keyed like the
+        # semantic cache entry they will fill; streamed requests have their
+        # own token consumer, so they are never coalesced.
+        if on_token is None:
+            result = await llm_scheduler.submit(normalize_key(text), ai_service.resolve_slow, text)
+        else:
+            result = await llm_scheduler.submit(None, ai_service.resolve_slow, text, on_token)
+    command_latency.observe("intent", time.perf_counter() - started)
+    return result
+
+async def run_streaming_command(text: str, emit, session_id: str = DEFAULT_SESSION) -> dict:
+    """
+    Resolves and dispatches a command while streaming progress.
+    emit(kind, data) is called on the event loop with "token" chunks from the
+    LLM and then the "intent". The intent is dispatched to devices the moment
+    its JSON object is complete, without waiting for the rest of the generation.
+    """
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
 
-from fastapi.concurrency import run_in_threadpool
+    def on_token(piece: str):
+        # Called from the threadpool; hop back onto the event loop
+        loop.call_soon_threadsafe(emit, "token", piece)
+
+    result = await resolve_intent(text, session_id, on_token)
+    emit("intent", result)
+    logger.debug("AI result: %s", result)
+    await dispatcher.dispatch_intent(result, started)
+    return result
+
+def sse_event(kind: str, data) -> str:
+    return f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_command_events(text: str, session_id: str):
+    """Server-sent events for /command/?stream=true: token*, intent, done (or error)."""
+    events: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(run_streaming_command(
+        text, lambda kind, data: events.put_nowait((kind, data)), session_id))
+    task.add_done_callback(lambda _: events.put_nowait(("finished", None)))
+
+    while True:
+        kind, data = await events.get()
+        if kind != "finished":
+            yield sse_event(kind, data)
+            continue
+        if task.exception() is None:
+            yield sse_event("done", task.result())
+        elif isinstance(task.exception(), SchedulerBusy):
+            yield sse_event("error", {"status": 503, "detail": "Assistant is busy, please try again shortly"})
+        elif isinstance(task.exception(), asyncio.TimeoutError):
+            yield sse_event("error", {"status": 504, "detail": "Assistant took too long to respond"})
+        else:
+            yield sse_event("error", {"status": 500, "detail": "Could not process that command"})
+        break
 
 @app.post("/command/")
-async def process_voice_command(command: dict = Body(...)):
+async def process_voice_command(request: Request, command: dict = Body(...), stream: bool = False):
     """
     Receives a text command (converted from speech on client) 
     and processes it with Ollama.
     Wrapper for AI service.
+    With ?stream=true the response is a text/event-stream of LLM tokens,
+    followed by the parsed intent as soon as it is complete.
+    Follow-up answers ("yes") are matched per session: pass "session_id" in the
+    body, otherwise the caller's address is used.
     """
+    started = time.perf_counter()
     text = command.get("text")
     if not text:
         raise HTTPException(status_code=400, detail="No text provided")
+    session_id = command.get("session_id") or f"http:{request.client.host if request.client else 'unknown'}"
 
-    print(f"Processing command: {text}")
-    
-    # Run synchronous AI call in threadpool to avoid blocking the event loop
-    # This ensures WebSockets remain responsive during AI inference
-    result = await run_in_threadpool(ai_service.process_command, text)
-    
-    print(f"AI Result: {result}")
+    logger.debug("Processing command: %s", text)
+
+    if stream:
+        return StreamingResponse(stream_command_events(text, session_id), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
     
-    action = result.get("action")
-    device_type = result.get("device_type")
+    try:
+        result = await resolve_intent(text, session_id)
+    except SchedulerBusy:
+        raise HTTPException(status_code=503, detail="Assistant is busy, please try again shortly")
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Assistant took too long to respond")
     
-    if action in ["turn_on", "turn_off"]:
-        # Update state persistence
-        manager.update_state(device_type, action)
-
-        # Broadcast to all clients (including frontend) to update UI
-        if device_type == "all":
-            # Broadcast individual updates to ensure robust sync
-            all_devices = ["light", "fan", "kitchen light", "refrigerator", "tv", "hometheater"]
-            for d in all_devices:
-                 # Essential appliance protection
-                 if d == "refrigerator" and action == "turn_off":
-                     continue
-                 await manager.broadcast_status(f"ACTION:{action}:{d}")
-            # Also broadcast the 'all' simplified message for UI convenience
-            await manager.broadcast_status(f"ACTION:{action}:all")
-        else:
-            await manager.broadcast_status(f"ACTION:{action}:{device_type}")
-        
-        # Update the ESP32 polling queue
-        global pending_esp32_command
-        
-        # Map "kitchen light" to "kitchen" for ESP32
-        esp32_device = "kitchen" if device_type == "kitchen light" else device_type
-        device_command = f"{action}:{esp32_device}"
-        pending_esp32_command = device_command
-        
-        # In a real scenario, we would parse 'location' and find the specific device ID
-        # For this demo, we broadcast to the specific device type if connected
-        # Or just broadcast to all ESP32s
-        for device_id, ws in manager.active_devices.items():
-            await ws.send_text(device_command)
-
+    logger.debug("AI result: %s", result)
+    await dispatcher.dispatch_intent(result, started)
     return result
 
 # WebSockets
 @app.post("/voice")
-async def process_simple_voice_command(data: dict = Body(...)):
+async def process_simple_voice_command(request: Request, data: dict = Body(...), stream: bool = False):
     """
     Alias for /command/ but matches the user's simple 'voice' endpoint structure.
     Expects {"text": "some command"}
     """
-    return await process_voice_command(data)
+    return await process_voice_command(request, data, stream)
+
+@app.post("/commands/bulk")
+async def process_bulk_command(command: dict = Body(...)):
+    """
+    Many devices in one call, applied as one state batch and one dashboard broadcast.
+    Body: {"commands": [{"device_type": "tv", "action": "turn_on"}, ...]}
+      and/or {"select": "all" | "on" | "off", "action": "turn_off"}
+    ("on" / "off" pick the devices currently in that state). Commands override the selector.
+    """
+    started = time.perf_counter()
+    try:
+        states = dispatcher.bulk_states(command.get("commands") or (), command.get("select"),
+                                        command.get("action"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    changed = await dispatcher.dispatch_states(states, started) if states else []
+    return {"states": states, "changed": changed}
+
+async def stream_voice_over_websocket(websocket: WebSocket, text: str, session_id: str):
+    """
+    Handles "VOICE:<text>" from a dashboard: streams "PARTIAL:<chunk>" frames
+    and a final "RESULT:<json>" back to that client only.
+    """
+    def emit(kind, data):
+        if kind == "token":
+            manager.send_to_client(websocket, f"PARTIAL:{data}")
+
+    try:
+        result = await run_streaming_command(text, emit, session_id)
+    except SchedulerBusy:
+        result = {"action": "error", "response_text": "Assistant is busy, please try again shortly"}
+    except asyncio.TimeoutError:
+        result = {"action": "error", "response_text": "Assistant took too long to respond"}
+    except Exception:
+        logger.exception("Voice command failed: %s", text)
+        result = {"action": "error", "response_text": "Could not process that command"}
+    manager.send_to_client(websocket, f"RESULT:{json.dumps(result)}")
 
 # WebSockets
 @app.websocket("/ws/client")
 async def websocket_endpoint_client(websocket: WebSocket):
+    # Each dashboard connection is its own conversation (unless it names one)
+    session_id = websocket.query_params.get("session_id") or f"ws:{uuid.uuid4().hex}"
     await manager.connect_client(websocket)
     try:
         while True:
             data = await websocket.receive_text()
+            started = time.perf_counter()
             # Handle manual commands from UI
-            print(f"Client says: {data}")
-            
-            # SUPPORT SIMPLE PROTOCOL: "toggle:device"
-            if data.startswith("toggle:"):
-                # Protocol: toggle:light
-                _, device_type = data.split(":")
-                
-                # Determine next state based on current state
-                current_state = manager.device_states.get(device_type, "off")
-                new_action = "turn_off" if current_state == "on" else "turn_on"
-                
-                # Convert to our standard ACTION format
-                data = f"ACTION:{new_action}:{device_type}"
+            logger.debug("Client says: %s", data)
+
+            # Natural-language command with streamed reply: "VOICE:turn on the lamp"
+            if data.startswith("VOICE:"):
+                task = asyncio.create_task(stream_voice_over_websocket(websocket, data[len("VOICE:"):], session_id))
+                voice_tasks.add(task)
+                task.add_done_callback(voice_tasks.discard)
+                continue
             
-            # Parse command: "ACTION:turn_on:light"
-            parts = data.split(":")
-            if len(parts) >= 3 and parts[0] == "ACTION":
-                action = parts[1]
-                device_type = parts[2]
-                
-                # Update state tracking
-                manager.update_state(device_type, action)
-
-                # 1. Broadcast to other frontends (but not the sender ideally, though here we simplisticly broadcast to all)
-                await manager.broadcast_status(data)
-                
-                # 2. Send to ESP32s
-                global pending_esp32_command
-                
-                if device_type == "all":
-                    # For "all", we'll just send the first device command
-                    # ESP32 will need to handle "all" or we send individual commands
-                    # For simplicity, let's send "turn_on:all" or "turn_off:all"
-                    pending_esp32_command = f"{action}:all"
-                    
-                    # Expand 'all' into individual commands for WebSocket-connected ESP32s
-                    all_targets = ["light", "fan", "kitchen light", "refrigerator", "tv", "hometheater"]
-                    for target in all_targets:
-                        # Essential appliance protection
-                        if target == "refrigerator" and action == "turn_off":
-                            continue
-                        
-                        device_command = f"{action}:{target}"
-                        for device_ws in manager.active_devices.values():
-                            await device_ws.send_text(device_command)
-                else:
-                    # Single device command
-                    # Map "kitchen light" to "kitchen" for ESP32
-                    esp32_device = "kitchen" if device_type == "kitchen light" else device_type
-                    device_command = f"{action}:{esp32_device}"
-                    
-                    # Update the polling queue for HTTP-polling ESP32s
-                    pending_esp32_command = device_command
-                    
-                    # Send via WebSocket to connected ESP32s
-                    for device_ws in manager.active_devices.values():
-                        await device_ws.send_text(device_command)
+            # "ACTION:turn_on:light" / "toggle:light": same pipeline as HTTP commands
+            plan = dispatcher.parse_client_message(data)
+            if plan is not None:
+                await dispatcher.dispatch(plan, started)
     except WebSocketDisconnect:
         manager.disconnect_client(websocket)
+        ai_service.sessions.clear(session_id)
 
 @app.websocket("/ws") # Legacy/Simple endpoint alias
 async def websocket_endpoint_simple(websocket: WebSocket):
@@ -191,22 +422,82 @@ async def websocket_endpoint_simple(websocket: WebSocket):
     """
     await websocket_endpoint_client(websocket)
 
+async def load_board_devices(device_id: str) -> List[str]:
+    """Device types registered for a board: Device rows with id "<board>" or "<board>:<relay>"."""
+    def load(session):
+        return session.execute(select(Device.type).where(
+            (Device.id == device_id) | Device.id.startswith(f"{device_id}:"))).scalars().all()
+    return await run_db(load)
+
 @app.websocket("/ws/device/{device_id}")
-async def websocket_endpoint_device(websocket: WebSocket, device_id: str, session: Session = Depends(get_session)):
-    await manager.connect_device(device_id, websocket)
+async def websocket_endpoint_device(websocket: WebSocket, device_id: str):
+    # Commands are routed to the boards that drive the target device.
+    # A board declares its devices with ?devices=light,fan, through its
+    # Device rows, or later with a "hello:light,fan" message; a board that
+    # declares nothing receives every command, as before.
+    # With ?ack=1 the board gets "turn_on:light#<seq>" and answers "ack:<seq>";
+    # its devices only change state once acknowledged.
+    declared = websocket.query_params.get("devices")
+    devices = declared.split(",") if declared else await load_board_devices(device_id)
+    acks = websocket.query_params.get("ack") == "1"
+    await manager.connect_device(device_id, websocket, devices, ack=acks)
+    device_liveness.connected(device_id, websocket.client.host if websocket.client else None)
     try:
         while True:
             data = await websocket.receive_text()
-            # Handle status updates from device (e.g. "status:on")
-            print(f"Received from {device_id}: {data}")
+            # Any message proves the board is alive; pongs need nothing else
+            if data == "pong":
+                device_liveness.pong(device_id)
+                device_messages_total.inc("pong")
+                continue
+            device_liveness.touch(device_id)
+            if data.startswith("hello:"):
+                manager.set_board_devices(device_id, data[len("hello:"):].split(","))
+                device_messages_total.inc("hello")
+            # Acks ("ack:17") and state reports ("status:light:on")
+            elif await ack_tracker.handle_report(device_id, data):
+                device_messages_total.inc(data.partition(":")[0])
+                continue
+            else:
+                device_messages_total.inc("other")
+            logger.debug("Received from %s: %s", device_id, data)
     except WebSocketDisconnect:
-        manager.disconnect_device(device_id)
+        manager.disconnect_device(device_id, websocket)
+        device_liveness.disconnected(device_id)
+
+@app.get("/commands/latency")
+def get_command_latency():
+    """Latency histograms per stage (intent, dispatch, ack, end_to_end) and ack pipeline counters."""
+    return {"stages": command_latency.snapshot(), "acks": ack_tracker.stats()}
+
+@app.get("/cluster")
+def get_cluster():
+    """This worker's id and message bus counters; "workers" counts the live workers it has heard from."""
+    return cluster.stats()
+
+@app.get("/ai/cache")
+def get_ai_cache_stats():
+    """Semantic cache hit rate and LLM time saved since startup."""
+    if ai_service.cache is None:
+        return {"enabled": False}
+    return ai_service.cache.stats()
+
+@app.get("/ai/classifier")
+def get_ai_classifier_stats():
+    """Commands the local classifier answered vs. passed on to the LLM."""
+    if ai_service.classifier is None:
+        return {"enabled": False}
+    return ai_service.classifier.stats()
+
+@app.get("/ai/scheduler")
+def get_ai_scheduler_stats():
+    """LLM inference queue depth, coalescing and rejection counts."""
+    return llm_scheduler.stats()
 
 @app.get("/connection-info")
 def get_connection_info():
     """Returns the local IP address to construct the QR code URL."""
     try:
-        import socket
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         # Doesn't actually connect, just determines the interface
         s.connect(("8.8.8.8", 80))
@@ -222,26 +513,145 @@ def get_connection_info():
     }
 
 @app.get("/device")
-def get_device_command():
+async def get_device_command(device_id: str = DEFAULT_DEVICE_ID, batch: bool = False,
+                             wait: float = Query(0, ge=0, le=MAX_LONG_POLL)):
     """
     ESP32 polling endpoint.
-    Returns the latest pending command in format: action:device
+    Returns the oldest pending command for this board in format: action:device
+    With ?batch=true, returns every pending command, one per line, in issue order.
+    With ?wait=<seconds>, holds the request open (long-poll) until a command
+    arrives or the timeout passes, so boards don't need to poll in a tight loop.
+    wait must be between 0 and MAX_LONG_POLL (422 otherwise, including nan).
     Returns "idle" when no command is pending.
     """
-    global pending_esp32_command
-    
-    # Get the current command
-    command = pending_esp32_command
-    
-    # Clear it after reading (one-time delivery)
-    pending_esp32_command = "idle"
+    # Commands are removed once read (one-time delivery); wait=0 is a plain poll
+    commands = await command_queue.wait(device_id, timeout=wait, batch=batch)
+    command = "\n".join(commands) if commands else "idle"
+    polls_total.inc("command" if commands else "idle")
     
-    print(f"ESP32 polled /device, returning: {command}")
+    logger.debug("ESP32 %s polled /device, returning: %r", device_id, command)
     
     # Return plain text response
-    from fastapi.responses import PlainTextResponse
     return PlainTextResponse(content=command)
 
+@app.get("/analytics/usage")
+async def get_usage(start: Optional[datetime] = None, end: Optional[datetime] = None, device: Optional[str] = None,
+                    granularity: str = "total"):
+    """
+    On-time, switch-ons and estimated energy per device over [start, end)
+    (UTC, default: the last 24 hours). granularity: total | day | hour.
+    Answered from the rollups, however long the raw log is.
+    """
+    end = as_utc(end) if end else datetime.utcnow()
+    start = as_utc(start) if start else end - timedelta(days=1)
+    device_type = canonical_name(device) if device else None
+    try:
+        return await run_db(lambda session: analytics.usage(session, start, end, device_type, granularity))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def as_utc(value: datetime) -> datetime:
+    """Naive UTC, as stored; naive input is taken to be UTC already."""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+# Scenes and schedules
+@app.get("/scenes")
+def get_scenes():
+    """Scene name -> device states, e.g. {"movie": {"tv": "on", "light": "off"}}."""
+    return automations.list_scenes()
+
+@app.put("/scenes/{name}")
+async def save_scene(name: str, states: Dict[str, str] = Body(...)):
+    """Creates or replaces a scene. Body: {"tv": "on", "hometheater": "on", "light": "off"}."""
+    try:
+        return await automations.save_scene(name, states)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/scenes/{name}")
+async def delete_scene(name: str):
+    try:
+        await automations.delete_scene(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Scene not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"deleted": name}
+
+@app.post("/scenes/{name}/activate")
+async def activate_scene(name: str):
+    """Applies every state of the scene at once: one state batch, one dashboard broadcast."""
+    started = time.perf_counter()
+    try:
+        changed = await automations.activate_scene(name, started)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Scene not found")
+    return {"scene": name, "changed": changed}
+
+@app.get("/schedules")
+def get_schedules():
+    """Every schedule with its next occurrence (server local time)."""
+    return automations.list_schedules()
+
+@app.post("/schedules")
+async def create_schedule(schedule: dict = Body(...)):
+    """
+    Body: {"name", "at": "HH:MM", "days": "daily" | "weekdays" | "weekends" | "mon,wed,fri",
+    "scene"} or {..., "action": "turn_off", "device_type": "light"}.
+    """
+    try:
+        return await automations.create_schedule(schedule)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.put("/schedules/{schedule_id}")
+async def update_schedule(schedule_id: int, changes: dict = Body(...)):
+    """Changes the given fields, e.g. {"enabled": false} or {"at": "22:30"}."""
+    try:
+        return await automations.update_schedule(schedule_id, changes)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/schedules/{schedule_id}")
+async def delete_schedule(schedule_id: int):
+    try:
+        await automations.delete_schedule(schedule_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    return {"deleted": schedule_id}
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition of every counter, histogram and gauge."""
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+@app.post("/debug/profiler/start")
+async def start_profiler(interval_ms: float = 10, duration: float = 60):
+    """
+    Starts sampling the event loop's stack every interval_ms for at most
+    duration seconds. Costs nothing until started.
+    """
+    # Called on the event loop, so the loop thread is the one profiled
+    if not profiler.start(interval_ms / 1000, duration):
+        raise HTTPException(status_code=409, detail="Profiler already running")
+    return profiler.status()
+
+@app.post("/debug/profiler/stop")
+async def stop_profiler():
+    profiler.stop()
+    return profiler.status()
+
+@app.get("/debug/profiler")
+def get_profile(format: str = "top", limit: int = 20):
+    """format=top: hottest functions as JSON; format=collapsed: flamegraph input."""
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed())
+    return {**profiler.status(), "top": profiler.top(limit)}
+
 @app.get("/")
 def read_root():
     return {"message": "Smart Home API is running"}
@@ -0,0 +1,157 @@
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+from latency import LatencyHistogram, LatencyRecorder
+
+# Prometheus text exposition format
+# (starlette appends "; charset=utf-8" to text/ media types)
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Labels, values: Labels) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    """Monotonic counter. inc() is a dict update: cheap enough for every request."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Labels = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Latency histogram in seconds, stored as latency.LatencyHistogram (millisecond buckets)."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Labels = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.histograms: Dict[Labels, LatencyHistogram] = {}
+
+    def observe(self, seconds: float, *labels: str):
+        histogram = self.histograms.get(labels)
+        if histogram is None:
+            histogram = self.histograms[labels] = LatencyHistogram()
+        histogram.observe(seconds)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, histogram in self.histograms.items():
+            lines.extend(_render_histogram(self.name, self.labelnames, labels, histogram))
+        return lines
+
+
+def _render_histogram(name: str, labelnames: Labels, labels: Labels, histogram: LatencyHistogram) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets_ms + (None,), histogram.counts):
+        cumulative += count
+        le = "+Inf" if bound is None else f"{bound / 1000:g}"
+        lines.append(f"{name}_bucket{_labels(labelnames + ('le',), labels + (le,))} {cumulative}")
+    lines.append(f"{name}_sum{_labels(labelnames, labels)} {histogram.sum_ms / 1000:g}")
+    lines.append(f"{name}_count{_labels(labelnames, labels)} {histogram.count}")
+    return lines
+
+
+class Gauge:
+    """Value read at scrape time, so the hot path pays nothing. fn returns a number or {label: number}."""
+
+    def __init__(self, name: str, help_text: str, fn: Callable[[], Union[float, Dict[str, float]]],
+                 labelname: str = None):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labelname = labelname
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            for label, v in value.items():
+                if isinstance(v, (int, float)):
+                    lines.append(f"{self.name}{_labels((self.labelname,), (label,))} {v:g}")
+        elif value is not None:
+            lines.append(f"{self.name} {value:g}")
+        return lines
+
+
+class RecorderHistogram:
+    """Exposes a latency.LatencyRecorder (one histogram per stage) as one labelled family."""
+
+    def __init__(self, name: str, help_text: str, recorder: LatencyRecorder, labelname: str = "stage"):
+        self.name = name
+        self.help = help_text
+        self.recorder = recorder
+        self.labelname = labelname
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for stage, histogram in self.recorder.histograms.items():
+            lines.extend(_render_histogram(self.name, (self.labelname,), (stage,), histogram))
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._add(Counter(name, help_text, tuple(labelnames)))
+
+    def histogram(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Histogram:
+        return self._add(Histogram(name, help_text, tuple(labelnames)))
+
+    def gauge(self, name: str, help_text: str, fn, labelname: str = None) -> Gauge:
+        return self._add(Gauge(name, help_text, fn, labelname))
+
+    def recorder(self, name: str, help_text: str, recorder: LatencyRecorder, labelname: str = "stage"):
+        return self._add(RecorderHistogram(name, help_text, recorder, labelname))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Hot-path metrics, updated where the work happens
+intents_total = registry.counter(
+    "smart_home_intents_total", "Commands resolved, by path (fast, followup, cache, classifier, miss, slow, error)", ("path",))
+intent_seconds = registry.histogram(
+    "smart_home_intent_seconds", "Time to resolve a command, by path", ("path",))
+broadcast_seconds = registry.histogram(
+    "smart_home_broadcast_seconds", "Fan-out time for one broadcast (clients: enqueue, devices: sends)", ("target",))
+polls_total = registry.counter(
+    "smart_home_polls_total", "GET /device polls, by result (command or idle)", ("result",))
+db_query_seconds = registry.histogram(
+    "smart_home_db_query_seconds", "SQLite statement execution time")
+device_messages_total = registry.counter(
+    "smart_home_device_messages_total", "Messages received from ESP32 sockets, by kind", ("kind",))
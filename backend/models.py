@@ -1,5 +1,6 @@
 from datetime import datetime
 from typing import Optional, List
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
 
 class User(SQLModel, table=True):
@@ -17,7 +18,44 @@ class Device(SQLModel, table=True):
     last_seen: Optional[datetime] = None
 
 class DeviceLog(SQLModel, table=True):
+    # Per-device history in time order, without scanning the whole log
+    __table_args__ = (Index("ix_devicelog_device_type_timestamp", "device_type", "timestamp"),)
     id: Optional[int] = Field(default=None, primary_key=True)
-    device_id: str = Field(foreign_key="device.id")
+    device_type: Optional[str] = None  # "light", "fan": the relay whose state changed
+    device_id: Optional[str] = Field(default=None, foreign_key="device.id")  # Board, when known
     action: str  # "turned_on", "turned_off"
     timestamp: datetime = Field(default_factory=datetime.utcnow)
+
+class IntentCache(SQLModel, table=True):
+    key: str = Field(primary_key=True)  # Normalized utterance
+    intent: str  # JSON-encoded intent returned by the LLM
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class Scene(SQLModel, table=True):
+    name: str = Field(primary_key=True)  # e.g., "movie"
+    states: str  # JSON: {"tv": "on", "hometheater": "on", "light": "off"}
+
+class Schedule(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str  # e.g., "Lights off at night"
+    at: str  # "HH:MM", server local time
+    days: str = Field(default="daily")  # "daily", "weekdays", "weekends" or "mon,wed,fri"
+    scene: Optional[str] = Field(default=None, foreign_key="scene.name")  # Scene to apply, or:
+    action: Optional[str] = None  # "turn_on" / "turn_off"
+    device_type: Optional[str] = None  # "light", "all" ...
+    enabled: bool = Field(default=True)
+    last_fired_at: Optional[datetime] = None  # Occurrence last run; a worker claims it before firing
+
+class DeviceUsage(SQLModel, table=True):
+    # Usage queries read one period's buckets over a time range
+    __table_args__ = (Index("ix_deviceusage_period_start", "period", "start"),)
+    device_type: str = Field(primary_key=True)  # Same value as DeviceLog.device_type
+    period: str = Field(primary_key=True)  # "hour" | "day"
+    start: datetime = Field(primary_key=True)  # Bucket start, UTC
+    on_seconds: float = Field(default=0.0)  # Time spent on inside the bucket (closed intervals only)
+    switch_ons: int = Field(default=0)  # Times turned on inside the bucket
+
+class UsageCursor(SQLModel, table=True):
+    device_type: str = Field(primary_key=True)
+    state: str  # "on" | "off", as of the last rolled-up event
+    since: datetime  # When that state began, UTC
@@ -0,0 +1,252 @@
+import json
+import logging
+import math
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from difflib import SequenceMatcher
+from typing import Dict, FrozenSet, NamedTuple, Optional, Set
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import Session, delete, select
+
+from models import IntentCache
+
+# Max cached slow-path results (in memory and in SQLite)
+MAX_ENTRIES = 2000
+# Cached LLM answers expire after this long
+TTL = timedelta(days=7)
+# Minimum similarity for a fuzzy hit; None disables fuzzy lookup
+FUZZY_THRESHOLD = 0.8
+# Most entries scored per fuzzy lookup (it runs on the event loop)
+FUZZY_MAX_CANDIDATES = 64
+
+# Words that don't change the meaning of a command
+_STOP_WORDS = frozenset({
+    "a", "an", "the", "please", "could", "can", "would", "will", "you", "kindly",
+    "my", "me", "for", "now", "just", "hey", "ok", "okay",
+})
+# Words that must match exactly for a fuzzy hit ("lamp on" must never serve "lamp off")
+_POLARITY_WORDS = frozenset({"on", "off", "up", "down", "open", "close", "start", "stop"})
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_VALID_ACTIONS = ("turn_on", "turn_off")
+
+logger = logging.getLogger("smart_home.semantic_cache")
+
+
+def normalize_key(text: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace."""
+    return " ".join(_PUNCTUATION_RE.sub(" ", text.lower()).split())
+
+
+def content_tokens(key: str) -> FrozenSet[str]:
+    return frozenset(t for t in key.split() if t not in _STOP_WORDS)
+
+
+def is_cacheable(intent) -> bool:
+    """Only cache well-formed device intents, never errors or free-form answers."""
+    return (
+        isinstance(intent, dict)
+        and intent.get("action") in _VALID_ACTIONS
+        and isinstance(intent.get("device_type"), str)
+        and bool(intent["device_type"].strip())
+    )
+
+
+class _Entry(NamedTuple):
+    intent: Dict
+    created_at: datetime
+    tokens: FrozenSet[str]
+
+
+class SemanticCache:
+    """
+    Persistent cache of LLM slow-path results keyed on normalized text.
+    Exact lookups are a dict hit; on a miss an optional fuzzy pass compares
+    content words (stop words removed, on/off must agree) against the entries
+    sharing enough of them, found through a word -> keys index.
+    Entries live in memory as an LRU and are written through to the
+    IntentCache table so they survive restarts.
+    Thread-safe: AIService runs in the threadpool.
+    """
+
+    def __init__(self, engine=None, max_entries: int = MAX_ENTRIES, ttl: timedelta = TTL,
+                 fuzzy_threshold: Optional[float] = FUZZY_THRESHOLD):
+        self.engine = engine
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fuzzy_threshold = fuzzy_threshold
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Content word -> keys of the entries containing it, for the fuzzy pass
+        self._postings: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._loaded = engine is None
+
+        # Stats
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.slow_path_calls = 0  # LLM answers passed to put(): misses the classifier didn't resolve
+        self._slow_path_seconds = 0.0
+
+    # --- Persistence ---
+
+    def load(self):
+        """Loads unexpired entries from SQLite (newest first, up to max_entries)."""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            cutoff = datetime.utcnow() - self.ttl
+            try:
+                with Session(self.engine) as session:
+                    session.exec(delete(IntentCache).where(IntentCache.created_at < cutoff))
+                    session.commit()
+                    rows = session.exec(
+                        select(IntentCache).order_by(IntentCache.created_at.desc()).limit(self.max_entries)
+                    ).all()
+            except SQLAlchemyError as e:
+                logger.error("Semantic cache load failed: %s", e)
+                return
+            # Oldest first so the newest end up most-recently-used
+            for row in reversed(rows):
+                try:
+                    intent = json.loads(row.intent)
+                except ValueError:
+                    continue
+                self._add(row.key, _Entry(intent, row.created_at, content_tokens(row.key)))
+
+    # --- In-memory entries (call with the lock held) ---
+
+    def _add(self, key: str, entry: _Entry):
+        if key in self._entries:
+            self._discard(key)
+        self._entries[key] = entry
+        for token in entry.tokens:
+            self._postings.setdefault(token, set()).add(key)
+
+    def _discard(self, key: str):
+        entry = self._entries.pop(key)
+        for token in entry.tokens:
+            keys = self._postings[token]
+            keys.discard(key)
+            if not keys:
+                del self._postings[token]
+
+    def _persist(self, key: str, entry: _Entry, evicted):
+        if self.engine is None:
+            return
+        try:
+            with Session(self.engine) as session:
+                session.merge(IntentCache(key=key, intent=json.dumps(entry.intent),
+                                          created_at=entry.created_at))
+                if evicted:
+                    session.exec(delete(IntentCache).where(IntentCache.key.in_(evicted)))
+                session.commit()
+        except SQLAlchemyError as e:
+            logger.error("Semantic cache write failed: %s", e)
+
+    # --- Lookup ---
+
+    def get(self, text: str, fuzzy: bool = True) -> Optional[Dict]:
+        """Cached intent for text. fuzzy=False only accepts the same phrasing."""
+        if not self._loaded:
+            self.load()
+        key = normalize_key(text)
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.created_at > self.ttl:
+                self._discard(key)
+                entry = None
+            if entry is None and fuzzy and self.fuzzy_threshold is not None:
+                key, entry = self._fuzzy_lookup(key, now)
+                if entry is not None:
+                    self.fuzzy_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry.intent)
+
+    def _fuzzy_lookup(self, key: str, now: datetime):
+        tokens = content_tokens(key)
+        if not tokens:
+            return None, None
+        polarity = tokens & _POLARITY_WORDS
+        # A match shares at least threshold x len(tokens) words, so it contains one
+        # of the rarest len(tokens) - that + 1: only their entries are looked at
+        shared = max(1, math.ceil(self.fuzzy_threshold * len(tokens) - 1e-9))
+        rarest = sorted(tokens, key=lambda t: len(self._postings.get(t, ())))[:len(tokens) - shared + 1]
+        candidates = set()
+        for token in rarest:
+            candidates.update(self._postings.get(token, ()))
+        scored = []
+        for candidate_key in candidates:
+            entry = self._entries[candidate_key]
+            other = entry.tokens
+            if (other & _POLARITY_WORDS) != polarity or now - entry.created_at > self.ttl:
+                continue
+            overlap = len(tokens & other) / len(tokens | other)
+            if overlap >= self.fuzzy_threshold:
+                scored.append((overlap, candidate_key, entry))
+        # Word order (SequenceMatcher) is the costly part: only for the closest few
+        scored.sort(key=lambda s: s[0], reverse=True)
+        best_key, best_entry, best_score = None, None, self.fuzzy_threshold
+        for overlap, candidate_key, entry in scored[:FUZZY_MAX_CANDIDATES]:
+            if overlap < best_score:
+                break
+            # Tie-break on word order so "kitchen lamp" beats "lamp kitchen"
+            score = (overlap + SequenceMatcher(None, key, candidate_key).ratio()) / 2
+            if score >= best_score:
+                best_key, best_entry, best_score = candidate_key, entry, score
+        return best_key, best_entry
+
+    def put(self, text: str, intent: Dict, latency: float = 0.0):
+        """Stores a slow-path result. latency is how long the LLM took (for stats)."""
+        self.slow_path_calls += 1
+        self._slow_path_seconds += latency
+        if not is_cacheable(intent):
+            return
+        if not self._loaded:
+            self.load()
+        key = normalize_key(text)
+        entry = _Entry(dict(intent), datetime.utcnow(), content_tokens(key))
+        evicted = []
+        with self._lock:
+            self._add(key, entry)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                evicted.append(oldest)
+            self.stores += 1
+        self._persist(key, entry, evicted)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        # A miss may still be answered locally (intent classifier); only the ones
+        # that reached the LLM tell what a hit saved
+        avg_latency = self._slow_path_seconds / self.slow_path_calls if self.slow_path_calls else 0.0
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+            "slow_path_calls": self.slow_path_calls,
+            "stores": self.stores,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "avg_slow_path_seconds": avg_latency,
+            "seconds_saved": self.hits * avg_latency,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._postings.clear()
+        if self.engine is not None:
+            with Session(self.engine) as session:
+                session.exec(delete(IntentCache))
+                session.commit()
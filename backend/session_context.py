@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+# Session used when a caller doesn't identify itself
+DEFAULT_SESSION = "default"
+# Most sessions kept at once; the least recently used is dropped first
+MAX_SESSIONS = 1000
+# A "Shall I turn on the Home Theater?" offer expires after this many seconds
+PENDING_OFFER_TTL = 60.0
+
+
+class SessionContextStore:
+    """
+    Conversation state per voice session (one per websocket / user), so a
+    "yes" only ever confirms the offer made to the same session.
+    Bounded by an LRU and safe to use from threadpool threads.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, offer_ttl: float = PENDING_OFFER_TTL):
+        self.max_sessions = max_sessions
+        self.offer_ttl = offer_ttl
+        # session_id -> {"pending_offer": str, "offered_at": float}
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Called as listener(session_id, offer or None) when an offer is made or taken
+        self.listeners: List[Callable[[str, Optional[str]], None]] = []
+
+    def _get(self, session_id: str) -> Optional[Dict]:
+        context = self._sessions.get(session_id)
+        if context is None:
+            return None
+        if time.monotonic() - context["offered_at"] > self.offer_ttl:
+            # Stale offer: nobody answered in time
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        return context
+
+    def set_offer(self, session_id: str, command: str):
+        self.replace(session_id, command)
+        self._notify(session_id, command)
+
+    def replace(self, session_id: str, command: Optional[str]):
+        """Sets (or with None, drops) a session's offer without notifying listeners."""
+        with self._lock:
+            if command is None:
+                self._sessions.pop(session_id, None)
+                return
+            self._sessions[session_id] = {"pending_offer": command, "offered_at": time.monotonic()}
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def _notify(self, session_id: str, command: Optional[str]):
+        for listener in self.listeners:
+            listener(session_id, command)
+
+    def get_offer(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            context = self._get(session_id)
+            return context["pending_offer"] if context else None
+
+    def pop_offer(self, session_id: str) -> Optional[str]:
+        """Removes and returns the pending offer; None if it expired or another thread took it."""
+        with self._lock:
+            context = self._get(session_id)
+            if context is None:
+                return None
+            del self._sessions[session_id]
+        self._notify(session_id, None)
+        return context["pending_offer"]
+
+    def clear(self, session_id: str):
+        with self._lock:
+            context = self._sessions.pop(session_id, None)
+        if context is not None:
+            self._notify(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Set
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, insert
+from sqlmodel import Session, select, update
+
+from models import Device, DeviceLog
+
+# Most events written in one transaction
+BATCH_SIZE = 500
+# Events buffered before new ones are dropped (the DB is far behind)
+MAX_PENDING_EVENTS = 50_000
+
+logger = logging.getLogger("smart_home.state_store")
+
+
+class StateEvent(NamedTuple):
+    device_type: str
+    state: str  # "on" | "off"
+    timestamp: datetime
+
+
+class StateWriter:
+    """
+    Write-behind persistence for device state changes.
+    record() only enqueues, so the event loop never waits on SQLite. A
+    background task drains the queue and writes each batch (DeviceLog rows
+    plus Device.status) in one transaction from the threadpool. While a batch
+    is being committed the next one accumulates, so throughput grows with load.
+    """
+
+    def __init__(self, engine, batch_size: int = BATCH_SIZE, max_pending: int = MAX_PENDING_EVENTS):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+        # Called as hook(session, batch) inside each batch's transaction, before the commit
+        self.batch_hooks: List[Callable[[Session, List[StateEvent]], None]] = []
+        # Called with the set of device types after each batch is committed
+        self.flush_listeners: List[Callable[[Set[str]], None]] = []
+
+        # Stats
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.lost = 0
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Writes whatever is still queued, then stops the drain task."""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def flush(self):
+        if self._queue is not None:
+            await self._queue.join()
+
+    def record(self, device_type: str, state: str):
+        """State-change listener for ConnectionManager. Never blocks."""
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait(StateEvent(device_type, state, datetime.utcnow()))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            # Any failure costs this batch only: the task must keep draining, or flush() never returns
+            try:
+                await run_in_threadpool(self._write_batch, batch)
+            except Exception:
+                self.lost += len(batch)
+                logger.exception("State write failed, %d events lost", len(batch))
+            else:
+                self.written += len(batch)
+                self.batches += 1
+                device_types = {e.device_type for e in batch}
+                for listener in self.flush_listeners:
+                    try:
+                        listener(device_types)
+                    except Exception:
+                        logger.exception("State flush listener failed")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch: List[StateEvent]):
+        with Session(self.engine) as session:
+            # Core executemany insert: far cheaper than building ORM objects
+            session.execute(insert(DeviceLog), [
+                {"device_type": e.device_type, "action": f"turned_{e.state}", "timestamp": e.timestamp}
+                for e in batch
+            ])
+            # Only the last state per device type matters for the Device rows
+            latest = {e.device_type: e.state for e in batch}
+            for device_type, state in latest.items():
+                session.exec(update(Device).where(Device.type == device_type).values(status=(state == "on")))
+            for hook in self.batch_hooks:
+                hook(session, batch)
+            session.commit()
+
+    def restore_states(self) -> Dict[str, str]:
+        """Latest logged state per device type, used to rebuild device_states on startup."""
+        with Session(self.engine) as session:
+            latest_ids = select(func.max(DeviceLog.id)).group_by(DeviceLog.device_type)
+            rows = session.exec(select(DeviceLog).where(DeviceLog.id.in_(latest_ids))).all()
+        return {row.device_type: "on" if row.action == "turned_on" else "off" for row in rows}
+
+    def stats(self) -> Dict:
+        return {
+            "pending": self._queue.qsize() if self._queue else 0,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "lost": self.lost,
+        }
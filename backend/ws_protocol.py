@@ -0,0 +1,78 @@
+import json
+from typing import Dict, Iterable, Tuple, Union
+
+from fastapi import WebSocket
+
+try:
+    import msgpack  # Optional: pip install msgpack
+except ImportError:
+    msgpack = None
+
+# Wire protocols for /ws/client and /ws/device/{device_id}
+#   "text":    one "ACTION:turn_on:light" (client) / "turn_on:light" (device) frame per device.
+#              The default, so existing dashboards and firmware keep working.
+#   "compact": one JSON text frame per command / snapshot
+#   "msgpack": the same messages as binary msgpack frames
+PROTO_TEXT = "text"
+PROTO_COMPACT = "compact"
+PROTO_MSGPACK = "msgpack"
+
+# Selected with ?proto=compact or the Sec-WebSocket-Protocol header
+SUBPROTOCOLS = {
+    "smarthome.compact.v1": PROTO_COMPACT,
+    "smarthome.msgpack.v1": PROTO_MSGPACK,
+}
+
+# Compact messages: a single key naming the type, mapping device -> 1 (on) / 0 (off)
+#   {"s": {"light": 1, "fan": 0, ...}}    full state snapshot (sent to dashboards on connect)
+#   {"u": {"light": 1, "fan": 1}}         dashboard update: every device one command changed
+#   {"c": {"light": 1, "fan": 1}}         ESP32 command: set these relays
+SNAPSHOT = "s"
+UPDATE = "u"
+COMMAND = "c"
+
+Frame = Union[str, bytes]
+
+
+def negotiate(websocket: WebSocket) -> Tuple[str, str]:
+    """
+    Picks the protocol for a connecting socket.
+    Returns (protocol, subprotocol to echo in accept() or None).
+    msgpack falls back to compact JSON when the package is not installed
+    (and its subprotocol is not accepted, so the client knows).
+    """
+    subprotocol = None
+    protocol = websocket.query_params.get("proto", PROTO_TEXT)
+    offered = websocket.headers.get("sec-websocket-protocol", "")
+    for name in (p.strip() for p in offered.split(",")):
+        if name in SUBPROTOCOLS and not (SUBPROTOCOLS[name] == PROTO_MSGPACK and msgpack is None):
+            subprotocol, protocol = name, SUBPROTOCOLS[name]
+            break
+
+    if protocol == PROTO_MSGPACK and msgpack is None:
+        protocol = PROTO_COMPACT
+    if protocol not in (PROTO_COMPACT, PROTO_MSGPACK):
+        protocol = PROTO_TEXT
+    return protocol, subprotocol
+
+
+def encode(message: Dict, protocol: str) -> Frame:
+    """Serializes a compact message: bytes for msgpack, str otherwise."""
+    if protocol == PROTO_MSGPACK:
+        return msgpack.packb(message)
+    return json.dumps(message, separators=(",", ":"))
+
+
+def state_message(kind: str, states: Dict[str, str]) -> Dict:
+    return {kind: {device: 1 if state == "on" else 0 for device, state in states.items()}}
+
+
+def command_message(action: str, devices: Iterable[str]) -> Dict:
+    value = 1 if action == "turn_on" else 0
+    return {COMMAND: {device: value for device in devices}}
+
+
+def client_text_frames(states: Dict[str, str]) -> list:
+    """The legacy dashboard frames for the same states: one ACTION frame per device."""
+    return [f"ACTION:{'turn_on' if state == 'on' else 'turn_off'}:{device}"
+            for device, state in states.items()]